@@ -0,0 +1,198 @@
+import heapq
+import threading
+from array import array
+from typing import Dict, List, Optional, Callable, Iterable, Set
+
+from bitfield import Bitfield
+
+
+class AvailabilityIndex:
+    """
+    Índice incremental de disponibilidade para a seleção Rarest First.
+
+    Mantém, para cada bloco, quantos peers conhecidos o possuem, e agrupa os
+    blocos que ainda faltam em baldes por número de réplicas (balde 1 = só um
+    peer tem o bloco). Anúncios HAVE, a chegada de um bitfield completo, a
+    saída de um peer e cada bloco salvo localmente atualizam o índice em O(1)
+    por bloco, sem recontar tudo a cada decisão.
+    """
+
+    def __init__(self, total_blocks: int = 0, my_blocks: Optional[Bitfield] = None):
+        self.lock = threading.RLock()
+        self.total_blocks = total_blocks
+        self.counts = array("I", bytes(4 * total_blocks))  # Réplicas de cada bloco entre os peers
+        self.buckets: List[Set[int]] = [set()]  # buckets[c] = blocos que faltam e têm c réplicas
+        self.my_blocks = my_blocks.copy() if my_blocks is not None else Bitfield(total_blocks)
+        self.peers: Dict[str, Bitfield] = {}  # Cópia do bitfield de cada peer
+        self.interesting: Dict[str, int] = {}  # Blocos que o peer tem e nós não
+
+    @classmethod
+    def from_map(cls, peer_block_map: Dict[str, Iterable[int]], my_blocks: Iterable[int]) -> "AvailabilityIndex":
+        # Monta um índice a partir de um mapa peer -> blocos (útil para consultas avulsas)
+        mine = my_blocks if isinstance(my_blocks, Bitfield) else Bitfield.from_iterable(my_blocks)
+        index = cls(mine.size, mine)
+        for peer, blocks in peer_block_map.items():
+            index.set_peer(peer, blocks if isinstance(blocks, Bitfield) else Bitfield.from_iterable(blocks))
+        return index
+
+    # ----------------------
+    # Atualizações
+    # ----------------------
+
+    def _ensure(self, block_id: int) -> None:
+        # Amplia o vetor de contagens quando aparece um bloco além do tamanho conhecido
+        if block_id >= len(self.counts):
+            self.counts.extend([0] * (block_id + 1 - len(self.counts)))
+            self.total_blocks = len(self.counts)
+
+    def _leave_bucket(self, count: int, block_id: int) -> None:
+        bucket = self.buckets[count]
+        bucket.discard(block_id)
+        if not bucket and count:
+            # Um set não encolhe após remoções; recriar evita varrer uma tabela vazia e enorme
+            self.buckets[count] = set()
+
+    def _increment(self, block_id: int) -> None:
+        counts = self.counts
+        if block_id >= len(counts):
+            self._ensure(block_id)
+            counts = self.counts
+        count = counts[block_id]
+        counts[block_id] = count + 1
+        if block_id not in self.my_blocks:
+            if count + 1 >= len(self.buckets):
+                self.buckets.append(set())
+            if count:
+                self._leave_bucket(count, block_id)
+            self.buckets[count + 1].add(block_id)
+
+    def _decrement(self, block_id: int) -> None:
+        count = self.counts[block_id]
+        if count == 0:
+            return
+        self.counts[block_id] = count - 1
+        if block_id not in self.my_blocks:
+            self._leave_bucket(count, block_id)
+            if count - 1 > 0:
+                self.buckets[count - 1].add(block_id)
+
+    def set_peer(self, peer: str, blocks: Bitfield) -> None:
+        """
+        Registra (ou substitui) o bitfield completo de um peer.
+        """
+        with self.lock:
+            self.remove_peer(peer)
+            own = blocks.copy()
+            self.peers[peer] = own
+            for block_id in own:
+                self._increment(block_id)
+            self.interesting[peer] = own.difference_count(self.my_blocks)
+
+    def peer_has(self, peer: str, block_id: int) -> None:
+        """
+        Aplica um anúncio HAVE: o peer passou a ter o bloco.
+        """
+        with self.lock:
+            blocks = self.peers.get(peer)
+            if blocks is None:
+                blocks = self.peers[peer] = Bitfield(self.total_blocks)
+                self.interesting[peer] = 0
+            if block_id in blocks:
+                return
+            blocks.add(block_id)
+            self._increment(block_id)
+            if block_id not in self.my_blocks:
+                self.interesting[peer] += 1
+
+    def remove_peer(self, peer: str) -> None:
+        """
+        Remove um peer que saiu (conexão encerrada), descontando suas réplicas.
+        """
+        with self.lock:
+            blocks = self.peers.pop(peer, None)
+            self.interesting.pop(peer, None)
+            if blocks is not None:
+                for block_id in blocks:
+                    self._decrement(block_id)
+
+    def mark_local(self, block_id: int) -> None:
+        """
+        Registra que obtivemos o bloco: ele sai dos baldes e deixa de ser interessante.
+        """
+        with self.lock:
+            if block_id in self.my_blocks:
+                return
+            self._ensure(block_id)
+            self.my_blocks.add(block_id)
+            if self.counts[block_id]:
+                self._leave_bucket(self.counts[block_id], block_id)
+                for peer, blocks in self.peers.items():
+                    if block_id in blocks:
+                        self.interesting[peer] -= 1
+
+    # ----------------------
+    # Consultas
+    # ----------------------
+
+    def has_peer(self, peer: str) -> bool:
+        return peer in self.peers
+
+    def holders(self, block_id: int) -> List[str]:
+        # Peers que possuem o bloco
+        with self.lock:
+            return [peer for peer, blocks in self.peers.items() if block_id in blocks]
+
+    def peer_holds(self, peer: str, block_id: int) -> bool:
+        # O peer anunciou o bloco (bitfield inicial ou HAVE)
+        blocks = self.peers.get(peer)
+        return blocks is not None and block_id in blocks
+
+    def interesting_count(self, peer: str) -> int:
+        # Quantos blocos úteis (que nos faltam) o peer possui
+        return self.interesting.get(peer, 0)
+
+    def missing_count(self) -> int:
+        # Quantos blocos ainda faltam para completar o arquivo
+        return self.total_blocks - len(self.my_blocks)
+
+    def rarest(self, n: Optional[int] = None) -> List[int]:
+        """
+        Retorna os blocos que faltam, do mais raro para o mais comum (até n).
+        """
+        with self.lock:
+            result = []
+            for bucket in self.buckets[1:]:
+                for block_id in bucket:
+                    result.append(block_id)
+                    if n is not None and len(result) >= n:
+                        return result
+            return result
+
+    def rarest_for_peer(self, peer: str, n: int, skip: Optional[Callable[[int], bool]] = None) -> List[int]:
+        """
+        Retorna até n blocos que nos faltam e que o peer possui, do mais raro
+        para o mais comum. `skip` permite ignorar blocos (ex.: já em andamento).
+        """
+        with self.lock:
+            blocks = self.peers.get(peer)
+            useful = self.interesting.get(peer, 0)
+            if blocks is None or not useful:
+                return []
+            tracked = sum(len(bucket) for bucket in self.buckets[1:])
+            # Percorrer os baldes custa ~n * tracked / useful; percorrer os blocos do peer custa ~useful
+            if n * tracked > useful * useful:
+                # Peer com poucos blocos úteis: mais barato percorrer os blocos dele do que os baldes
+                counts = self.counts
+                candidates = (
+                    (counts[block_id], block_id) for block_id in blocks - self.my_blocks
+                    if skip is None or not skip(block_id)
+                )
+                return [block_id for _, block_id in heapq.nsmallest(n, candidates)]
+            result = []
+            for bucket in self.buckets[1:]:
+                for block_id in bucket:
+                    if block_id in blocks and (skip is None or not skip(block_id)):
+                        result.append(block_id)
+                        if len(result) >= n:
+                            return result
+            return result
@@ -0,0 +1,315 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+from file_manager import split_and_distribute
+
+# -------- BENCHMARK DO SWARM EM LOOPBACK --------
+# Uso: python benchmark.py --size 8M --block-size 64K --peers 8 --runs 3 --output resultado.json
+# Sobe um tracker e N peers como subprocessos em 127.0.0.1 (sem terminal gráfico), mede
+# quanto tempo leva até todos terem o arquivo e grava os resultados em JSON.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+POLL_INTERVAL = 0.1   # Intervalo (s) entre as consultas às métricas dos peers
+STARTUP_TIMEOUT = 10  # Tempo limite (s) para o tracker começar a responder
+VERIFY_GRACE = 10     # Tempo limite (s) para os arquivos reconstruídos conferirem com o original
+TEXT_WORDS = 2000     # Vocabulário do arquivo sintético de texto (--content text)
+
+
+def parse_size(text: str) -> int:
+    # "64K", "8M", "1G" ou um número de bytes
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_file(path: str, size: int, seed: int, text: bool = False) -> str:
+    # Arquivo sintético reproduzível (mesma semente = mesmo conteúdo); retorna o SHA-256.
+    # Com `text`, palavras sorteadas de um vocabulário pequeno (conteúdo compressível, como historia.txt)
+    rng = random.Random(seed)
+    words = [bytes(rng.choices(b"abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 9))) for _ in range(TEXT_WORDS)]
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining:
+            length = min(remaining, 1024 * 1024)
+            if text:
+                chunk = b" ".join(rng.choices(words, k=length // 4))[:length].ljust(length, b".")
+            else:
+                chunk = rng.randbytes(length)
+            f.write(chunk)
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scrape(port: int) -> Optional[Dict[str, float]]:
+    """
+    Lê o endpoint de métricas (formato texto do Prometheus) e retorna
+    {série com rótulos: valor}; None se o processo ainda não responde.
+    """
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2) as response:
+            text = response.read().decode()
+    except OSError:
+        return None
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            series, _, value = line.rpartition(" ")
+            samples[series] = float(value)
+    return samples
+
+
+def metric_total(samples: Optional[Dict[str, float]], name: str) -> float:
+    # Soma todas as séries de uma métrica (todos os rótulos)
+    if not samples:
+        return 0.0
+    return sum(value for series, value in samples.items() if series == name or series.startswith(name + "{"))
+
+
+class Process:
+    """
+    Subprocesso do benchmark (tracker ou peer) com a saída em um arquivo de log.
+    Ao terminar, o uso de CPU e o pico de memória vêm do wait4 do próprio processo.
+    """
+
+    def __init__(self, name: str, args: List[str], cwd: str, metrics_port: int):
+        self.name = name
+        self.metrics_port = metrics_port
+        self.log = open(os.path.join(cwd, f"{name}.log"), "wb")
+        self.popen = subprocess.Popen([sys.executable, *args], cwd=cwd, stdout=self.log, stderr=subprocess.STDOUT)
+        self.usage = None
+
+    def stop(self) -> Dict[str, float]:
+        if self.popen.poll() is None:
+            self.popen.send_signal(signal.SIGTERM)
+        try:
+            _, _, usage = os.wait4(self.popen.pid, 0)
+            self.popen.returncode = 0  # Já coletado pelo wait4
+            self.usage = usage
+        except ChildProcessError:
+            pass
+        self.log.close()
+        if self.usage is None:
+            return {}
+        return {
+            "cpu_seconds": round(self.usage.ru_utime + self.usage.ru_stime, 3),
+            "max_rss_kb": self.usage.ru_maxrss,  # KB no Linux
+        }
+
+
+def run_once(workdir: str, args, run_index: int) -> dict:
+    """
+    Uma execução completa: prepara os peers, sobe tracker e peers e espera
+    todos completarem o arquivo (ou o tempo limite).
+    """
+    seed = args.seed + run_index
+    source = os.path.join(workdir, "source.bin")
+    expected = make_file(source, args.size, seed, args.content == "text")
+    total_blocks = split_and_distribute(source, os.path.join(workdir, "peers"), block_size=args.block_size,
+                                        num_peers=args.peers, replication=args.replication, seed=seed)
+
+    tracker_port, tracker_metrics = free_port(), free_port()
+    tracker = Process("tracker", [os.path.join(HERE, "tracker_server.py"), "--port", str(tracker_port),
+                                  "--metrics-port", str(tracker_metrics)], workdir, tracker_metrics)
+    processes = [tracker]
+    peers: List[Process] = []
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while scrape(tracker_metrics) is None:
+            if time.monotonic() > deadline or tracker.popen.poll() is not None:
+                raise RuntimeError("O tracker não respondeu (veja tracker.log)")
+            time.sleep(POLL_INTERVAL)
+
+        started = time.monotonic()
+        tracker_start = scrape(tracker_metrics)
+        for i in range(1, args.peers + 1):
+            port = free_port()
+            peer = Process(f"peer_{i}", [os.path.join(HERE, "peer.py"), f"peer_{i}", "--tracker",
+                                         f"127.0.0.1:{tracker_port}", "--metrics-port", str(port),
+                                         "--compression", args.compression], workdir, port)
+            peers.append(peer)
+            processes.append(peer)
+
+        # Acompanha os blocos que faltam em cada peer até todos completarem
+        completed_at: Dict[str, float] = {}
+        last_samples: Dict[str, Dict[str, float]] = {}
+        while len(completed_at) < len(peers) and time.monotonic() - started < args.timeout:
+            time.sleep(POLL_INTERVAL)
+            for peer in peers:
+                if peer.name in completed_at:
+                    continue
+                samples = scrape(peer.metrics_port)
+                if samples is None:
+                    continue
+                last_samples[peer.name] = samples
+                missing = [value for series, value in samples.items() if series.startswith("p2p_missing_blocks{")]
+                if missing and not any(missing):
+                    completed_at[peer.name] = time.monotonic() - started
+        elapsed = time.monotonic() - started
+
+        # O arquivo de saída é concluído logo depois do último bloco: espera um pouco antes de conferi-lo
+        outputs = {peer.name: os.path.join(workdir, "reconstruidos", f"{peer.name}_reconstruido.txt") for peer in peers}
+        verified = set()
+        deadline = time.monotonic() + VERIFY_GRACE
+        while len(verified) < len(completed_at) and time.monotonic() < deadline:
+            verified.update(name for name in completed_at
+                            if name not in verified and file_digest(outputs[name]) == expected)
+            time.sleep(POLL_INTERVAL)
+
+        # Métricas finais (os contadores só crescem: a última leitura vale para a execução inteira)
+        for peer in peers:
+            samples = scrape(peer.metrics_port)
+            if samples is not None:
+                last_samples[peer.name] = samples
+        tracker_end = scrape(tracker_metrics) or {}
+    finally:
+        usage = {process.name: process.stop() for process in reversed(processes)}
+
+    peer_results = {}
+    for peer in peers:
+        samples = last_samples.get(peer.name)
+        downloaded = metric_total(samples, "p2p_download_bytes_total")
+        duration = completed_at.get(peer.name)
+        peer_results[peer.name] = {
+            "completed": duration is not None,
+            "completion_seconds": round(duration, 3) if duration is not None else None,
+            "verified": peer.name in verified,
+            "downloaded_bytes": int(downloaded),
+            "uploaded_bytes": int(metric_total(samples, "p2p_upload_bytes_total")),
+            "download_bytes_per_sec": round(downloaded / duration, 1) if duration else None,
+            "cache_hits": int(metric_total(samples, "p2p_cache_hits_total")),
+            "cache_misses": int(metric_total(samples, "p2p_cache_misses_total")),
+            **usage.get(peer.name, {}),
+        }
+
+    def tracker_delta(name: str) -> float:
+        return metric_total(tracker_end, name) - metric_total(tracker_start, name)
+    announces = tracker_delta("tracker_announces_total")
+    peer_requests = tracker_delta("tracker_peer_requests_total")
+    distribution = max(completed_at.values()) if len(completed_at) == len(peers) else None
+    return {
+        "run": run_index,
+        "seed": seed,
+        "total_blocks": total_blocks,
+        "completed": distribution is not None and all(p["verified"] for p in peer_results.values()),
+        "distribution_seconds": round(distribution, 3) if distribution is not None else None,
+        "aggregate_bytes_per_sec": round(sum(p["downloaded_bytes"] for p in peer_results.values()) / elapsed, 1),
+        "peers": peer_results,
+        "tracker": {
+            "announces": int(announces),
+            "peer_requests": int(peer_requests),
+            "announces_per_sec": round(announces / elapsed, 2),
+            "requests_per_sec": round((announces + peer_requests) / elapsed, 2),
+            **usage.get("tracker", {}),
+        },
+        "cpu_seconds": round(sum(u.get("cpu_seconds", 0) for u in usage.values()), 3),
+        "max_rss_kb": max((u.get("max_rss_kb", 0) for u in usage.values()), default=0),
+    }
+
+
+def summarize(runs: List[dict]) -> dict:
+    # Mediana e extremos das execuções completas
+    times = [run["distribution_seconds"] for run in runs if run["completed"]]
+    rates = [run["aggregate_bytes_per_sec"] for run in runs if run["completed"]]
+    if not times:
+        return {"completed_runs": 0}
+    return {
+        "completed_runs": len(times),
+        "distribution_seconds": {"median": statistics.median(times), "min": min(times), "max": max(times)},
+        "aggregate_bytes_per_sec": {"median": statistics.median(rates), "min": min(rates), "max": max(rates)},
+        "cpu_seconds_median": statistics.median(run["cpu_seconds"] for run in runs if run["completed"]),
+        "max_rss_kb": max(run["max_rss_kb"] for run in runs),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark do swarm em loopback (tracker + N peers)")
+    parser.add_argument("--size", type=parse_size, default=parse_size("4M"), help="tamanho do arquivo sintético (ex.: 64M)")
+    parser.add_argument("--block-size", type=parse_size, default=parse_size("64K"), help="tamanho do bloco (ex.: 256K)")
+    parser.add_argument("--peers", type=int, default=5, help="número de peers")
+    parser.add_argument("--replication", type=int, default=None, help="cópias de cada bloco na distribuição inicial")
+    parser.add_argument("--content", choices=("random", "text"), default="random",
+                        help="conteúdo do arquivo: bytes aleatórios (incompressível) ou texto")
+    parser.add_argument("--compression", default="none", metavar="CODEC[:NÍVEL]",
+                        help="compressão usada pelos peers (none, zlib, lzma; ex.: zlib:6)")
+    parser.add_argument("--runs", type=int, default=1, help="execuções (a semente muda a cada uma)")
+    parser.add_argument("--seed", type=int, default=1, help="semente do arquivo e da distribuição dos blocos")
+    parser.add_argument("--timeout", type=float, default=120, help="tempo limite (s) de cada execução")
+    parser.add_argument("--output", default="benchmark.json", help="arquivo JSON com os resultados")
+    parser.add_argument("--keep", action="store_true", help="mantém os diretórios temporários (logs dos peers)")
+    args = parser.parse_args()
+
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "keep")},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "revision": git_revision(),
+        },
+        "runs": [],
+    }
+    for run_index in range(args.runs):
+        workdir = tempfile.mkdtemp(prefix="minibit-bench-")
+        try:
+            run = run_once(workdir, args, run_index)
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+        if args.keep:
+            run["workdir"] = workdir
+        results["runs"].append(run)
+        status = f"{run['distribution_seconds']}s" if run["completed"] else "INCOMPLETA"
+        print(f"[BENCH] Execução {run_index + 1}/{args.runs}: {status}, "
+              f"{run['aggregate_bytes_per_sec'] / 1024:.1f} KB/s agregados, CPU {run['cpu_seconds']}s")
+    results["summary"] = summarize(results["runs"])
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[BENCH] Resultados gravados em {args.output}")
+    return 0 if results["summary"]["completed_runs"] == args.runs else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
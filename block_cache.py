@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Dict
+
+CACHE_BYTES = 64 * 1024 * 1024  # Orçamento padrão de memória do cache (64 MB)
+POLICY_LRU = "lru"    # Descarta sempre o bloco usado há mais tempo
+POLICY_SLRU = "slru"  # LRU segmentado: blocos acessados mais de uma vez ficam protegidos
+PROTECTED_RATIO = 0.8  # Fração do orçamento reservada ao segmento protegido (SLRU)
+
+
+class BlockCache:
+    """
+    Cache de blocos em memória limitado por bytes.
+
+    As chaves são tuplas (namespace, id do bloco), de modo que um mesmo cache
+    pode ser compartilhado por vários arquivos. Na política SLRU, um bloco
+    entra no segmento de prova e só passa ao segmento protegido quando é lido
+    de novo; assim, blocos raros pedidos repetidamente sobrevivem a uma
+    varredura sequencial (ex.: read-ahead ou reconstrução do arquivo).
+    Contadores de acertos, faltas e descartes permitem dimensionar o orçamento.
+    """
+
+    def __init__(self, capacity_bytes: int = CACHE_BYTES, policy: str = POLICY_SLRU):
+        if policy not in (POLICY_LRU, POLICY_SLRU):
+            raise ValueError(f"Política de cache desconhecida: {policy}")
+        self.capacity_bytes = capacity_bytes
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.probation: "OrderedDict[Hashable, bytes]" = OrderedDict()  # Único segmento na política LRU
+        self.protected: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self.probation_bytes = 0
+        self.protected_bytes = 0
+        self.protected_capacity = int(capacity_bytes * PROTECTED_RATIO) if policy == POLICY_SLRU else 0
+
+        # Contadores
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    # ----------------------
+    # Acesso
+    # ----------------------
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self.lock:
+            data = self.protected.get(key)
+            if data is not None:
+                self.protected.move_to_end(key)
+                self.hits += 1
+                return data
+            data = self.probation.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self.policy == POLICY_SLRU:
+                # Segundo acesso: promove ao segmento protegido
+                del self.probation[key]
+                self.probation_bytes -= len(data)
+                self._protect(key, data)
+            else:
+                self.probation.move_to_end(key)
+            return data
+
+    def put(self, key: Hashable, data: bytes) -> None:
+        # Insere (ou substitui) um bloco no segmento de prova e descarta o excedente
+        size = len(data)
+        if size > self.capacity_bytes:
+            return
+        with self.lock:
+            self._remove(key)
+            self.probation[key] = data
+            self.probation_bytes += size
+            self._evict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        # Consulta sem alterar a ordem nem os contadores
+        return key in self.protected or key in self.probation
+
+    def discard(self, key: Hashable) -> None:
+        with self.lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.probation.clear()
+            self.protected.clear()
+            self.probation_bytes = self.protected_bytes = 0
+
+    # ----------------------
+    # Manutenção interna
+    # ----------------------
+
+    def _remove(self, key: Hashable) -> None:
+        data = self.probation.pop(key, None)
+        if data is not None:
+            self.probation_bytes -= len(data)
+        data = self.protected.pop(key, None)
+        if data is not None:
+            self.protected_bytes -= len(data)
+
+    def _protect(self, key: Hashable, data: bytes) -> None:
+        self.protected[key] = data
+        self.protected_bytes += len(data)
+        # Segmento protegido cheio: os mais antigos voltam para o segmento de prova (como recém-usados)
+        while self.protected_bytes > self.protected_capacity and self.protected:
+            old_key, old_data = self.protected.popitem(last=False)
+            self.protected_bytes -= len(old_data)
+            self.probation[old_key] = old_data
+            self.probation_bytes += len(old_data)
+        self._evict()
+
+    def _evict(self) -> None:
+        # Descarta do segmento de prova (do menos recente) até caber no orçamento
+        while self.probation_bytes + self.protected_bytes > self.capacity_bytes and self.probation:
+            _, data = self.probation.popitem(last=False)
+            self.probation_bytes -= len(data)
+            self.evictions += 1
+            self.evicted_bytes += len(data)
+
+    # ----------------------
+    # Estatísticas
+    # ----------------------
+
+    @property
+    def size_bytes(self) -> int:
+        return self.probation_bytes + self.protected_bytes
+
+    def __len__(self) -> int:
+        return len(self.probation) + len(self.protected)
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            return {
+                "policy": self.policy,
+                "capacity_bytes": self.capacity_bytes,
+                "size_bytes": self.size_bytes,
+                "entries": len(self),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hit_ratio(),
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+            }
@@ -0,0 +1,101 @@
+import lzma
+import zlib
+from typing import Iterable, Tuple
+
+# Codecs de compressão dos blocos. O número de cada codec vai no campo de
+# flags dos quadros: no HANDSHAKE do cliente, um bit por codec aceito
+# (1 << codec); na resposta do servidor e em cada BLOCK/SUBBLOCK, o codec
+# usado (0 = dados sem compressão).
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODECS = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "lzma": CODEC_LZMA}
+CODEC_NAMES = {codec: name for name, codec in CODECS.items()}
+SUPPORTED_CODECS = (CODEC_ZLIB, CODEC_LZMA)  # Oferecidos por padrão no HANDSHAKE
+
+DEFAULT_LEVELS = {CODEC_NONE: 0, CODEC_ZLIB: 6, CODEC_LZMA: 6}
+MIN_SAVING = 0.05  # Fração mínima economizada para valer a descompressão; abaixo disso o bloco vai sem compressão
+MAX_DECOMPRESSED = 64 * 1024 * 1024  # Limite de segurança para um bloco descomprimido
+
+
+class CompressionError(ValueError):
+    """Payload comprimido inválido ou que descomprime além do limite."""
+
+
+def parse_codec(text: str) -> Tuple[int, int]:
+    """
+    Interpreta "codec[:nível]" (ex.: "zlib", "zlib:9", "lzma:3", "none")
+    e retorna (codec, nível).
+    """
+    name, _, level = text.partition(":")
+    codec = CODECS.get(name.strip().lower())
+    if codec is None:
+        raise ValueError(f"Codec desconhecido: {name} (use {', '.join(CODECS)})")
+    if not level:
+        return codec, DEFAULT_LEVELS[codec]
+    level = int(level)
+    if not 0 <= level <= 9:
+        raise ValueError(f"Nível inválido para {name}: {level} (use 0 a 9)")
+    return codec, level
+
+
+def codec_mask(codecs: Iterable[int]) -> int:
+    # Flags do HANDSHAKE do cliente: um bit por codec aceito
+    mask = 0
+    for codec in codecs:
+        if codec != CODEC_NONE:
+            mask |= 1 << codec
+    return mask
+
+
+def choose_codec(mask: int, preferred: int) -> int:
+    # O servidor só comprime com o seu codec se o cliente o tiver oferecido
+    if preferred != CODEC_NONE and mask & (1 << preferred):
+        return preferred
+    return CODEC_NONE
+
+
+def compress(codec: int, data: bytes, level: int) -> bytes:
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, level)
+    if codec == CODEC_LZMA:
+        # Formato "alone": cabeçalho de 13 bytes, contra ~60 do .xz (faz diferença em blocos pequenos)
+        return lzma.compress(data, format=lzma.FORMAT_ALONE, preset=level)
+    raise ValueError(f"Codec desconhecido: {codec}")
+
+
+def decompress(codec: int, data: bytes, max_size: int = MAX_DECOMPRESSED) -> bytes:
+    """
+    Descomprime um payload recebido. Lança CompressionError se os dados
+    forem inválidos ou passarem de `max_size` bytes.
+    """
+    # Pede um byte além do limite: passar dele é erro (e max_length=0 no zlib seria "sem limite")
+    try:
+        if codec == CODEC_ZLIB:
+            decompressor = zlib.decompressobj()
+            result = decompressor.decompress(data, max_size + 1)
+            complete = decompressor.eof and not decompressor.unconsumed_tail
+        elif codec == CODEC_LZMA:
+            decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_ALONE)
+            result = decompressor.decompress(data, max_size + 1)
+            complete = decompressor.eof
+        else:
+            raise CompressionError(f"Codec desconhecido: {codec}")
+    except (zlib.error, lzma.LZMAError) as e:
+        raise CompressionError(f"Payload comprimido inválido: {e}")
+    if not complete or len(result) > max_size:
+        raise CompressionError(f"Payload comprimido truncado ou maior que {max_size} bytes")
+    return result
+
+
+def pack(codec: int, data: bytes, level: int) -> Tuple[bytes, int]:
+    """
+    Comprime `data` e retorna (payload, codec usado): se a compressão não
+    economizar ao menos MIN_SAVING, retorna os dados originais com CODEC_NONE.
+    """
+    if codec == CODEC_NONE or not data:
+        return data, CODEC_NONE
+    packed = compress(codec, data, level)
+    if len(packed) > len(data) * (1 - MIN_SAVING):
+        return data, CODEC_NONE
+    return packed, codec
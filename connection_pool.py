@@ -0,0 +1,472 @@
+import socket
+import threading
+import logging
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Dict, Iterable, Set, Tuple, Optional, Callable
+
+from bitfield import Bitfield
+from compression import CODEC_NONE, MAX_DECOMPRESSED, SUPPORTED_CODECS, CompressionError, codec_mask, decompress
+from protocol import (
+    build_get, build_list, build_handshake, build_cancel, parse_message, parse_handshake, parse_blocks_list, recv_frame,
+    parse_flags, parse_pex,
+    CMD_BLOCK, CMD_SUBBLOCK, CMD_BLOCKS, CMD_ERROR, CMD_HAVE, CMD_HANDSHAKE, CMD_CHOKE, CMD_UNCHOKE, CMD_CANCEL,
+    CMD_PEX, SUBBLOCK_OFFSET, HANDSHAKE_PEX, ProtocolError, parse_range,
+)
+from metrics import REGISTRY
+from rate import RateMeter
+
+MAX_INFLIGHT = 8        # Máximo de GETs simultâneos em uma mesma conexão
+CONNECT_TIMEOUT = 5     # Tempo limite (s) para abrir a conexão
+MAX_PEX_PEERS = 200     # Máximo de endereços recebidos por PEX guardados por conexão
+
+# Eventos repassados a on_update(conexão, evento, id do bloco)
+EVENT_HAVE = CMD_HAVE        # O peer anunciou um bloco novo
+EVENT_BITFIELD = CMD_BLOCKS  # Chegou o bitfield completo do peer
+EVENT_CLOSED = "CLOSED"      # A conexão foi encerrada
+EVENT_CHOKE = CMD_CHOKE      # O peer deixou de atender nossos pedidos
+EVENT_UNCHOKE = CMD_UNCHOKE  # O peer voltou a atender nossos pedidos
+EVENT_PEX = CMD_PEX          # O peer enviou endereços de outros peers do swarm
+
+DOWNLOAD_BYTES = REGISTRY.counter("p2p_download_bytes_total", "Bytes de blocos recebidos, por peer remoto", ["peer"])
+REQUEST_SECONDS = REGISTRY.histogram("p2p_request_duration_seconds",
+                                     "Tempo entre o envio de um pedido e a resposta", ["command"])
+GET_SECONDS = REQUEST_SECONDS.labels("GET")
+LIST_SECONDS = REQUEST_SECONDS.labels("LIST")
+
+
+def _observe_latency(future: Future, histogram) -> None:
+    # Registra a latência do pedido quando ele é respondido (falhas e cancelamentos ficam de fora)
+    started = time.monotonic()
+
+    def done(f: Future) -> None:
+        if not f.cancelled() and f.exception() is None:
+            histogram.observe(time.monotonic() - started)
+    future.add_done_callback(done)
+
+
+class PeerChokedError(ConnectionError):
+    """O peer remoto bloqueou (CHOKE) esta conexão; os pedidos voltam a valer após um UNCHOKE."""
+
+
+class RequestCancelledError(Exception):
+    """O servidor confirmou o CANCEL: o GET foi descartado antes de ser atendido."""
+
+
+class PeerConnection:
+    """
+    Conexão TCP de longa duração com um peer remoto.
+
+    Várias requisições podem ser enviadas sem esperar as respostas anteriores
+    (pipelining). Uma thread leitora recebe os quadros e entrega cada resposta
+    ao Future correspondente, casando pelo ID do bloco.
+
+    Depois do LIST inicial, o peer remoto envia HAVE a cada bloco novo; esses
+    anúncios mantêm `remote_blocks` atualizado sem novas consultas.
+
+    Com `info_hash`, a conexão começa com um HANDSHAKE que escolhe o swarm
+    (arquivo) no servidor remoto e anuncia `listen_address`, o endereço em
+    que este peer escuta; os pedidos seguem sem esperar a resposta, já que
+    o servidor processa os quadros em ordem. O HANDSHAKE também oferece os
+    `codecs` de compressão aceitos; o servidor escolhe um (ou nenhum) e marca
+    cada bloco comprimido, que é descomprimido aqui antes de chegar ao Future.
+    O HANDSHAKE também aceita PEX: o servidor passa a enviar os peers do swarm
+    que conhece, em deltas, guardados em `pex_peers`.
+
+    Um CHOKE do servidor falha os pedidos pendentes com PeerChokedError e
+    recusa novos pedidos até o UNCHOKE correspondente.
+    """
+
+    def __init__(self, host: str, port: int, max_inflight: int = MAX_INFLIGHT, timeout: float = CONNECT_TIMEOUT,
+                 on_update: Optional[Callable[["PeerConnection", str, Optional[int]], None]] = None,
+                 info_hash: Optional[bytes] = None, listen_address: Optional[Tuple[str, int]] = None,
+                 codecs: Iterable[int] = SUPPORTED_CODECS):
+        self.host = host
+        self.port = port
+        self.info_hash = info_hash
+        self.handshake_done = info_hash is None
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.settimeout(None)  # A leitura fica bloqueada na thread leitora; os prazos ficam nos Futures
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_lock = threading.Lock()   # Serializa escritas no socket
+        self.state_lock = threading.Lock()  # Protege as requisições pendentes
+        self.list_lock = threading.Lock()   # Apenas um LIST em andamento por conexão
+        self.slots = threading.BoundedSemaphore(max_inflight)
+        self.pending: Dict[Tuple[int, int], Future] = {}  # (block_id, offset) -> Future com os dados pedidos
+        self.expected_sizes: Dict[Tuple[int, int], int] = {}  # Tamanho máximo de cada resposta pendente
+        self.pending_list: Optional[Future] = None
+        self.remote_blocks = Bitfield()  # Disponibilidade do peer remoto (LIST inicial + HAVEs)
+        self.availability_known = False  # True após a resposta ao primeiro LIST
+        self.on_update = on_update  # Chamado quando a disponibilidade remota muda ou a conexão fecha
+        self.choked = False  # True entre um CHOKE e o UNCHOKE seguinte
+        self.download_rate = RateMeter()  # Bytes/s recebidos deste peer (reciprocidade do tit-for-tat)
+        self.discarded_bytes = 0  # Blocos recebidos depois que o pedido expirou ou foi cancelado localmente
+        self.received_bytes = DOWNLOAD_BYTES.labels(self.address)
+        self.codec = CODEC_NONE  # Compressão escolhida pelo servidor na resposta ao HANDSHAKE
+        self.pex_peers: Set[str] = set()  # Peers do swarm ("host:porta") conhecidos pelo servidor remoto (PEX)
+        self.closed = False
+        if info_hash is not None:
+            self.sock.sendall(build_handshake(info_hash, listen_address, codec_mask(codecs) | HANDSHAKE_PEX))
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def _send(self, data: bytes) -> None:
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def request_block(self, block_id: int, timeout: Optional[float] = None,
+                      offset: int = 0, length: Optional[int] = None,
+                      block_size: int = MAX_DECOMPRESSED) -> Future:
+        """
+        Envia um GET e retorna um Future que recebe os dados do bloco (ou, com
+        `length`, do sub-bloco que começa em `offset`). A resposta não pode
+        passar de `length` (ou, para o bloco inteiro, de `block_size`) bytes:
+        um bloco comprimido que descomprime além disso encerra a conexão.
+
+        Bloqueia enquanto todos os slots de requisição da conexão estiverem ocupados.
+        """
+        key = (block_id, offset)
+        with self.state_lock:
+            current = self.pending.get(key)
+            if current is not None and not current.done():
+                return current  # Já existe um pedido deste bloco em andamento
+        if not self.slots.acquire(timeout=timeout):
+            raise TimeoutError(f"Sem slots livres na conexão com {self.address}")
+
+        future: Future = Future()
+        future.add_done_callback(lambda _: self.slots.release())
+        _observe_latency(future, GET_SECONDS)
+        with self.state_lock:
+            if self.closed:
+                future.set_exception(ConnectionError(f"Conexão com {self.address} encerrada"))
+                return future
+            if self.choked:
+                future.set_exception(PeerChokedError(f"{self.address} bloqueou os pedidos (choke)"))
+                return future
+            self.pending[key] = future
+            self.expected_sizes[key] = length if length is not None else block_size
+        try:
+            self._send(build_get(block_id, offset, length))
+        except OSError as e:
+            self.close(e)
+        return future
+
+    def cancel_request(self, block_id: int, offset: int = 0, length: Optional[int] = None) -> bool:
+        """
+        Envia CANCEL para um GET pendente. O Future continua aberto e recebe
+        o bloco (se o servidor já o tinha enviado) ou RequestCancelledError
+        (se o pedido ainda estava na fila); de um jeito ou de outro, o slot é
+        liberado pela resposta, sem depender de tempo limite.
+        """
+        with self.state_lock:
+            if self.closed or (block_id, offset) not in self.pending:
+                return False
+        try:
+            self._send(build_cancel(block_id, offset, length))
+        except OSError as e:
+            self.close(e)
+            return False
+        return True
+
+    def request_list(self) -> Future:
+        # Envia um LIST e retorna um Future com o bitfield da resposta BLOCKS
+        with self.list_lock:
+            with self.state_lock:
+                if self.pending_list is not None:
+                    return self.pending_list
+                future: Future = Future()
+                if self.closed:
+                    future.set_exception(ConnectionError(f"Conexão com {self.address} encerrada"))
+                    return future
+                self.pending_list = future
+            _observe_latency(future, LIST_SECONDS)
+            try:
+                self._send(build_list())
+            except OSError as e:
+                self.close(e)
+            return future
+
+    def _read_loop(self) -> None:
+        # Recebe quadros até a conexão fechar e entrega cada resposta ao seu Future
+        error: Optional[BaseException] = None
+        try:
+            while True:
+                frame = recv_frame(self.sock)
+                if frame is None:
+                    break
+                self._dispatch(*parse_message(frame), parse_flags(frame))
+        except Exception as e:
+            error = e
+        self.close(error)
+
+    def _dispatch(self, cmd: str, block_id: Optional[int], payload: Optional[bytes], flags: int = 0) -> None:
+        if not self.handshake_done:
+            # A primeira resposta é a do HANDSHAKE: o mesmo info_hash confirma o swarm (e as flags trazem o codec)
+            if cmd != CMD_HANDSHAKE or parse_handshake(payload)[0] != self.info_hash:
+                reason = (payload or b"").decode(errors="replace") if cmd == CMD_ERROR else cmd
+                raise ConnectionRefusedError(f"Handshake recusado por {self.address}: {reason}")
+            self.handshake_done = True
+            self.codec = flags
+            return
+        if cmd == CMD_HAVE:
+            # Anúncio de bloco novo no peer remoto (sem requisição correspondente)
+            with self.state_lock:
+                if block_id in self.remote_blocks:
+                    return
+                self.remote_blocks.add(block_id)
+            self._notify(EVENT_HAVE, block_id)
+            return
+        if cmd in (CMD_CHOKE, CMD_UNCHOKE):
+            self._set_choked(cmd == CMD_CHOKE)
+            return
+        if cmd == CMD_PEX:
+            # Delta dos peers conhecidos pelo remoto; o total guardado é limitado a MAX_PEX_PEERS
+            added, dropped = parse_pex(payload)
+            with self.state_lock:
+                self.pex_peers.difference_update(dropped)
+                room = max(0, MAX_PEX_PEERS - len(self.pex_peers))
+                self.pex_peers.update(added[:room])
+            self._notify(EVENT_PEX)
+            return
+        wire_size = 0
+        if cmd in (CMD_BLOCK, CMD_SUBBLOCK):
+            # Bytes que de fato vieram pela rede; com compressão, os dados são descomprimidos fora da trava
+            prefix = SUBBLOCK_OFFSET.size if cmd == CMD_SUBBLOCK else 0
+            wire_size = len(payload) - prefix
+            if flags != CODEC_NONE:
+                offset = SUBBLOCK_OFFSET.unpack_from(payload)[0] if prefix else 0
+                with self.state_lock:
+                    limit = self.expected_sizes.get((block_id, offset))
+                # Sem pedido pendente a resposta é descartada: nem vale descomprimir
+                if limit is not None:
+                    try:
+                        payload = payload[:prefix] + decompress(flags, payload[prefix:], limit)
+                    except CompressionError as e:
+                        raise ProtocolError(f"Bloco {block_id} (offset {offset}) de {self.address}: {e}")
+        with self.state_lock:
+            if cmd == CMD_BLOCKS:
+                futures = [self.pending_list]
+                self.pending_list = None
+                # HAVEs que chegaram antes da resposta continuam valendo
+                self.remote_blocks = parse_blocks_list(payload, block_id) | self.remote_blocks
+                self.availability_known = True
+                result: object = self.remote_blocks
+            elif cmd in (CMD_BLOCK, CMD_SUBBLOCK):
+                offset = 0
+                if cmd == CMD_SUBBLOCK:
+                    offset = SUBBLOCK_OFFSET.unpack_from(payload)[0]
+                    payload = payload[SUBBLOCK_OFFSET.size:]
+                future = self.pending.pop((block_id, offset), None)
+                self.expected_sizes.pop((block_id, offset), None)
+                futures = [future]
+                result = payload
+                self.download_rate.update(wire_size)
+                self.received_bytes.inc(wire_size)
+                if future is None or future.done():
+                    self.discarded_bytes += wire_size  # Resposta que ninguém espera mais (expirada/cancelada)
+            elif cmd == CMD_CANCEL:
+                offset, _ = parse_range(payload)
+                futures = [self.pending.pop((block_id, offset), None)]
+                self.expected_sizes.pop((block_id, offset), None)
+                result = RequestCancelledError(f"Pedido do bloco {block_id} (offset {offset}) cancelado")
+            elif cmd == CMD_ERROR:
+                # O erro vale para o bloco inteiro: falha todos os sub-blocos pendentes dele
+                keys = [key for key in self.pending if key[0] == block_id]
+                futures = [self.pending.pop(key) for key in keys]
+                for key in keys:
+                    self.expected_sizes.pop(key, None)
+                result = LookupError((payload or b"").decode(errors="replace"))
+            else:
+                logging.warning(f"Resposta inesperada de {self.address}: {cmd}")
+                return
+        if cmd == CMD_BLOCKS:
+            self._notify(EVENT_BITFIELD)
+        for future in futures:
+            if future is None:
+                continue  # Resposta sem requisição pendente
+            try:
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            except InvalidStateError:
+                pass  # A requisição foi cancelada ou expirou antes da resposta chegar
+
+    def _set_choked(self, choked: bool) -> None:
+        # CHOKE descarta os pedidos pendentes: o servidor não vai respondê-los
+        with self.state_lock:
+            if self.choked == choked:
+                return
+            self.choked = choked
+            pending = list(self.pending.values()) if choked else []
+            if choked:
+                self.pending.clear()
+                self.expected_sizes.clear()
+        reason = PeerChokedError(f"{self.address} bloqueou os pedidos (choke)")
+        for future in pending:
+            try:
+                future.set_exception(reason)
+            except InvalidStateError:
+                pass
+        self._notify(EVENT_CHOKE if choked else EVENT_UNCHOKE)
+
+    def _notify(self, event: str, block_id: Optional[int] = None) -> None:
+        if self.on_update is not None:
+            self.on_update(self, event, block_id)
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        # Fecha a conexão e falha todas as requisições pendentes
+        with self.state_lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending = list(self.pending.values())
+            if self.pending_list is not None:
+                pending.append(self.pending_list)
+            self.pending.clear()
+            self.expected_sizes.clear()
+            self.pending_list = None
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        reason = ConnectionError(f"Conexão com {self.address} encerrada" + (f": {error}" if error else ""))
+        for future in pending:
+            try:
+                future.set_exception(reason)
+            except InvalidStateError:
+                pass
+        self._notify(EVENT_CLOSED)
+
+
+class ConnectionPool:
+    """
+    Mantém uma conexão persistente por peer remoto, reaproveitada por todas as requisições.
+
+    Com vários swarms, há uma conexão por (peer, info_hash), e cada swarm
+    registra com subscribe() a função que recebe os eventos das suas conexões.
+    """
+
+    def __init__(self, max_inflight: int = MAX_INFLIGHT, timeout: float = CONNECT_TIMEOUT,
+                 on_update: Optional[Callable[[PeerConnection, str, Optional[int]], None]] = None,
+                 codecs: Iterable[int] = SUPPORTED_CODECS):
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self.on_update = on_update
+        self.codecs = tuple(codecs)  # Compressões aceitas, oferecidas no HANDSHAKE de cada conexão
+        self.subscribers: Dict[Optional[bytes], Callable[[PeerConnection, str, Optional[int]], None]] = {}
+        self.listen_address: Optional[Tuple[str, int]] = None  # Anunciado no HANDSHAKE (definido após o servidor subir)
+        self.connections: Dict[Tuple[str, int, Optional[bytes]], PeerConnection] = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, info_hash: Optional[bytes], callback: Callable[[PeerConnection, str, Optional[int]], None]) -> None:
+        # Registra quem recebe os eventos (HAVE, bitfield, desconexão) das conexões de um swarm
+        self.subscribers[info_hash] = callback
+
+    def _route(self, conn: PeerConnection, event: str, block_id: Optional[int]) -> None:
+        if self.on_update is not None:
+            self.on_update(conn, event, block_id)
+        callback = self.subscribers.get(conn.info_hash)
+        if callback is not None:
+            callback(conn, event, block_id)
+
+    def get(self, host: str, port: int, info_hash: Optional[bytes] = None) -> PeerConnection:
+        # Retorna a conexão aberta com o peer (no swarm indicado), criando uma nova se necessário
+        key = (host, port, info_hash)
+        with self.lock:
+            conn = self.connections.get(key)
+            if conn is not None and not conn.closed:
+                return conn
+        conn = PeerConnection(host, port, self.max_inflight, self.timeout, self._route, info_hash, self.listen_address,
+                              self.codecs)
+        with self.lock:
+            current = self.connections.get(key)
+            if current is not None and not current.closed:
+                conn.close()  # Outra thread abriu a conexão primeiro
+                return current
+            self.connections[key] = conn
+        return conn
+
+    def discard(self, host: str, port: int, info_hash: Optional[bytes] = None) -> None:
+        # Fecha e remove a conexão com o peer (ex.: após um erro)
+        with self.lock:
+            conn = self.connections.pop((host, port, info_hash), None)
+        if conn is not None:
+            conn.close()
+
+    def availability(self, info_hash: Optional[bytes] = None) -> Dict[str, Bitfield]:
+        # Disponibilidade atual de cada peer do swarm que já respondeu ao LIST inicial
+        with self.lock:
+            conns = [conn for key, conn in self.connections.items() if key[2] == info_hash]
+        return {conn.address: conn.remote_blocks for conn in conns
+                if conn.availability_known and not conn.closed}
+
+    def choking(self, info_hash: Optional[bytes] = None) -> Set[str]:
+        # Peers do swarm que bloquearam nossos pedidos
+        with self.lock:
+            conns = [conn for key, conn in self.connections.items() if key[2] == info_hash]
+        return {conn.address for conn in conns if conn.choked and not conn.closed}
+
+    def addresses(self, info_hash: Optional[bytes] = None) -> Set[str]:
+        # Peers do swarm com conexão aberta (incluindo os que ainda não responderam ao LIST)
+        with self.lock:
+            conns = [conn for key, conn in self.connections.items() if key[2] == info_hash]
+        return {conn.address for conn in conns if not conn.closed}
+
+    def pex_peers(self, info_hash: Optional[bytes] = None) -> Set[str]:
+        # União dos peers recebidos por PEX nas conexões do swarm (sem repetições)
+        with self.lock:
+            conns = [conn for key, conn in self.connections.items() if key[2] == info_hash]
+        peers: Set[str] = set()
+        for conn in conns:
+            if not conn.closed:
+                with conn.state_lock:
+                    peers |= conn.pex_peers
+        return peers
+
+    def download_rates(self) -> Dict[str, float]:
+        # Bytes/s recebidos de cada peer, somando as conexões de todos os swarms
+        with self.lock:
+            conns = [conn for conn in self.connections.values() if not conn.closed]
+        rates: Dict[str, float] = {}
+        for conn in conns:
+            rates[conn.address] = rates.get(conn.address, 0.0) + conn.download_rate.rate()
+        return rates
+
+    def connection_count(self) -> int:
+        with self.lock:
+            return sum(1 for conn in self.connections.values() if not conn.closed)
+
+    def pending_requests(self) -> int:
+        # Pedidos enviados e ainda sem resposta, somando todas as conexões
+        with self.lock:
+            conns = list(self.connections.values())
+        return sum(len(conn.pending) for conn in conns)
+
+    def cancel(self, host: str, port: int, block_id: int, info_hash: Optional[bytes] = None,
+               offset: int = 0, length: Optional[int] = None) -> bool:
+        # Envia CANCEL pela conexão existente com o peer (se houver)
+        with self.lock:
+            conn = self.connections.get((host, port, info_hash))
+        return conn is not None and conn.cancel_request(block_id, offset, length)
+
+    def close_swarm(self, info_hash: Optional[bytes]) -> None:
+        # Fecha apenas as conexões de um swarm (o pool continua servindo os demais)
+        with self.lock:
+            keys = [key for key in self.connections if key[2] == info_hash]
+            conns = [self.connections.pop(key) for key in keys]
+        self.subscribers.pop(info_hash, None)
+        for conn in conns:
+            conn.close()
+
+    def close_all(self) -> None:
+        with self.lock:
+            conns = list(self.connections.values())
+            self.connections.clear()
+        for conn in conns:
+            conn.close()
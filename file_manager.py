@@ -1,57 +1,138 @@
 import os
 import random
-from typing import Set, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, BinaryIO, Iterator, List, Union, Callable
+
+from bitfield import Bitfield
+from block_cache import BlockCache, CACHE_BYTES, POLICY_SLRU
+from compression import CODEC_NONE, pack
+from manifest import build_manifest, MANIFEST_FILENAME
+from protocol import NO_INFO_HASH
+from storage import BlockDirStore, SingleFileStore, migrate_block_dir, seed_store, STORAGE_BLOCKS, STORAGE_SINGLE
 
 BLOCK_SIZE = 1024  # Tamanho do bloco em bytes
 NUM_PEERS = 5
 
 
 class FileManager:
-    def __init__(self, peer_id: str, base_dir: str = "peers"):
-        # Inicializa o gerenciador de arquivos do peer, definindo o diretório onde os blocos serão armazenados
+    def __init__(self, peer_id: str, base_dir: str = "peers", storage: str = STORAGE_BLOCKS,
+                 block_size: int = BLOCK_SIZE, total_blocks: Optional[int] = None, file_size: Optional[int] = None,
+                 cache: Optional[BlockCache] = None, cache_bytes: int = CACHE_BYTES,
+                 cache_policy: str = POLICY_SLRU, readahead: int = 0,
+                 info_hash: bytes = NO_INFO_HASH, directory: Optional[str] = None, read_only: bool = False):
+        # Inicializa o gerenciador de arquivos do peer, definindo onde os blocos serão armazenados
         self.peer_id = peer_id
-        self.blocks_dir = os.path.join(base_dir, peer_id, "blocks")
-        os.makedirs(self.blocks_dir, exist_ok=True)
-        self.blocks = {}  # Cache para armazenar blocos já carregados em memória
-
-    def load_blocks(self) -> Set[int]:
-        # Carrega todos os blocos disponíveis no diretório do peer e retorna um conjunto com os índices dos blocos
-        blocks = set()
-        for filename in os.listdir(self.blocks_dir):
-            if filename.startswith("block_") and filename.endswith(".bin"):
-                try:
-                    index = int(filename.split("_")[1].split(".")[0])
-                    blocks.add(index)
-                except:
-                    continue  # Ignora arquivos que não seguem o padrão esperado
-        return blocks
+        self.info_hash = info_hash  # Swarm (arquivo) ao qual estes blocos pertencem
+        self.block_size = block_size
+        self.total_blocks = total_blocks or 0
+        self.file_size = file_size  # Tamanho real do arquivo (do manifesto), se conhecido
+        self.directory = directory = directory or os.path.join(base_dir, peer_id)
+        self.storage = storage
+        self.blocks_dir = os.path.join(directory, "blocks")
+        if storage == STORAGE_SINGLE:
+            # Um único arquivo pré-alocado; blocos no formato antigo são migrados na primeira execução
+            # Com o tamanho real do arquivo (manifesto), o último bloco parcial não estende o data.bin
+            total_size = file_size or (total_blocks * block_size if total_blocks else None)
+            self.store = SingleFileStore(directory, block_size, total_size, self.total_blocks, read_only=read_only)
+            if not read_only:
+                migrate_block_dir(self.blocks_dir, self.store)
+        elif storage == STORAGE_BLOCKS:
+            self.store = BlockDirStore(self.blocks_dir, self.total_blocks)
+        else:
+            raise ValueError(f"Tipo de armazenamento desconhecido: {storage}")
+        # Cache de blocos limitado em bytes; pode ser compartilhado entre swarms (as chaves levam o info_hash)
+        self.cache = cache if cache is not None else BlockCache(cache_bytes, cache_policy)
+        self.cache_namespace = info_hash if info_hash != NO_INFO_HASH else peer_id
+        self.readahead = readahead  # Quantos blocos seguintes carregar junto em uma falta de cache
+        self.listeners = []  # Funções chamadas com o ID de cada bloco salvo (ex.: anúncio HAVE)
+        self.sinks = []  # Funções chamadas com o ID e os dados de cada bloco salvo (ex.: reconstrução progressiva)
+
+    def add_listener(self, callback) -> None:
+        # Registra uma função chamada sempre que um bloco novo é salvo
+        self.listeners.append(callback)
+
+    def add_sink(self, callback) -> None:
+        # Registra uma função que recebe (id, dados) de cada bloco salvo, antes dos listeners
+        self.sinks.append(callback)
+
+    def load_blocks(self) -> Bitfield:
+        # Retorna o mapa (bitfield) dos blocos disponíveis neste peer
+        return self.store.block_ids()
 
     def save_block(self, block_num: int, data: bytes) -> None:
-        # Salva um bloco no disco e também armazena em cache
-        path = os.path.join(self.blocks_dir, f"block_{block_num}.bin")
-        with open(path, "wb") as f:
-            f.write(data)
-        self.blocks[block_num] = data
+        # Salva um bloco no armazenamento e também em cache
+        self.store.write(block_num, data)
+        self.cache.put((self.cache_namespace, block_num), bytes(data))
+        for sink in self.sinks:
+            sink(block_num, data)
+        for callback in self.listeners:
+            callback(block_num)
 
     def get_block(self, block_num: int) -> Optional[bytes]:
-        # Retorna o conteúdo de um bloco, buscando primeiro no cache e depois no disco, se necessário
-        if block_num in self.blocks:
-            return self.blocks[block_num]
-
-        path = os.path.join(self.blocks_dir, f"block_{block_num}.bin")
-        if os.path.exists(path):
-            with open(path, "rb") as f:
-                data = f.read()
-                self.blocks[block_num] = data
-                return data
-        return None  # Se o bloco não for encontrado, retorna None
+        # Retorna o conteúdo de um bloco, buscando primeiro no cache e depois no armazenamento
+        data = self.cache.get((self.cache_namespace, block_num))
+        if data is not None:
+            return data
+
+        data = self.store.read(block_num)
+        if data is not None:
+            self.cache.put((self.cache_namespace, block_num), data)
+            self._read_ahead(block_num)
+        return data  # Se o bloco não for encontrado, retorna None
+
+    def compressed_block(self, block_num: int, data: bytes, codec: int, level: int, offset: int = 0) -> Tuple[bytes, int]:
+        """
+        Retorna (payload, codec usado) para enviar `data` (o bloco ou o trecho
+        que começa em `offset`) comprimido. A forma comprimida fica no cache
+        junto dos blocos, de modo que blocos muito pedidos são comprimidos uma
+        vez só; blocos que não encolhem ficam marcados (b"") e seguem sem compressão.
+        """
+        if codec == CODEC_NONE:
+            return data, CODEC_NONE
+        key = (self.cache_namespace, block_num, codec, level, offset, len(data))
+        packed = self.cache.get(key)
+        if packed is None:
+            packed, used = pack(codec, data, level)
+            self.cache.put(key, packed if used != CODEC_NONE else b"")
+            return packed, used
+        if not packed:
+            return data, CODEC_NONE
+        return packed, codec
+
+    def _read_ahead(self, block_num: int) -> None:
+        # Carrega os blocos seguintes que ainda não estão em cache (pedidos costumam ser vizinhos)
+        for neighbour in range(block_num + 1, block_num + 1 + self.readahead):
+            key = (self.cache_namespace, neighbour)
+            if key in self.cache:
+                continue
+            data = self.store.read(neighbour)
+            if data is not None:
+                self.cache.put(key, data)
+
+    def block_length(self, block_num: int) -> Optional[int]:
+        # Tamanho exato do bloco (o último pode ser menor); None se o tamanho do arquivo não for conhecido
+        if self.file_size is None:
+            return None
+        return max(0, min(self.block_size, self.file_size - block_num * self.block_size))
+
+    def block_span(self, block_num: int) -> Optional[Tuple[BinaryIO, int, int]]:
+        # Retorna (arquivo, offset, tamanho) do bloco para envio direto com sendfile, se o armazenamento permitir
+        return self.store.span(block_num)
+
+    def flush(self) -> None:
+        # Persiste o índice de blocos (na saída do processo, para que a próxima abertura seja imediata)
+        self.store.flush()
+
+    def close(self) -> None:
+        self.store.close()
 
     def rebuild_file(self, output_path: str, total_blocks: int) -> bool:
         # Reconstrói o arquivo original unindo os blocos em ordem e salvando no caminho especificado
         missing = []
         with open(output_path, "wb") as output:
             for i in range(total_blocks):
-                data = self.get_block(i)
+                # Lê direto do armazenamento: uma varredura completa não deve ocupar o cache
+                data = self.store.read(i)
                 if data:
                     output.write(data)
                 else:
@@ -62,52 +143,93 @@ class FileManager:
         return True  # Arquivo reconstruído com sucesso
 
 
-def split_and_distribute(filepath: str, output_dir: str = "peers", block_size: int = BLOCK_SIZE, num_peers: int = NUM_PEERS):
-    blocks_path = os.path.join(output_dir, "blocks")
-    os.makedirs(blocks_path, exist_ok=True)
-
-    # Cria pastas dos peers
-    peer_dirs = []
-    for i in range(1, num_peers + 1):
-        peer_dir = os.path.join(output_dir, f"peer_{i}", "blocks")
-        os.makedirs(peer_dir, exist_ok=True)
-        peer_dirs.append(peer_dir)
-
-    # Divide o arquivo em blocos e salva cada um como um arquivo separado
-    block_paths = []
-    with open(filepath, "rb") as f:
-        index = 0
-        while chunk := f.read(block_size):
-            path = os.path.join(blocks_path, f"block_{index}.bin")
-            with open(path, "wb") as bf:
-                bf.write(chunk)
-            block_paths.append(path)
-            index += 1
-
-    total_blocks = len(block_paths)
-    print(f"[SETUP] Total de blocos criados: {total_blocks}")
-
-    # Garante que cada bloco vá para pelo menos um peer
-    for b in range(total_blocks):
-        selected_peer = random.choice(peer_dirs)
-        src = block_paths[b]
-        dst = os.path.join(selected_peer, f"block_{b}.bin")
-        with open(src, "rb") as s, open(dst, "wb") as d:
-            d.write(s.read())
-
-    # Adiciona blocos extras aleatórios para simular distribuição real entre os peers
-    for peer_dir in peer_dirs:
-        extra_blocks = random.sample(range(total_blocks), random.randint(1, total_blocks - 1))
-        for b in extra_blocks:
-            src = block_paths[b]
-            dst = os.path.join(peer_dir, f"block_{b}.bin")
-            if not os.path.exists(dst):
-                with open(src, "rb") as s, open(dst, "wb") as d:
-                    d.write(s.read())
+# ----------------------
+# Políticas de distribuição inicial
+# ----------------------
+# Cada política é um gerador que recebe (total de blocos, nº de peers, fator de
+# replicação, gerador aleatório) e produz, para cada bloco em ordem, a lista de
+# índices dos peers que recebem uma cópia.
+
+def random_placement(total_blocks: int, num_peers: int, replication: Optional[int], rng: random.Random) -> Iterator[List[int]]:
+    if replication is None:
+        # Comportamento original: cada bloco vai para um peer garantido, e cada peer
+        # ainda recebe uma fração aleatória dos demais blocos
+        fractions = [rng.randint(1, max(1, total_blocks - 1)) / total_blocks for _ in range(num_peers)]
+        for _ in range(total_blocks):
+            owners = {rng.randrange(num_peers)}
+            owners.update(peer for peer in range(num_peers) if rng.random() < fractions[peer])
+            yield sorted(owners)
+    else:
+        # Exatamente `replication` cópias de cada bloco, em peers distintos sorteados
+        for _ in range(total_blocks):
+            yield rng.sample(range(num_peers), replication)
+
+
+def striped_placement(total_blocks: int, num_peers: int, replication: Optional[int], rng: random.Random) -> Iterator[List[int]]:
+    # Divide o arquivo em faixas contíguas, uma por peer; cada cópia extra vai para o peer seguinte
+    copies = replication or 1
+    stripe = max(1, (total_blocks + num_peers - 1) // num_peers)
+    for block_id in range(total_blocks):
+        first = block_id // stripe
+        yield [(first + k) % num_peers for k in range(copies)]
+
+
+PLACEMENT_POLICIES = {
+    "random": random_placement,
+    "striped": striped_placement,
+}
+
+
+def split_and_distribute(filepath: str, output_dir: str = "peers", block_size: int = BLOCK_SIZE, num_peers: int = NUM_PEERS,
+                         replication: Optional[int] = None, placement: Union[str, Callable] = "random",
+                         workers: Optional[int] = None, link_full_seeds: bool = False, seed: Optional[int] = None) -> int:
+    """
+    Divide o arquivo e monta diretamente o armazenamento de arquivo único
+    (peers/peer_N/data.bin + have.idx) de cada peer, em uma única passada.
+
+    - `replication`: número de cópias de cada bloco (None mantém a
+      distribuição aleatória original, com pelo menos uma cópia por bloco);
+    - `placement`: nome de uma política em PLACEMENT_POLICIES ou um gerador
+      com a mesma assinatura;
+    - `workers`: threads que montam os peers em paralelo;
+    - `link_full_seeds`: peers que recebem todos os blocos ganham um hardlink
+      do arquivo original em vez de uma cópia. Desligado por padrão: o
+      data.bin passa a ser o próprio arquivo original, que o peer abre para
+      escrita, e qualquer escrita ou truncamento do armazenamento altera (ou
+      corrompe) o original. Use só com um arquivo que possa ser sacrificado.
+
+    Nenhum arquivo por bloco é criado: trechos contíguos são copiados com
+    copy_file_range. Retorna o número total de blocos.
+    """
+    file_size = os.path.getsize(filepath)
+    total_blocks = (file_size + block_size - 1) // block_size
+    if replication is not None and not 1 <= replication <= num_peers:
+        raise ValueError(f"Fator de replicação deve estar entre 1 e {num_peers}")
+    policy = PLACEMENT_POLICIES[placement] if isinstance(placement, str) else placement
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"[SETUP] Total de blocos: {total_blocks}")
+
+    # Decide, bloco a bloco, quem recebe cada cópia (só metadados: um bitfield por peer)
+    shares = [Bitfield(total_blocks) for _ in range(num_peers)]
+    for block_id, owners in enumerate(policy(total_blocks, num_peers, replication, random.Random(seed))):
+        for peer in owners:
+            shares[peer].add(block_id)
+
+    # Monta os peers em paralelo enquanto o manifesto é calculado
+    with ThreadPoolExecutor(max_workers=workers or min(num_peers, os.cpu_count() or 1)) as pool:
+        jobs = [
+            pool.submit(seed_store, filepath, os.path.join(output_dir, f"peer_{i}"), block_size, share, link_full_seeds)
+            for i, share in enumerate(shares, start=1)
+        ]
+        # Manifesto (tamanhos e SHA-256 de cada bloco) usado pelos peers para verificar o que recebem
+        manifest = build_manifest(filepath, block_size)
+        manifest.save(os.path.join(output_dir, MANIFEST_FILENAME))
+        print(f"[SETUP] Manifesto gerado com {manifest.block_count} hashes")
+        for job in jobs:
+            job.result()
 
     # Mostrar blocos por peer
-    for i, peer_dir in enumerate(peer_dirs, start=1):
-        count = len([f for f in os.listdir(peer_dir) if f.endswith(".bin")])
-        print(f"[SETUP] Peer {i} recebeu {count} blocos.")
+    for i, share in enumerate(shares, start=1):
+        print(f"[SETUP] Peer {i} recebeu {len(share)} blocos.")
 
     return total_blocks
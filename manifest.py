@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Optional
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+HASH_ALGORITHM = "sha256"
+PARALLEL_THRESHOLD = 64 * 1024 * 1024  # Abaixo disso o hash é calculado no próprio processo
+TASK_BYTES = 16 * 1024 * 1024           # Bytes processados por tarefa no pool de processos
+
+
+class BlockVerificationError(ValueError):
+    """Bloco recebido com tamanho ou hash diferente do manifesto."""
+
+
+class Manifest:
+    """
+    Descrição do arquivo distribuído: tamanho, tamanho do bloco, número de
+    blocos e o SHA-256 de cada bloco. Gerado por split_and_distribute e lido
+    pelos peers para saber o total de blocos e verificar cada bloco recebido.
+    """
+
+    def __init__(self, file_name: str, file_size: int, block_size: int, block_hashes: List[bytes]):
+        self.file_name = file_name
+        self.file_size = file_size
+        self.block_size = block_size
+        self.block_hashes = block_hashes  # Digests SHA-256 (32 bytes) na ordem dos blocos
+        self._info_hash: Optional[bytes] = None
+
+    @property
+    def block_count(self) -> int:
+        return len(self.block_hashes)
+
+    @property
+    def info_hash(self) -> bytes:
+        # Identificador do swarm: SHA-1 (20 bytes) da forma canônica do manifesto
+        if self._info_hash is None:
+            canonical = json.dumps(self.to_dict(), sort_keys=True, separators=(",", ":")).encode()
+            self._info_hash = hashlib.sha1(canonical).digest()
+        return self._info_hash
+
+    def block_length(self, block_id: int) -> int:
+        # Tamanho esperado do bloco (o último pode ser menor)
+        if block_id == self.block_count - 1:
+            return self.file_size - block_id * self.block_size
+        return self.block_size
+
+    def verify(self, block_id: int, data: bytes) -> bool:
+        # Confere o tamanho e o hash de um bloco
+        if not 0 <= block_id < self.block_count or len(data) != self.block_length(block_id):
+            return False
+        return hashlib.sha256(data).digest() == self.block_hashes[block_id]
+
+    def check(self, block_id: int, data: bytes) -> bytes:
+        # Igual a verify, mas lança BlockVerificationError; retorna os dados para encadear
+        if not self.verify(block_id, data):
+            raise BlockVerificationError(f"Bloco {block_id} corrompido ou truncado ({len(data)} bytes)")
+        return data
+
+    # ----------------------
+    # Serialização
+    # ----------------------
+
+    def to_dict(self) -> dict:
+        return {
+            "version": MANIFEST_VERSION,
+            "file_name": self.file_name,
+            "file_size": self.file_size,
+            "block_size": self.block_size,
+            "block_count": self.block_count,
+            "hash": HASH_ALGORITHM,
+            "block_hashes": [digest.hex() for digest in self.block_hashes],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Manifest":
+        if data.get("version") != MANIFEST_VERSION or data.get("hash") != HASH_ALGORITHM:
+            raise ValueError("Manifesto em formato não suportado")
+        hashes = [bytes.fromhex(h) for h in data["block_hashes"]]
+        if len(hashes) != data["block_count"]:
+            raise ValueError("Manifesto inconsistente: número de hashes diferente de block_count")
+        return cls(data["file_name"], data["file_size"], data["block_size"], hashes)
+
+    def save(self, path: str) -> None:
+        # Grava em um arquivo temporário e renomeia, para nunca deixar um manifesto pela metade
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Manifest":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def load_manifest(base_dir: str = "peers") -> Optional[Manifest]:
+    # Lê o manifesto gerado pela divisão do arquivo, se existir
+    path = os.path.join(base_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    return Manifest.load(path)
+
+
+# ----------------------
+# Cálculo dos hashes
+# ----------------------
+
+def _hash_range(filepath: str, block_size: int, first: int, count: int) -> List[bytes]:
+    # Calcula o hash de `count` blocos a partir do bloco `first` (executado nos processos do pool)
+    digests = []
+    with open(filepath, "rb") as f:
+        f.seek(first * block_size)
+        for _ in range(count):
+            chunk = f.read(block_size)
+            if not chunk:
+                break
+            digests.append(hashlib.sha256(chunk).digest())
+    return digests
+
+
+def hash_blocks(filepath: str, block_size: int, workers: Optional[int] = None) -> List[bytes]:
+    """
+    Calcula o SHA-256 de cada bloco do arquivo. Arquivos grandes são
+    divididos em faixas de blocos processadas em paralelo (um processo por núcleo).
+    """
+    file_size = os.path.getsize(filepath)
+    block_count = (file_size + block_size - 1) // block_size
+    workers = workers or os.cpu_count() or 1
+    if file_size < PARALLEL_THRESHOLD or workers == 1:
+        # Arquivo pequeno (ou um só núcleo): criar processos custaria mais do que o próprio hash
+        return _hash_range(filepath, block_size, 0, block_count)
+
+    per_task = max(1, TASK_BYTES // block_size)
+    firsts = range(0, block_count, per_task)
+    digests: List[bytes] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map preserva a ordem das faixas
+        for part in pool.map(_hash_range, repeat(filepath), repeat(block_size), firsts, repeat(per_task)):
+            digests.extend(part)
+    return digests
+
+
+def build_manifest(filepath: str, block_size: int, workers: Optional[int] = None) -> Manifest:
+    # Gera o manifesto de um arquivo
+    return Manifest(os.path.basename(filepath), os.path.getsize(filepath), block_size,
+                    hash_blocks(filepath, block_size, workers))
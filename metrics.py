@@ -0,0 +1,282 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Limites (s) dos histogramas de latência: de 1 ms a 10 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"  # Formato texto do Prometheus
+
+
+# ----------------------
+# Métricas
+# ----------------------
+# O custo fica no momento da coleta: incrementar um contador é uma soma sob
+# uma trava sem disputa, e os valores que já existem em outras estruturas
+# (conexões, filas, cache) são lidos por funções chamadas só quando alguém
+# consulta o endpoint.
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self.function: Optional[Callable[[], object]] = None
+        self.lock = threading.Lock()
+
+    def labels(self, *values) -> object:
+        # Série de um conjunto de rótulos (criada no primeiro uso e reaproveitada depois)
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name}: esperados os rótulos {self.label_names}")
+            with self.lock:
+                child = self.children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def set_function(self, function: Callable[[], object]) -> None:
+        """
+        Calcula o valor apenas na coleta, a partir de um contador ou estado
+        que já existe em outro objeto: a função retorna um número (sem
+        rótulos) ou um dicionário {valor do rótulo (ou tupla): número}.
+        """
+        self.function = function
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self.function is not None:
+            return lines + self._render_function()
+        for key, child in list(self.children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_function(self) -> List[str]:
+        try:
+            values = self.function()
+        except Exception as e:
+            logging.debug(f"Falha ao coletar {self.name}: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = []
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+    def _render_child(self, key: Tuple[str, ...], child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """
+    Contador monotônico (ex.: bytes enviados). Sem rótulos, inc() vale para
+    a série única; com rótulos, use labels(...).inc().
+    """
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """
+    Valor instantâneo (ex.: conexões abertas), normalmente lido com set_function().
+    """
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count", "lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Por faixa (não acumulado); a última é +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    """
+    Distribuição de valores (ex.: latência em segundos) em faixas fixas.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _render_child(self, key: Tuple[str, ...], child: _HistogramValue) -> List[str]:
+        with child.lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(child.bounds + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# ----------------------
+# Registro e exportação
+# ----------------------
+
+class MetricsRegistry:
+    """
+    Conjunto de métricas de um processo, exportado no formato texto do Prometheus.
+
+    Registrar de novo um nome já existente devolve a mesma métrica, de modo
+    que vários objetos do mesmo tipo (ex.: um servidor por teste) compartilham
+    as séries.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name: str, help_text: str, labels: Sequence[str] = (), **kwargs) -> _Metric:
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Métrica {name} já registrada como {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, labels, buckets=buckets)
+
+    def counter_values(self) -> Dict[str, List[Tuple[Tuple[str, ...], float]]]:
+        """
+        Valores atuais dos contadores com séries próprias (os calculados por
+        função ficam de fora): {nome: [(rótulos, valor), ...]}. Usado para
+        somar os contadores de outros processos (workers do seeder) a este registro.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: [(key, child.value) for key, child in list(metric.children.items())]
+                for metric in metrics if isinstance(metric, Counter) and metric.function is None}
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()  # Registro padrão do processo
+
+
+class MetricsServer:
+    """
+    Endpoint HTTP local (GET /metrics) com as métricas do registro, em uma
+    thread própria. Nada é calculado fora das consultas.
+    """
+
+    def __init__(self, port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry_ref.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Uma linha de log por coleta só poluiria a saída
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host = host
+        self.port = self.httpd.server_address[1]  # Porta real (caso tenha sido 0)
+
+    def start(self) -> "MetricsServer":
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,139 +1,224 @@
+import argparse
 import threading
 import time
 import os
 import logging
-import sys
+import signal
 import socket
-
-from file_manager import FileManager
-from peer_server import PeerServer
-from peer_client import PeerClient
+from concurrent.futures import ThreadPoolExecutor
+
+from block_cache import BlockCache
+from compression import parse_codec
+from connection_pool import ConnectionPool
+from file_manager import BLOCK_SIZE
+from manifest import Manifest, MANIFEST_FILENAME
+from metrics import REGISTRY, MetricsServer
+from peer_client import VERIFY_WORKERS
+from peer_server import AsyncPeerServer
+from seeder import SeederWorkers
 from strategy import Strategy
-from tracker_client import TrackerClient
+from swarm import Swarm, output_name
+from tracker_client import TrackerClient, UdpTrackerClient
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # -------- CONFIGURAÇÕES INICIAIS --------
-# Define o ID do peer com base no argumento passado, ou usa "peer_1" por padrão
-PEER_ID = sys.argv[1] if len(sys.argv) > 1 else "peer_1"
-TRACKER_HOST = "127.0.0.1"
-TRACKER_PORT = 8000
+# Uso: python peer.py [peer_id] [--swarm peers/manifest.json] [--swarm outro/manifest.json] ...
+parser = argparse.ArgumentParser(description="Peer da rede P2P (um ou mais arquivos por processo)")
+parser.add_argument("peer_id", nargs="?", default="peer_1")
+parser.add_argument("--swarm", action="append", metavar="MANIFESTO",
+                    help="manifesto de um arquivo a compartilhar (repetível); os blocos ficam em <pasta do manifesto>/<peer_id>")
+parser.add_argument("--max-upload", type=float, default=0, metavar="KB/s", help="limite total de upload (0 = sem limite)")
+parser.add_argument("--max-upload-peer", type=float, default=0, metavar="KB/s",
+                    help="limite de upload para cada peer (0 = sem limite)")
+parser.add_argument("--compression", default="none", metavar="CODEC[:NÍVEL]",
+                    help="comprime os blocos enviados aos peers que aceitam: none, zlib ou lzma, com nível opcional (ex.: zlib:6)")
+parser.add_argument("--workers", type=int, default=1, metavar="N",
+                    help="processos que servem os blocos depois que o peer vira seeder, todos na mesma porta (SO_REUSEPORT)")
+parser.add_argument("--tracker", default="127.0.0.1:8000", metavar="HOST:PORTA", help="endereço do tracker")
+parser.add_argument("--metrics-port", type=int, default=0, metavar="PORTA",
+                    help="expõe as métricas (formato Prometheus) em http://127.0.0.1:PORTA/metrics (0 = desativado)")
+args = parser.parse_args()
+try:
+    COMPRESSION, COMPRESSION_LEVEL = parse_codec(args.compression)
+except ValueError as e:
+    parser.error(str(e))
+if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+    parser.error("--workers exige SO_REUSEPORT, indisponível neste sistema")
+
+PEER_ID = args.peer_id
+TRACKER_HOST, _, TRACKER_PORT = args.tracker.rpartition(":")
+TRACKER_PORT = int(TRACKER_PORT)
+TRACKER_UDP = True  # Anúncio UDP compacto (um datagrama por consulta); False usa TCP
 BLOCKS_DIR = "peers"
-OUTPUT_EXTENSION = ".txt"
+OUTPUT_DIR = "reconstruidos"
+STORAGE = "single"  # "single": arquivo único pré-alocado com mmap/sendfile; "blocks": um arquivo por bloco
+CHOKE_INTERVAL = 10  # Intervalo (s) entre as rodadas de choking (tit-for-tat)
+PEX_INTERVAL = 5     # Intervalo (s) entre os envios de PEX (só os deltas; nada é enviado se nada mudou)
+SERVER_START_TIMEOUT = 10  # Tempo máximo (s) para o servidor associar a porta
 
 # -------- INICIALIZAÇÃO --------
-# Cria as instâncias principais do sistema: gerenciamento de blocos, servidor, cliente, estratégia e comunicação com o tracker
-file_manager = FileManager(PEER_ID, BLOCKS_DIR)
-client = PeerClient(PEER_ID, file_manager)
-server = PeerServer(PEER_ID, host="0.0.0.0", port=0, file_manager=file_manager)
+# Servidor, pool de conexões, verificador e cache são únicos no processo e atendem todos os swarms
+pool = ConnectionPool()
+verifier = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix=f"{PEER_ID}-verify")
+cache = BlockCache()
+server = AsyncPeerServer(PEER_ID, host="0.0.0.0", port=0, max_upload_rate=args.max_upload * 1024,
+                         max_peer_upload_rate=args.max_upload_peer * 1024,
+                         compression=COMPRESSION, compression_level=COMPRESSION_LEVEL, reuse_port=args.workers > 1)
 strategy = Strategy()
-tracker = TrackerClient(TRACKER_HOST, TRACKER_PORT)
+
+swarms = []
+manifest_paths = args.swarm or [os.path.join(BLOCKS_DIR, MANIFEST_FILENAME)]
+for path in manifest_paths:
+    directory = os.path.join(os.path.dirname(path), PEER_ID)
+    if os.path.exists(path):
+        # O manifesto gerado por split_and_distribute traz o total de blocos e o hash de cada um
+        manifest = Manifest.load(path)
+        logging.info(f"[{PEER_ID}] Manifesto {path} carregado: {manifest.block_count} blocos de "
+                     f"{manifest.block_size} bytes (swarm {manifest.info_hash.hex()[:8]})")
+        swarm = Swarm(PEER_ID, directory, os.path.join(OUTPUT_DIR, output_name(PEER_ID, manifest, len(manifest_paths) == 1)),
+                      manifest, storage=STORAGE, pool=pool, verifier=verifier, cache=cache, server=server)
+    elif args.swarm:
+        logging.error(f"[{PEER_ID}] Manifesto não encontrado: {path}")
+        continue
+    else:
+        # Sem manifesto (divisão feita por uma versão antiga): conta os blocos e baixa sem verificação
+        main_blocks_dir = os.path.join(BLOCKS_DIR, "blocks")
+        if os.path.exists(main_blocks_dir):
+            total_blocks = len([f for f in os.listdir(main_blocks_dir) if f.endswith(".bin")])
+            logging.info(f"[{PEER_ID}] Total de blocos detectados: {total_blocks}")
+        else:
+            total_blocks = 100  # valor padrão, caso não consiga contar
+            logging.warning(f"[{PEER_ID}] Não foi possível detectar blocos. Usando 100 como padrão.")
+        swarm = Swarm(PEER_ID, directory, os.path.join(OUTPUT_DIR, output_name(PEER_ID, None, True)),
+                      total_blocks=total_blocks, block_size=BLOCK_SIZE, storage=STORAGE,
+                      pool=pool, verifier=verifier, cache=cache, server=server)
+        server.file_manager = swarm.file_manager  # Conexões sem HANDSHAKE usam este swarm
+    server.add_swarm(swarm.file_manager)
+    swarms.append(swarm)
+
+if not swarms:
+    raise SystemExit(f"[{PEER_ID}] Nenhum swarm para participar")
+
+tracker = UdpTrackerClient(TRACKER_HOST, TRACKER_PORT) if TRACKER_UDP else TrackerClient(TRACKER_HOST, TRACKER_PORT)
 
 # Inicia o servidor em uma thread separada (modo daemon)
 server_thread = threading.Thread(target=server.start, daemon=True)
 server_thread.start()
 
-# Aguarda o servidor inicializar e obter a porta real
-time.sleep(1)
+# Aguarda o servidor associar a porta (e obter a porta real)
+if not server.ready.wait(SERVER_START_TIMEOUT):
+    raise SystemExit(f"[{PEER_ID}] O servidor não iniciou em {SERVER_START_TIMEOUT}s")
 my_port = server.port
 my_host = socket.gethostbyname(socket.gethostname())
+pool.listen_address = (my_host, my_port)  # Anunciado no HANDSHAKE: os outros peers nos identificam por ele
+
+# Processos extras que dividem a porta com o servidor quando o peer vira seeder (iniciados ao completar os downloads)
+seeders = None
+if args.workers > 1:
+    seeders = SeederWorkers(PEER_ID, my_port, [swarm.file_manager for swarm in swarms], args.workers - 1,
+                            compression=COMPRESSION, compression_level=COMPRESSION_LEVEL,
+                            max_upload_rate=args.max_upload * 1024, max_peer_upload_rate=args.max_upload_peer * 1024)
+
+# -------- MÉTRICAS --------
+# Contadores e histogramas são atualizados pelos módulos; os valores abaixo só são lidos quando alguém consulta
+if args.metrics_port:
+    # Com workers, as conexões, filas e peers desbloqueados somam o servidor principal e os workers
+    REGISTRY.gauge("p2p_connections", "Conexões abertas", ["direction"]).set_function(
+        lambda: {"in": server.connection_count() + (seeders.connection_count() if seeders else 0),
+                 "out": pool.connection_count()})
+    REGISTRY.gauge("p2p_queued_requests", "Pedidos aguardando resposta", ["side"]).set_function(
+        lambda: {"server": server.queued_requests() + (seeders.queued_requests() if seeders else 0),
+                 "client": pool.pending_requests()})
+    REGISTRY.gauge("p2p_unchoked_peers", "Peers desbloqueados para download deste peer").set_function(
+        lambda: len(server.unchoked) + (seeders.unchoked_count() if seeders else 0))
+    REGISTRY.gauge("p2p_missing_blocks", "Blocos que ainda faltam, por swarm", ["swarm"]).set_function(
+        lambda: {swarm.name: swarm.index.missing_count() for swarm in swarms})
+    REGISTRY.counter("p2p_cache_hits_total", "Leituras atendidas pelo cache de blocos").set_function(lambda: cache.hits)
+    REGISTRY.counter("p2p_cache_misses_total", "Leituras que foram ao disco").set_function(lambda: cache.misses)
+    REGISTRY.counter("p2p_cache_evictions_total", "Blocos descartados do cache").set_function(lambda: cache.evictions)
+    REGISTRY.gauge("p2p_cache_bytes", "Bytes ocupados no cache de blocos").set_function(lambda: cache.size_bytes)
+    try:
+        metrics = MetricsServer(args.metrics_port).start()
+        logging.info(f"[{PEER_ID}] Métricas em http://{metrics.host}:{metrics.port}/metrics")
+    except OSError as e:
+        logging.warning(f"[{PEER_ID}] Não foi possível abrir o endpoint de métricas: {e}")
+
+# Registra este peer no tracker central, uma vez por swarm
+for swarm in swarms:
+    if swarm.register(tracker, my_host, my_port):
+        logging.info(f"[{PEER_ID}] Registrado no tracker como {my_host}:{my_port} ({swarm.name})")
+    else:
+        logging.error(f"[{PEER_ID}] Falha ao registrar no tracker ({swarm.name})")
+
+# Renova o registro periodicamente; o tracker descarta peers que param de anunciar
+def announce_loop():
+    while True:
+        time.sleep(tracker.interval)
+        for swarm in swarms:
+            if not swarm.register(tracker, my_host, my_port):
+                logging.warning(f"[{PEER_ID}] Falha ao renovar o registro no tracker ({swarm.name})")
 
-# Registra este peer no tracker central
-if tracker.register(PEER_ID, my_host, my_port):
-    logging.info(f"[{PEER_ID}] Registrado no tracker como {my_host}:{my_port}")
-else:
-    logging.error(f"[{PEER_ID}] Falha ao registrar no tracker")
-
-# Detecta o número total de blocos com base na pasta de blocos principal
-main_blocks_dir = os.path.join("peers", "blocks")
-if os.path.exists(main_blocks_dir):
-    TOTAL_BLOCKS = len([f for f in os.listdir(main_blocks_dir) if f.endswith(".bin")])
-    logging.info(f"[{PEER_ID}] Total de blocos detectados: {TOTAL_BLOCKS}")
-else:
-    TOTAL_BLOCKS = 100  # valor padrão, caso não consiga contar
-    logging.warning(f"[{PEER_ID}] Não foi possível detectar blocos. Usando 100 como padrão.")
-
-# -------- Função auxiliar de rarest first --------
-# Retorna os blocos ainda não baixados, ordenados do mais raro para o mais comum
-def select_rarest_blocks(peer_block_map, my_blocks):
-    block_frequency = {}
-    for blocks in peer_block_map.values():
-        for b in blocks:
-            if b not in my_blocks:
-                block_frequency[b] = block_frequency.get(b, 0) + 1
-    sorted_blocks = sorted(block_frequency.items(), key=lambda x: x[1])
-    return [b for b, _ in sorted_blocks]
+threading.Thread(target=announce_loop, daemon=True).start()
 
-# -------- LOOP DE TROCA DE BLOCOS --------
-# Loop principal de download, roda em background até obter todos os blocos
-def download_loop():
-    peer_block_map = {}  # mapeia os peers e os blocos que cada um possui
-    counter = 0  # usado para controlar a frequência de atualização da estratégia
+# -------- CHOKING (TIT-FOR-TAT) --------
+# A cada rodada, escolhe quem pode baixar deste peer: os que mais nos enviam (ou, como
+# seeder, os que mais recebem) entre os interessados, mais um otimista. O servidor aplica a escolha.
+def choke_loop():
+    while True:
+        time.sleep(CHOKE_INTERVAL)
+        by_hash = {swarm.info_hash: swarm for swarm in swarms}
+        my_blocks = {swarm.info_hash: swarm.file_manager.load_blocks() for swarm in swarms}
+        candidates = [peer for peer, hashes in server.connected_peers().items()
+                      if any(h in by_hash and by_hash[h].interested(peer, my_blocks[h]) for h in hashes)]
+        logging.info(f"[{PEER_ID}] Atualizando estratégia tit-for-tat - {time.strftime('%H:%M:%S')}")
+        unchoked = strategy.update_unchoked_peers(candidates, pool.download_rates(), server.upload_rates.rates(),
+                                                  seeding=all(swarm.completed for swarm in swarms))
+        server.set_unchoked(unchoked)
+
+threading.Thread(target=choke_loop, daemon=True).start()
+
+# -------- PEX (TROCA DE PEERS) --------
+# A cada rodada, cada swarm divulga aos peers conectados os peers com que tem conexão aberta
+# (enviados e recebidos); assim os peers se descobrem sem consultar o tracker a cada ciclo
+def pex_loop():
+    while True:
+        time.sleep(PEX_INTERVAL)
+        for swarm in swarms:
+            server.send_pex(swarm.info_hash, swarm.gossip_peers())
+
+threading.Thread(target=pex_loop, daemon=True).start()
+
+# -------- ENCERRAMENTO --------
+# SIGTERM encerra como Ctrl+C: o índice de blocos é gravado antes de sair, e o próximo início o lê de uma vez
+def terminate(signum, frame):
+    raise SystemExit(0)
 
+signal.signal(signal.SIGTERM, terminate)
+
+# -------- LOOP DE TROCA DE BLOCOS --------
+# Cada swarm baixa em sua própria thread; ao completar, o peer continua como seeder
+download_threads = [threading.Thread(target=swarm.download_loop, args=(tracker,), daemon=True) for swarm in swarms]
+try:
+    for thread in download_threads:
+        thread.start()
+    for thread in download_threads:
+        thread.join()
+
+    logging.info(f"[{PEER_ID}] Permanecendo online como seeder para ajudar outros peers.")
+    if seeders is not None:
+        seeders.start()
     while True:
-        # Carrega os blocos que este peer já possui
-        my_blocks = file_manager.load_blocks()
-        logging.info(f"[{PEER_ID}] Blocos atuais: {sorted(my_blocks)}")
-
-        # Se já tiver todos os blocos, tenta reconstruir o arquivo original
-        if len(my_blocks) >= TOTAL_BLOCKS:
-            logging.info(f"[{PEER_ID}] Todos os blocos foram baixados. Tentando reconstruir...")
-            os.makedirs("reconstruidos", exist_ok=True)
-            output_path = os.path.join("reconstruidos", f"{PEER_ID}_reconstruido{OUTPUT_EXTENSION}")
-            success = file_manager.rebuild_file(output_path, TOTAL_BLOCKS)
-            if success:
-                logging.info(f"[{PEER_ID}] Arquivo reconstruído com sucesso.")
-                logging.info(f"[{PEER_ID}] Permanecendo online como seeder para ajudar outros peers.")
-                # Após reconstruir, o peer continua ativo apenas como fonte para outros peers
-                while True:
-                    time.sleep(60)  # mantém o processo vivo
-            else:
-                logging.warning(f"[{PEER_ID}] Falha na reconstrução. Esperando mais blocos...")
-                time.sleep(3)
-                continue
-
-        # Solicita a lista de peers disponíveis ao tracker
-        known_peers = tracker.get_peers(PEER_ID)
-        peer_block_map.clear()
-
-        # Para cada peer encontrado, obtém a lista de blocos que ele possui
-        for peer in known_peers:
-            host, port = peer["host"], peer["port"]
-            peer_id = f"{host}:{port}"
-            blocks = client.get_peer_blocks(host, port)
-            if blocks:
-                peer_block_map[peer_id] = blocks
-
-        # A cada 5 ciclos (10 segundos), atualiza a estratégia tit-for-tat
-        if counter % 5 == 0:
-            logging.info(f"[{PEER_ID}] Atualizando estratégia tit-for-tat (a cada 10s) - {time.strftime('%H:%M:%S')}")
-            strategy.update_unchoked_peers(
-                known_peers=list(peer_block_map.keys()),
-                peer_block_map=peer_block_map,
-                my_blocks=my_blocks
-            )
-
-        # Obtém a lista de peers desbloqueados e blocos mais raros a serem buscados
-        unchoked_peers = strategy.get_unchoked_peers()
-        rarest_blocks = select_rarest_blocks(peer_block_map, my_blocks)
-
-        # Para cada bloco raro, tenta baixá-lo de um dos peers desbloqueados
-        for block_id in rarest_blocks:
-            for peer_addr in unchoked_peers:
-                host, port = peer_addr.split(":")
-                port = int(port)
-                if block_id in peer_block_map.get(peer_addr, set()):
-                    success = client.request_block(host, port, block_id)
-                    if success:
-                        break  # Se conseguiu baixar, sai do loop de blocos
-            else:
-                continue
-            break
-
-        time.sleep(2)  # espera entre cada ciclo de tentativa de download
-        counter += 1
-
-# Inicia o loop de download em background em uma thread separada
-download_thread = threading.Thread(target=download_loop, daemon=True)
-download_thread.start()
-download_thread.join()
+        time.sleep(60)  # mantém o processo vivo
+        stats = cache.stats()
+        logging.info(f"[{PEER_ID}] Cache: {stats['entries']} blocos, {stats['size_bytes']} bytes, "
+                     f"acertos {stats['hits']}, faltas {stats['misses']}, descartes {stats['evictions']}")
+except KeyboardInterrupt:
+    pass
+finally:
+    if seeders is not None:
+        seeders.stop()
+    for swarm in swarms:
+        swarm.file_manager.flush()
+        swarm.rebuild.save_progress()  # O próximo início só copia para a saída os blocos que faltam nela
+    logging.info(f"[{PEER_ID}] Índice de blocos gravado. Encerrando.")
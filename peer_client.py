@@ -1,71 +1,190 @@
-import socket
 import logging
-from typing import Set, Optional
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, InvalidStateError
+from typing import Dict, List, Optional, Set
 
-# Fallback para protocolo simples (até termos o real)
-# Monta uma mensagem GET para solicitar um bloco específico
-def build_get(block_id: int) -> str:
-    return f"GET {block_id}"
+from connection_pool import ConnectionPool, PeerChokedError, MAX_INFLIGHT, EVENT_HAVE, EVENT_BITFIELD, EVENT_CLOSED
+from bitfield import Bitfield
+from manifest import BlockVerificationError
 
-# Monta uma mensagem LIST para solicitar a lista de blocos disponíveis de um peer
-def build_list() -> str:
-    return "LIST"
-
-# Interpreta a mensagem recebida de outro peer e extrai o comando e o conteúdo
-def parse_message(data: bytes):
-    try:
-        if data.startswith(b"BLOCKS "):
-            payload = data[7:]
-            return "BLOCKS", None, payload
-
-        elif data.startswith(b"BLOCK "):
-            parts = data.split(b" ", 2)
-            if len(parts) == 3:
-                block_id = int(parts[1])
-                payload = parts[2]
-                return "BLOCK", block_id, payload
-
-    except:
-        pass  # Em caso de erro de parsing, retorna None
-    return None, None, None
+REQUEST_TIMEOUT = 5  # Tempo limite (s) para cada resposta
+VERIFY_WORKERS = 2   # Threads que calculam o hash dos blocos recebidos (fora da thread de rede)
 
 
 class PeerClient:
-    def __init__(self, peer_id: str, file_manager):
+    def __init__(self, peer_id: str, file_manager, max_inflight: int = MAX_INFLIGHT, index=None, manifest=None,
+                 pool: Optional[ConnectionPool] = None, info_hash: Optional[bytes] = None,
+                 verifier: Optional[ThreadPoolExecutor] = None):
         # Inicializa o cliente do peer, com o ID do peer e o gerenciador de arquivos
         self.peer_id = peer_id
         self.file_manager = file_manager
+        self.index = index  # AvailabilityIndex opcional, atualizado a cada bitfield/HAVE/desconexão
+        # Swarm deste cliente: com info_hash, cada conexão começa com HANDSHAKE
+        self.info_hash = info_hash
+        # Conexões persistentes com os demais peers, reaproveitadas entre requisições;
+        # o pool pode ser compartilhado por vários swarms do mesmo processo
+        self.owns_pool = pool is None
+        self.pool = pool if pool is not None else ConnectionPool(max_inflight=max_inflight)
+        self.pool.subscribe(info_hash, self._on_availability_update)
+        self.updated = threading.Event()  # Sinaliza HAVE/PEX recebido ou conexão encerrada
+        # Manifesto opcional: cada bloco recebido é conferido (tamanho + SHA-256) antes de ser salvo
+        self.manifest = manifest
+        self.owns_verifier = verifier is None and manifest is not None
+        if verifier is None and manifest is not None:
+            verifier = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix=f"{peer_id}-verify")
+        self.verifier = verifier
 
-    def get_peer_blocks(self, host: str, port: int) -> Optional[Set[int]]:
-        # Conecta-se a outro peer e solicita a lista de blocos disponíveis
-        try:
-            with socket.create_connection((host, port), timeout=5) as sock:
-                sock.sendall(build_list().encode())
-                data = sock.recv(4096)
-                cmd, _, payload = parse_message(data)
+    def _on_availability_update(self, conn, event, block_id) -> None:
+        if self.index is not None:
+            if event == EVENT_HAVE:
+                self.index.peer_has(conn.address, block_id)
+            elif event == EVENT_BITFIELD:
+                self.index.set_peer(conn.address, conn.remote_blocks)
+            elif event == EVENT_CLOSED:
+                self.index.remove_peer(conn.address)
+        self.updated.set()
+
+    def availability(self) -> Dict[str, Bitfield]:
+        """
+        Retorna o bitfield de cada peer conectado ("host:porta"), mantido
+        atualizado pelos anúncios HAVE recebidos após o LIST inicial.
+        """
+        return self.pool.availability(self.info_hash)
+
+    def choking(self) -> Set[str]:
+        # Peers que bloquearam nossos pedidos (enviaram CHOKE)
+        return self.pool.choking(self.info_hash)
+
+    def unchoked_peers(self) -> List[str]:
+        # Peers conectados que atendem nossos pedidos
+        choking = self.choking()
+        return [peer for peer in self.availability() if peer not in choking]
 
-                if cmd == "BLOCKS" and payload:
-                    decoded = payload.decode()
-                    block_ids = list(map(int, decoded.split(","))) if decoded else []
-                    return set(block_ids)  # Retorna o conjunto de blocos do peer
+    def connected_peers(self) -> Set[str]:
+        # Peers do swarm com conexão aberta a partir deste peer
+        return self.pool.addresses(self.info_hash)
+
+    def pex_peers(self) -> Set[str]:
+        # Peers do swarm que os peers conectados nos enviaram por PEX
+        return self.pool.pex_peers(self.info_hash)
+
+    def wait_for_update(self, timeout: float) -> bool:
+        # Espera até algum peer anunciar um bloco novo (ou o tempo acabar)
+        signaled = self.updated.wait(timeout)
+        self.updated.clear()
+        return signaled
+
+    def get_peer_blocks(self, host: str, port: int) -> Optional[Bitfield]:
+        # Solicita a outro peer a lista completa de blocos (troca inicial); depois disso chegam apenas HAVEs
+        try:
+            return self.pool.get(host, port, self.info_hash).request_list().result(timeout=REQUEST_TIMEOUT)  # Bitfield do peer
 
         except Exception as e:
             logging.warning(f"[{self.peer_id}] Falha ao obter blocos de {host}:{port} - {e}")
+            self.pool.discard(host, port, self.info_hash)
         return None  # Se falhar, retorna None
 
+    def fetch_block(self, host: str, port: int, block_id: int) -> Future:
+        # Envia um GET pela conexão persistente sem esperar a resposta; o Future recebe os dados do bloco
+        future = self.pool.get(host, port, self.info_hash).request_block(
+            block_id, timeout=REQUEST_TIMEOUT, block_size=self.file_manager.block_size)
+        if self.manifest is None:
+            return future
+        return self._verified(future, block_id)
+
+    def fetch_subblock(self, host: str, port: int, block_id: int, offset: int = 0,
+                       length: Optional[int] = None) -> Future:
+        # Pede um sub-bloco (ou, sem `length`, o bloco inteiro) sem verificação:
+        # o hash só pode ser conferido com o bloco completo (verify_block)
+        return self.pool.get(host, port, self.info_hash).request_block(
+            block_id, timeout=REQUEST_TIMEOUT, offset=offset, length=length, block_size=self.file_manager.block_size)
+
+    def verify_block(self, block_id: int, data: bytes) -> Future:
+        # Confere um bloco montado contra o manifesto em uma thread do verificador
+        result = Future()
+        if self.manifest is None:
+            result.set_result(data)
+            return result
+
+        def verify() -> None:
+            try:
+                result.set_result(self.manifest.check(block_id, data))
+            except Exception as e:
+                result.set_exception(e)
+
+        try:
+            self.verifier.submit(verify)
+        except RuntimeError as e:  # Verificador já encerrado
+            result.set_exception(e)
+        return result
+
+    def cancel_block(self, host: str, port: int, block_id: int, offset: int = 0, length: Optional[int] = None) -> bool:
+        # Desiste de um pedido em andamento (ex.: endgame); o Future do pedido ainda recebe a resposta
+        return self.pool.cancel(host, port, block_id, self.info_hash, offset, length)
+
+    def _verified(self, network_future: Future, block_id: int) -> Future:
+        """
+        Encadeia a verificação do bloco: a resposta da rede é conferida contra
+        o manifesto em uma thread do verificador, e o Future retornado só
+        recebe os dados se o hash conferir (senão, BlockVerificationError).
+        Cancelar o Future retornado cancela também o pedido na conexão.
+        """
+        result = Future()
+
+        def resolve(setter, value) -> None:
+            try:
+                setter(value)
+            except InvalidStateError:
+                pass  # Já cancelado por quem pediu (ex.: tempo esgotado)
+
+        def verify(data: bytes) -> None:
+            try:
+                resolve(result.set_result, self.manifest.check(block_id, data))
+            except Exception as e:
+                resolve(result.set_exception, e)
+
+        def on_network_done(f: Future) -> None:
+            if f.cancelled():
+                result.cancel()
+            elif f.exception() is not None:
+                resolve(result.set_exception, f.exception())
+            else:
+                try:
+                    self.verifier.submit(verify, f.result())
+                except RuntimeError as e:  # Verificador já encerrado
+                    resolve(result.set_exception, e)
+
+        result.add_done_callback(lambda f: network_future.cancel() if f.cancelled() else None)
+        network_future.add_done_callback(on_network_done)
+        return result
+
     def request_block(self, host: str, port: int, block_id: int) -> bool:
         # Solicita um bloco específico a outro peer e salva o bloco, se recebido com sucesso
         try:
-            with socket.create_connection((host, port), timeout=5) as sock:
-                sock.sendall(build_get(block_id).encode())
-                response = sock.recv(4096 + 64)
-
-                cmd, received_id, data = parse_message(response)
-                if cmd == "BLOCK" and received_id == block_id and data:
-                    self.file_manager.save_block(block_id, data)
-                    logging.info(f"[{self.peer_id}] Bloco {block_id} recebido de {host}:{port}")
-                    return True  # Sucesso na requisição
+            data = self.fetch_block(host, port, block_id).result(timeout=REQUEST_TIMEOUT)
+            if data:
+                self.file_manager.save_block(block_id, data)
+                logging.info(f"[{self.peer_id}] Bloco {block_id} recebido de {host}:{port}")
+                return True  # Sucesso na requisição
 
+        except LookupError as e:
+            logging.warning(f"[{self.peer_id}] Peer {host}:{port} não possui o bloco {block_id} - {e}")
+        except PeerChokedError as e:
+            # A conexão continua aberta; o peer volta a atender após um UNCHOKE
+            logging.info(f"[{self.peer_id}] {e}")
+        except BlockVerificationError as e:
+            # A conexão continua válida; o bloco é descartado e pode ser pedido de novo
+            logging.warning(f"[{self.peer_id}] Bloco inválido recebido de {host}:{port} - {e}")
         except Exception as e:
             logging.warning(f"[{self.peer_id}] Erro ao solicitar bloco {block_id} de {host}:{port} - {e}")
+            self.pool.discard(host, port, self.info_hash)
         return False  # Falha na requisição
+
+    def close(self) -> None:
+        # Encerra as conexões abertas (só as deste swarm, se o pool for compartilhado)
+        if self.owns_pool:
+            self.pool.close_all()
+        else:
+            self.pool.close_swarm(self.info_hash)
+        if self.owns_verifier:
+            self.verifier.shutdown(wait=False)
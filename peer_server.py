@@ -1,19 +1,208 @@
+import asyncio
 import socket
+import struct
 import threading
+import time
 import logging
+from collections import deque
+from typing import Dict, Iterable, Optional, Set
+from compression import CODEC_NONE, DEFAULT_LEVELS, choose_codec
 from file_manager import FileManager
-from protocol import parse_message, build_block, build_blocks_list, build_error
+from protocol import (
+    parse_message, parse_handshake, parse_flags, parse_range, recv_frame, read_frame_async,
+    build_header, build_block, build_subblock, build_blocks_list, build_have, build_error, build_handshake,
+    build_choke, build_cancel, build_pex, CMD_BLOCK, CMD_SUBBLOCK, CMD_HANDSHAKE, CMD_CANCEL, NO_INFO_HASH,
+    SUBBLOCK_OFFSET, HANDSHAKE_PEX,
+)
+from metrics import REGISTRY
+from rate import RateMeters, RateLimiter
+
+MAX_CONNECTIONS = 256              # Limite de conexões simultâneas no modo assíncrono
+WRITE_BUFFER_HIGH = 4 * 1024 * 1024  # Acima disso, o servidor para de ler pedidos até o cliente consumir as respostas
+SENDFILE_THRESHOLD = 16 * 1024     # Blocos a partir deste tamanho são enviados direto do arquivo (sendfile)
+UPLOAD_SLOTS = 5                   # Peers atendidos ao mesmo tempo (4 fixos + 1 otimista, como na Strategy)
+MAX_QUEUED_REQUESTS = 64           # Pedidos lidos à frente por conexão (onde um CANCEL ainda alcança o GET)
+PEX_MAX_ADDED = 50                 # Endereços novos enviados por mensagem PEX (o restante vai nas seguintes)
+
+UPLOAD_BYTES = REGISTRY.counter("p2p_upload_bytes_total", "Bytes de blocos enviados, por peer remoto", ["peer"])
+RECEIVED_REQUESTS = REGISTRY.counter("p2p_received_requests_total", "Pedidos recebidos pelo servidor, por comando", ["command"])
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+
+def pex_delta(sent: Set[str], peers: Set[str], own: str) -> Optional[bytes]:
+    """
+    Monta a mensagem PEX de uma conexão: os peers que ela ainda não recebeu
+    (até PEX_MAX_ADDED, sem o próprio peer remoto) e os que já recebeu e
+    saíram do swarm. Atualiza `sent`; retorna None se não houver mudança.
+    """
+    added = [peer for peer in peers - sent if peer != own][:PEX_MAX_ADDED]
+    dropped = list(sent - peers)
+    if not added and not dropped:
+        return None
+    sent.update(added)
+    sent.difference_update(dropped)
+    return build_pex(added, dropped)
+
+
 class PeerServer:
-    def __init__(self, peer_id, host='0.0.0.0', port=0, file_manager: FileManager = None):
+    """
+    Servidor de blocos do peer (uma thread por conexão).
+
+    Só atende GETs dos peers desbloqueados (unchoked): até `upload_slots`
+    peers ao mesmo tempo, escolhidos pela Strategy via set_unchoked(); os
+    demais recebem CHOKE. Os envios passam por um limite de taxa global e
+    por peer (0 = sem limite) e alimentam os medidores de upload.
+    """
+
+    def __init__(self, peer_id, host='0.0.0.0', port=0, file_manager: FileManager = None,
+                 upload_slots: int = UPLOAD_SLOTS, max_upload_rate: float = 0, max_peer_upload_rate: float = 0,
+                 compression: int = CODEC_NONE, compression_level: Optional[int] = None, reuse_port: bool = False):
         # Inicializa o servidor com o ID do peer, o IP/porta para escutar, e o gerenciador de arquivos
         self.peer_id = peer_id
         self.host = host
         self.port = port
-        self.file_manager = file_manager
+        self.file_manager = file_manager  # Swarm usado por conexões que não enviam HANDSHAKE
         self.running = True  # Controla se o servidor deve continuar rodando
+        self.server_socket = None
+        self.ready = threading.Event()  # Sinalizado quando a porta está associada e aceitando conexões
+        self.reuse_port = reuse_port  # SO_REUSEPORT: vários processos (workers do seeder) escutam na mesma porta
+        # Swarms atendidos por este servidor: info_hash -> FileManager (uma porta para todos os arquivos)
+        self.swarms = {}
+        # Conexões que já receberam o LIST inicial e passam a receber HAVE a cada bloco novo
+        self.subscribers = {}  # socket -> (trava de envio da conexão, info_hash do swarm)
+        self.subscribers_lock = threading.Lock()
+        # Conexões ativas: socket -> (trava de envio, peer remoto, info_hash do swarm)
+        self.sessions = {}
+        # Conexões que aceitaram PEX no HANDSHAKE: socket -> peers já enviados a ela
+        self.pex_sent: Dict[socket.socket, Set[str]] = {}
+        # Choking: peers remotos ("host:porta" de escuta) que podem baixar deste servidor
+        self.upload_slots = upload_slots
+        self.unchoked: Set[str] = set()
+        self.choke_lock = threading.Lock()
+        self.upload_rates = RateMeters()  # Bytes/s enviados a cada peer (ranking do tit-for-tat como seeder)
+        self.limiter = RateLimiter(max_upload_rate, max_peer_upload_rate)
+        # Compressão oferecida aos clientes que a aceitam no HANDSHAKE (CODEC_NONE = blocos sempre sem compressão)
+        self.compression = compression
+        self.compression_level = DEFAULT_LEVELS[compression] if compression_level is None else compression_level
+        if file_manager is not None:
+            self.add_swarm(file_manager)
+
+    def add_swarm(self, file_manager: FileManager) -> None:
+        """
+        Passa a atender o swarm do FileManager (identificado pelo seu info_hash).
+        """
+        info_hash = file_manager.info_hash
+        self.swarms[info_hash] = file_manager
+        file_manager.add_listener(lambda block_id: self.announce_have(block_id, info_hash))
+
+    def handshake(self, payload, addr, offered: int = 0):
+        """
+        Trata um HANDSHAKE: retorna (FileManager do swarm, resposta, peer
+        remoto, codec da conexão). O FileManager é None se o swarm não for
+        atendido aqui. `offered` são as flags do HANDSHAKE (codecs que o
+        cliente aceita); o codec escolhido volta nas flags da resposta.
+        """
+        info_hash, advertised = parse_handshake(payload)
+        key = self.peer_key(addr, advertised)
+        file_manager = self.swarms.get(info_hash)
+        if file_manager is None:
+            return None, build_error("Unknown swarm"), key, CODEC_NONE
+        codec = choose_codec(offered, self.compression)
+        return file_manager, build_handshake(info_hash, flags=codec), key, codec
+
+    # ------------------------------------------------------------------
+    # Choking e limite de upload
+    # ------------------------------------------------------------------
+
+    def peer_key(self, addr, advertised=None) -> str:
+        # O peer remoto é identificado pelo endereço de escuta anunciado no HANDSHAKE
+        # (o mesmo do tracker); sem ele, pelo endereço de origem da conexão
+        if advertised is None:
+            return f"{addr[0]}:{addr[1]}"
+        host = addr[0] if advertised[0] == "0.0.0.0" else advertised[0]
+        return f"{host}:{advertised[1]}"
+
+    def admit(self, key: str) -> bool:
+        # True se o peer pode baixar; ocupa um slot livre se houver (peers novos não esperam a próxima rodada)
+        with self.choke_lock:
+            if key in self.unchoked:
+                return True
+            if len(self.unchoked) < self.upload_slots:
+                self.unchoked.add(key)
+                return True
+            return False
+
+    def set_unchoked(self, keys: Iterable[str]) -> None:
+        """
+        Define os peers desbloqueados (decisão da Strategy) e avisa com
+        CHOKE/UNCHOKE os peers cuja situação mudou.
+        """
+        keys = set(list(keys)[:self.upload_slots])
+        with self.choke_lock:
+            changed = self.unchoked ^ keys
+            self.unchoked = keys
+        for key in changed:
+            self.push_to_peer(key, build_choke(key not in keys))
+
+    def release(self, key: str) -> None:
+        # Libera o slot de um peer que não tem mais conexões abertas
+        if key not in self.connected_peers():
+            with self.choke_lock:
+                self.unchoked.discard(key)
+            self.limiter.discard(key)
+
+    def account_upload(self, key: str, size: int) -> float:
+        # Registra um envio para o peer e retorna quanto esperar antes dele (limite de taxa)
+        self.upload_rates.update(key, size)
+        UPLOAD_BYTES.labels(key).inc(size)
+        return self.limiter.reserve(key, size)
+
+    def connected_peers(self) -> Dict[str, Set[bytes]]:
+        # Peers com conexões abertas e os swarms (info_hash) de cada uma
+        with self.subscribers_lock:
+            sessions = list(self.sessions.values())
+        peers: Dict[str, Set[bytes]] = {}
+        for _, key, info_hash in sessions:
+            peers.setdefault(key, set()).add(info_hash)
+        return peers
+
+    def connection_count(self) -> int:
+        return len(self.sessions)
+
+    def queued_requests(self) -> int:
+        # Cada conexão atende um pedido por vez, sem fila
+        return 0
+
+    def push_to_peer(self, key: str, message: bytes) -> None:
+        # Envia uma mensagem sem pedido prévio a todas as conexões do peer
+        with self.subscribers_lock:
+            targets = [(sock, lock) for sock, (lock, peer, _) in self.sessions.items() if peer == key]
+        for sock, send_lock in targets:
+            try:
+                with send_lock:
+                    sock.sendall(message)
+            except OSError:
+                pass
+
+    def send_pex(self, info_hash: bytes, peers: Iterable[str]) -> None:
+        """
+        Envia a cada conexão do swarm que aceitou PEX o delta entre `peers`
+        (os peers ativos do swarm, "host:porta") e o que ela já recebeu.
+        """
+        peers = set(peers)
+        with self.subscribers_lock:
+            targets = [(sock, self.sessions[sock], sent) for sock, sent in self.pex_sent.items()
+                       if sock in self.sessions and self.sessions[sock][2] == info_hash]
+        for sock, (send_lock, key, _), sent in targets:
+            message = pex_delta(sent, peers, key)
+            if message is None:
+                continue
+            try:
+                with send_lock:
+                    sock.sendall(message)
+            except OSError:
+                pass
 
     def start(self):
         """
@@ -21,45 +210,432 @@ class PeerServer:
         """
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Permite reuso da porta
+        if self.reuse_port:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)  # O kernel reparte as conexões entre os processos
         server.bind((self.host, self.port))  # Associa o socket ao endereço e porta
         server.listen()
+        self.server_socket = server
         self.port = server.getsockname()[1]  # Captura a porta real usada (caso tenha sido 0)
+        self.ready.set()
         logging.info(f"[{self.peer_id}] Servidor ouvindo em {self.host}:{self.port}")
 
         # Loop principal: aceita conexões e trata cada uma em uma thread separada
-        while self.running:
+        with server:
+            while self.running:
+                try:
+                    client_socket, addr = server.accept()
+                    threading.Thread(target=self.handle_client, args=(client_socket, addr), daemon=True).start()
+                except Exception as e:
+                    if not self.running:
+                        break  # O socket foi fechado por stop()
+                    logging.error(f"[{self.peer_id}] Erro ao aceitar conexão: {e}")
+        logging.info(f"[{self.peer_id}] Servidor encerrado")
+
+    def stop(self):
+        """
+        Encerra o servidor, interrompendo o accept() bloqueado.
+        """
+        self.running = False
+        if self.server_socket is not None:
             try:
-                client_socket, addr = server.accept()
-                threading.Thread(target=self.handle_client, args=(client_socket, addr), daemon=True).start()
-            except Exception as e:
-                logging.error(f"[{self.peer_id}] Erro ao aceitar conexão: {e}")
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server_socket.close()
 
     def handle_client(self, sock, addr):
         """
-        Trata a solicitação de um peer (LIST ou GET).
+        Atende um peer pela mesma conexão até que ele a encerre.
+        Cada quadro recebido (LIST ou GET) gera exatamente uma resposta, na ordem de chegada.
         """
+        send_lock = threading.Lock()  # Respostas e anúncios HAVE não podem se intercalar no socket
+        file_manager = self.file_manager  # Swarm da conexão; trocado pelo HANDSHAKE
+        key = self.peer_key(addr)  # Peer remoto; trocado pelo endereço anunciado no HANDSHAKE
+        codec = CODEC_NONE  # Compressão negociada no HANDSHAKE
+        info_hash = file_manager.info_hash if file_manager is not None else NO_INFO_HASH
+        with self.subscribers_lock:
+            self.sessions[sock] = (send_lock, key, info_hash)
         try:
             with sock:
-                data = sock.recv(4096)  # Recebe a mensagem enviada pelo peer cliente
-                cmd, block_id, payload = parse_message(data)  # Interpreta a mensagem
-
-                if cmd == "GET":
-                    # Se for um pedido de bloco, tenta obter o bloco e enviar
-                    block_data = self.file_manager.get_block(block_id)
-                    if block_data:
-                        sock.sendall(build_block(block_id, block_data))
-                    else:
-                        sock.sendall(build_error("Block not found").encode())
+                while self.running:
+                    data = recv_frame(sock)  # Recebe exatamente um quadro enviado pelo peer cliente
+                    if data is None:
+                        return  # O peer encerrou a conexão
+                    cmd, block_id, payload = parse_message(data)
+                    RECEIVED_REQUESTS.labels(cmd).inc()
+                    if cmd == CMD_CANCEL:
+                        continue  # Os pedidos são atendidos na ordem: o GET cancelado já foi respondido
+                    if cmd == CMD_HANDSHAKE:
+                        flags = parse_flags(data)
+                        file_manager, response, key, codec = self.handshake(payload, addr, flags)
+                        with send_lock:
+                            sock.sendall(response)
+                        if file_manager is None:
+                            return  # Swarm desconhecido: encerra a conexão
+                        with self.subscribers_lock:
+                            self.sessions[sock] = (send_lock, key, file_manager.info_hash)
+                            if flags & HANDSHAKE_PEX:
+                                self.pex_sent[sock] = set()
+                        if not self.admit(key):
+                            with send_lock:
+                                sock.sendall(build_choke())  # Sem slot livre: o peer espera um UNCHOKE
+                        continue
+                    if cmd == "GET" and not self.admit(key):
+                        with send_lock:
+                            sock.sendall(build_choke())  # Pedido de um peer bloqueado
+                        continue
+                    if cmd == "LIST" and file_manager is not None:
+                        # A partir do LIST, o peer passa a receber HAVE (inscrito antes do retrato para não perder nenhum)
+                        with self.subscribers_lock:
+                            self.subscribers[sock] = (send_lock, file_manager.info_hash)
+                    # Com compressão a resposta é montada em memória (o cache guarda a forma comprimida)
+                    span = self.sendfile_span(cmd, block_id, file_manager, payload) if not codec else None
+                    response = None if span is not None else self.handle_request(cmd, block_id, payload, file_manager, codec)
+                    if cmd == "GET":
+                        time.sleep(self.account_upload(key, span[3] if span is not None else len(response)))
+                    with send_lock:
+                        if span is not None:
+                            # Envia o cabeçalho e depois o bloco direto do arquivo, sem passar pela memória do processo
+                            header, block_file, offset, length = span
+                            sock.sendall(header)
+                            sock.sendfile(block_file, offset, length)
+                        else:
+                            sock.sendall(response)
 
-                elif cmd == "LIST":
-                    # Se for um pedido de lista de blocos, envia todos os blocos disponíveis
-                    blocks = self.file_manager.load_blocks()
-                    response = build_blocks_list(blocks)
-                    sock.sendall(response.encode())
+        except Exception as e:
+            logging.error(f"[{self.peer_id}] Erro com cliente {addr}: {e}")
+        finally:
+            with self.subscribers_lock:
+                self.subscribers.pop(sock, None)
+                self.sessions.pop(sock, None)
+                self.pex_sent.pop(sock, None)
+            self.release(key)
 
-                else:
-                    # Qualquer comando inválido é respondido com mensagem de erro
-                    sock.sendall(build_error("Invalid command").encode())
+    def announce_have(self, block_id, info_hash=NO_INFO_HASH):
+        """
+        Envia HAVE <id> às conexões inscritas no swarm (chamado quando o FileManager salva um bloco).
+        """
+        message = build_have(block_id)
+        with self.subscribers_lock:
+            subscribers = [(sock, lock) for sock, (lock, swarm) in self.subscribers.items() if swarm == info_hash]
+        for sock, send_lock in subscribers:
+            try:
+                with send_lock:
+                    sock.sendall(message)
+            except OSError:
+                with self.subscribers_lock:
+                    self.subscribers.pop(sock, None)
 
+    def sendfile_span(self, cmd, block_id, file_manager=None, payload=None):
+        """
+        Retorna (cabeçalho, arquivo, offset, tamanho) se a resposta a este
+        pedido (bloco inteiro ou sub-bloco) puder ir direto do disco com
+        sendfile; caso contrário, None.
+        """
+        file_manager = file_manager or self.file_manager
+        if cmd != "GET" or file_manager is None:
+            return None
+        span = file_manager.block_span(block_id)
+        if span is None:
+            return None
+        block_file, offset, length = span
+        if payload is None:
+            if length < SENDFILE_THRESHOLD:
+                return None  # Blocos pequenos saem mais baratos em um único write
+            return build_header(CMD_BLOCK, block_id, length), block_file, offset, length
+        try:
+            start, size = parse_range(payload)
+        except struct.error:
+            return None  # Faixa mal formada: handle_request responde com erro
+        if size < SENDFILE_THRESHOLD or start + size > length:
+            return None
+        header = build_header(CMD_SUBBLOCK, block_id, SUBBLOCK_OFFSET.size + size) + SUBBLOCK_OFFSET.pack(start)
+        return header, block_file, offset + start, size
+
+    def handle_request(self, cmd, block_id, payload, file_manager=None, codec: int = CODEC_NONE) -> bytes:
+        """
+        Monta a resposta para uma mensagem já interpretada (LIST ou GET) do swarm indicado.
+        Com `codec`, os dados do bloco vão comprimidos sempre que encolhem.
+        """
+        file_manager = file_manager or self.file_manager
+        if file_manager is None and cmd in ("GET", "LIST"):
+            return build_error("Handshake required", block_id or 0)
+
+        if cmd == "GET":
+            # Se for um pedido de bloco, tenta obter o bloco e enviar
+            block_data = file_manager.get_block(block_id)
+            if not block_data:
+                return build_error("Block not found", block_id)
+            if payload is None:
+                data, flags = file_manager.compressed_block(block_id, block_data, codec, self.compression_level)
+                return build_block(block_id, data, flags)
+            # Pedido de sub-bloco: só a faixa pedida, precedida do offset
+            try:
+                start, size = parse_range(payload)
+            except struct.error:
+                return build_error("Invalid range", block_id)
+            if not size or start + size > len(block_data):
+                return build_error("Invalid range", block_id)
+            data, flags = file_manager.compressed_block(block_id, memoryview(block_data)[start:start + size], codec,
+                                                        self.compression_level, start)
+            return build_subblock(block_id, start, data, flags)
+
+        if cmd == "LIST":
+            # Se for um pedido de lista de blocos, envia todos os blocos disponíveis
+            blocks = file_manager.load_blocks()
+            return build_blocks_list(blocks)
+
+        # Qualquer comando inválido é respondido com mensagem de erro
+        return build_error("Invalid command")
+
+
+class AsyncConnection:
+    """
+    Estado de uma conexão atendida pelo AsyncPeerServer.
+    """
+
+    def __init__(self, writer, task, file_manager=None, peer_key=None):
+        self.writer = writer
+        self.task = task
+        self.file_manager = file_manager  # Swarm atendido nesta conexão (escolhido pelo HANDSHAKE)
+        self.peer_key = peer_key  # Peer remoto ("host:porta" de escuta), usado no choking e nas taxas
+        self.codec = CODEC_NONE  # Compressão negociada no HANDSHAKE
+        self.pex_sent: Optional[Set[str]] = None  # Peers já enviados por PEX (None = o cliente não aceita PEX)
+        self.subscribed = False  # Recebe HAVE após o LIST inicial
+        self.sending_file = False  # Durante um sendfile nada mais pode ser escrito no socket
+        self.backlog = []  # Anúncios HAVE adiados enquanto o sendfile está em andamento
+        self.requests = deque()  # Pedidos lidos e ainda não atendidos: (comando, id do bloco, payload, flags)
+        self.requests_changed = asyncio.Condition()
+        self.eof = False  # O peer encerrou o envio de pedidos
+
+    def push(self, message: bytes) -> None:
+        if self.sending_file:
+            self.backlog.append(message)
+        else:
+            self.writer.write(message)
+
+    def flush_backlog(self) -> None:
+        if self.backlog:
+            self.writer.write(b"".join(self.backlog))
+            self.backlog.clear()
+
+
+class AsyncPeerServer(PeerServer):
+    """
+    Servidor do peer baseado em asyncio: um único event loop atende todas as
+    conexões, em vez de uma thread por conexão. Mantém a mesma semântica de
+    LIST/GET do PeerServer.
+    """
+
+    def __init__(self, peer_id, host='0.0.0.0', port=0, file_manager: FileManager = None,
+                 max_connections: int = MAX_CONNECTIONS, write_buffer_high: int = WRITE_BUFFER_HIGH,
+                 upload_slots: int = UPLOAD_SLOTS, max_upload_rate: float = 0, max_peer_upload_rate: float = 0,
+                 compression: int = CODEC_NONE, compression_level: Optional[int] = None, reuse_port: bool = False):
+        super().__init__(peer_id, host, port, file_manager, upload_slots, max_upload_rate, max_peer_upload_rate,
+                         compression, compression_level, reuse_port)
+        self.max_connections = max_connections
+        self.write_buffer_high = write_buffer_high
+        self.connections = {}  # Writer -> AsyncConnection de cada conexão ativa
+        self.loop = None
+        self.stopped = None
+
+    def start(self):
+        """
+        Executa o event loop do servidor até stop() ser chamado (bloqueante, como PeerServer.start).
+        """
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        if not self.running:
+            return  # stop() foi chamado antes do servidor subir
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port, reuse_address=True,
+                                            reuse_port=self.reuse_port or None)
+        self.port = server.sockets[0].getsockname()[1]  # Captura a porta real usada (caso tenha sido 0)
+        self.ready.set()
+        logging.info(f"[{self.peer_id}] Servidor assíncrono ouvindo em {self.host}:{self.port} "
+                     f"(máx. {self.max_connections} conexões)")
+
+        async with server:
+            await self.stopped.wait()
+            server.close()
+            # Fecha as conexões ativas e espera os handlers terminarem
+            tasks = [conn.task for conn in self.connections.values()]
+            for writer in list(self.connections):
+                writer.close()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await server.wait_closed()
+        logging.info(f"[{self.peer_id}] Servidor encerrado")
+
+    def stop(self):
+        """
+        Encerra o servidor de forma limpa; pode ser chamado de qualquer thread.
+        """
+        self.running = False
+        if self.loop is not None and self.stopped is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    def announce_have(self, block_id, info_hash=NO_INFO_HASH):
+        """
+        Agenda o envio de HAVE <id> no event loop (pode ser chamado de qualquer thread).
+        """
+        if self.loop is not None and self.running:
+            self.loop.call_soon_threadsafe(self._broadcast_have, block_id, info_hash)
+
+    def connection_count(self) -> int:
+        return len(self.connections)
+
+    def queued_requests(self) -> int:
+        # Pedidos lidos e ainda não atendidos, somando todas as conexões
+        return sum(len(conn.requests) for conn in list(self.connections.values()))
+
+    def connected_peers(self) -> Dict[str, Set[bytes]]:
+        peers: Dict[str, Set[bytes]] = {}
+        for conn in list(self.connections.values()):
+            if conn.file_manager is not None:
+                peers.setdefault(conn.peer_key, set()).add(conn.file_manager.info_hash)
+        return peers
+
+    def push_to_peer(self, key: str, message: bytes) -> None:
+        # Agenda o envio no event loop (pode ser chamado de qualquer thread)
+        if self.loop is not None and self.running:
+            self.loop.call_soon_threadsafe(self._push_to_peer, key, message)
+
+    def _push_to_peer(self, key, message):
+        for conn in list(self.connections.values()):
+            if conn.peer_key == key and not conn.writer.is_closing():
+                conn.push(message)
+
+    def send_pex(self, info_hash: bytes, peers: Iterable[str]) -> None:
+        # Agenda o envio no event loop (pode ser chamado de qualquer thread)
+        if self.loop is not None and self.running:
+            self.loop.call_soon_threadsafe(self._send_pex, info_hash, set(peers))
+
+    def _send_pex(self, info_hash, peers):
+        for conn in list(self.connections.values()):
+            if (conn.pex_sent is not None and conn.file_manager.info_hash == info_hash
+                    and not conn.writer.is_closing()):
+                message = pex_delta(conn.pex_sent, peers, conn.peer_key)
+                if message is not None:
+                    conn.push(message)
+
+    def _broadcast_have(self, block_id, info_hash):
+        message = build_have(block_id)
+        for conn in list(self.connections.values()):
+            if conn.subscribed and conn.file_manager.info_hash == info_hash and not conn.writer.is_closing():
+                conn.push(message)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Atende um peer até que ele encerre a conexão.
+
+        Os pedidos são lidos à frente (até MAX_QUEUED_REQUESTS) por uma tarefa
+        separada, para que um CANCEL retire da fila o GET ainda não atendido.
+        Cada resposta só é seguida da próxima depois que o buffer de escrita
+        drena abaixo do limite, o que aplica backpressure a clientes lentos
+        em vez de acumular respostas na memória.
+        """
+        addr = writer.get_extra_info("peername")
+        if len(self.connections) >= self.max_connections:
+            logging.warning(f"[{self.peer_id}] Limite de conexões atingido; recusando {addr}")
+            writer.close()
+            return
+
+        writer.transport.set_write_buffer_limits(high=self.write_buffer_high)
+        conn = AsyncConnection(writer, asyncio.current_task(), self.file_manager, self.peer_key(addr))
+        self.connections[writer] = conn
+        read_task = asyncio.create_task(self.read_requests(reader, conn, addr))
+        try:
+            while self.running:
+                async with conn.requests_changed:
+                    await conn.requests_changed.wait_for(lambda: conn.requests or conn.eof)
+                    if not conn.requests:
+                        break  # O peer encerrou a conexão
+                    cmd, block_id, payload, flags = conn.requests.popleft()
+                    conn.requests_changed.notify_all()
+                if cmd == CMD_HANDSHAKE:
+                    file_manager, response, conn.peer_key, conn.codec = self.handshake(payload, addr, flags)
+                    writer.write(response)
+                    if file_manager is None:
+                        await writer.drain()
+                        break  # Swarm desconhecido: encerra a conexão
+                    conn.file_manager = file_manager
+                    if flags & HANDSHAKE_PEX:
+                        conn.pex_sent = set()
+                    if not self.admit(conn.peer_key):
+                        writer.write(build_choke())  # Sem slot livre: o peer espera um UNCHOKE
+                    await writer.drain()
+                    continue
+                if cmd == "GET" and not self.admit(conn.peer_key):
+                    conn.push(build_choke())  # Pedido de um peer bloqueado
+                    await writer.drain()
+                    continue
+                if cmd == "LIST" and conn.file_manager is not None:
+                    conn.subscribed = True  # A partir do LIST, o peer passa a receber HAVE
+                span = self.sendfile_span(cmd, block_id, conn.file_manager, payload) if not conn.codec else None
+                if span is not None:
+                    header, block_file, offset, length = span
+                    delay = self.account_upload(conn.peer_key, length)
+                    if delay > 0:
+                        await asyncio.sleep(delay)  # Limite de taxa de upload
+                    conn.sending_file = True  # Nenhum HAVE pode entrar entre o cabeçalho e os dados
+                    try:
+                        writer.write(header)
+                        await writer.drain()
+                        await self.loop.sendfile(writer.transport, block_file, offset, length)
+                    finally:
+                        conn.sending_file = False
+                        conn.flush_backlog()
+                else:
+                    if cmd == "GET" and conn.codec:
+                        # A compressão (na primeira vez que o bloco é pedido) roda fora do event loop
+                        response = await self.loop.run_in_executor(
+                            None, self.handle_request, cmd, block_id, payload, conn.file_manager, conn.codec)
+                    else:
+                        response = self.handle_request(cmd, block_id, payload, conn.file_manager)
+                    if cmd == "GET":
+                        delay = self.account_upload(conn.peer_key, len(response))
+                        if delay > 0:
+                            await asyncio.sleep(delay)  # Limite de taxa de upload
+                    writer.write(response)
+                    await writer.drain()
+        except ConnectionError:
+            pass
         except Exception as e:
             logging.error(f"[{self.peer_id}] Erro com cliente {addr}: {e}")
+        finally:
+            read_task.cancel()
+            self.connections.pop(writer, None)
+            writer.close()
+            self.release(conn.peer_key)
+
+    async def read_requests(self, reader, conn, addr):
+        # Lê os pedidos da conexão para a fila; CANCEL retira da fila o GET correspondente e é confirmado
+        try:
+            while self.running:
+                data = await read_frame_async(reader)
+                if data is None:
+                    break
+                cmd, block_id, payload = parse_message(data)
+                RECEIVED_REQUESTS.labels(cmd).inc()
+                async with conn.requests_changed:
+                    if cmd == CMD_CANCEL:
+                        # O CANCEL traz a mesma faixa do GET (payload vazio = bloco inteiro)
+                        queued = next((r for r in conn.requests
+                                       if r[0] == "GET" and r[1] == block_id and r[2] == payload), None)
+                        if queued is not None:
+                            conn.requests.remove(queued)
+                            conn.push(build_cancel(block_id, *parse_range(payload)))
+                        continue  # Já atendido (ou em andamento): a resposta BLOCK segue normalmente
+                    await conn.requests_changed.wait_for(lambda: len(conn.requests) < MAX_QUEUED_REQUESTS)
+                    conn.requests.append((cmd, block_id, payload, parse_flags(data)))
+                    conn.requests_changed.notify_all()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logging.error(f"[{self.peer_id}] Erro ao ler pedidos de {addr}: {e}")
+        finally:
+            async with conn.requests_changed:
+                conn.eof = True
+                conn.requests_changed.notify_all()
@@ -1,46 +1,175 @@
-from typing import Optional, Tuple, Iterable
+from typing import Optional, Tuple, Iterable, List
+import asyncio
 import logging
+import socket
+import struct
+
+from bitfield import Bitfield
 
 # Constantes dos comandos suportados
 CMD_GET = "GET"         # Solicita um bloco específico
 CMD_LIST = "LIST"       # Solicita a lista de blocos disponíveis
 CMD_BLOCK = "BLOCK"     # Resposta com o bloco solicitado
-CMD_BLOCKS = "BLOCKS"   # Resposta com a lista de blocos disponíveis
+CMD_BLOCKS = "BLOCKS"   # Resposta com o bitfield dos blocos disponíveis
 CMD_ERROR = "ERROR"     # Mensagem de erro
+CMD_HAVE = "HAVE"       # Aviso (push) de que um novo bloco ficou disponível
+CMD_HANDSHAKE = "HANDSHAKE"  # Primeira mensagem da conexão: escolhe o swarm (info_hash) atendido
+CMD_CHOKE = "CHOKE"     # Aviso (push) de que o servidor deixou de atender os pedidos deste peer
+CMD_UNCHOKE = "UNCHOKE" # Aviso (push) de que o servidor voltou a atender os pedidos deste peer
+CMD_CANCEL = "CANCEL"   # Desiste de um GET; o servidor confirma com CANCEL se o pedido ainda não foi atendido
+CMD_SUBBLOCK = "SUBBLOCK"  # Resposta a um GET de sub-bloco: offset (4B) + dados
+CMD_PEX = "PEX"         # Aviso (push) com os peers do swarm que entraram e saíram desde o último PEX
 CMD_INVALID = "INVALID" # Mensagem mal formatada
 CMD_UNKNOWN = "UNKNOWN" # Comando desconhecido
 
+# ----------------------
+# Formato do quadro (frame) binário
+# ----------------------
+# Cada mensagem trafega como um cabeçalho fixo seguido do payload:
+#
+#   versão (1B) | tipo (1B) | flags (1B) | reservado (1B) | id do bloco (4B) | tamanho do payload (4B)
+#
+# Todos os inteiros em ordem de rede (big-endian). O tamanho explícito permite
+# ler exatamente um quadro do socket, independentemente do tamanho do bloco.
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("!BBBBII")
+HEADER_SIZE = HEADER.size
+MAX_PAYLOAD = 64 * 1024 * 1024  # Limite de segurança para o payload de um único quadro
+INFO_HASH_SIZE = 20
+NO_INFO_HASH = bytes(INFO_HASH_SIZE)  # Swarm padrão (conexões sem HANDSHAKE, arquivos sem manifesto)
+# Faixa de um sub-bloco: offset e tamanho dentro do bloco (payload do GET/CANCEL de sub-bloco).
+# Um GET sem payload pede o bloco inteiro e é respondido com BLOCK.
+SUBBLOCK_RANGE = struct.Struct("!II")
+SUBBLOCK_OFFSET = struct.Struct("!I")
+# Endereço de escuta anunciado no HANDSHAKE (IPv4 + porta), o mesmo registrado no tracker
+HANDSHAKE_ADDRESS = struct.Struct("!4sH")
+# Flag do HANDSHAKE do cliente: aceita receber PEX (os bits baixos são os codecs de compressão aceitos)
+HANDSHAKE_PEX = 0x80
+# PEX: nº de endereços que entraram e que saíram (2B cada), seguidos dos endereços no formato do HANDSHAKE
+PEX_COUNTS = struct.Struct("!HH")
+
+# Códigos numéricos de cada tipo de mensagem no fio
+MSG_TYPES = {
+    CMD_GET: 1,
+    CMD_LIST: 2,
+    CMD_BLOCK: 3,
+    CMD_BLOCKS: 4,
+    CMD_ERROR: 5,
+    CMD_HAVE: 6,
+    CMD_HANDSHAKE: 7,
+    CMD_CHOKE: 8,
+    CMD_UNCHOKE: 9,
+    CMD_CANCEL: 10,
+    CMD_SUBBLOCK: 11,
+    CMD_PEX: 12,
+}
+MSG_NAMES = {code: name for name, code in MSG_TYPES.items()}
+
+
+class ProtocolError(Exception):
+    """Erro de enquadramento: versão incompatível, payload grande demais ou quadro truncado."""
+
 # ----------------------
 # Funções de montagem
 # ----------------------
 
-def build_get(block_id: int) -> str:
-    # Monta a mensagem GET <id> para pedir um bloco
-    return f"{CMD_GET} {block_id}"
+def build_header(cmd: str, block_id: int = 0, length: int = 0, flags: int = 0) -> bytes:
+    # Monta apenas o cabeçalho do quadro, útil para enviar o payload separadamente
+    return HEADER.pack(PROTOCOL_VERSION, MSG_TYPES[cmd], flags, 0, block_id, length)
 
-def build_list() -> str:
+def build_frame(cmd: str, block_id: int = 0, payload: bytes = b"", flags: int = 0) -> bytes:
+    # Monta um quadro completo (cabeçalho + payload)
+    return build_header(cmd, block_id, len(payload), flags) + payload
+
+def build_get(block_id: int, offset: int = 0, length: Optional[int] = None) -> bytes:
+    # Monta a mensagem GET <id> para pedir um bloco (ou, com `length`, o sub-bloco [offset, offset + length))
+    if length is None:
+        return build_frame(CMD_GET, block_id)
+    return build_frame(CMD_GET, block_id, SUBBLOCK_RANGE.pack(offset, length))
+
+def build_list() -> bytes:
     # Monta a mensagem LIST para pedir a lista de blocos
-    return CMD_LIST
+    return build_frame(CMD_LIST)
+
+def build_block(block_id: int, data: bytes, flags: int = 0) -> bytes:
+    # Monta a mensagem BLOCK <id> <conteúdo> para enviar um bloco (flags = codec, se o conteúdo vier comprimido)
+    return build_frame(CMD_BLOCK, block_id, bytes(data), flags)
+
+def build_blocks_list(block_ids: Iterable[int]) -> bytes:
+    # Monta a mensagem BLOCKS com o bitfield dos blocos disponíveis (o campo de ID leva o nº de blocos do mapa)
+    bitfield = block_ids if isinstance(block_ids, Bitfield) else Bitfield.from_iterable(block_ids)
+    return build_frame(CMD_BLOCKS, bitfield.size, bitfield.to_bytes())
+
+def build_subblock(block_id: int, offset: int, data: bytes, flags: int = 0) -> bytes:
+    # Monta a mensagem SUBBLOCK <id> <offset> <conteúdo> em resposta a um GET de sub-bloco (só o conteúdo é comprimido)
+    return build_frame(CMD_SUBBLOCK, block_id, SUBBLOCK_OFFSET.pack(offset) + bytes(data), flags)
+
+def build_have(block_id: int) -> bytes:
+    # Monta a mensagem HAVE <id>, enviada sem pedido prévio quando um bloco é salvo
+    return build_frame(CMD_HAVE, block_id)
 
-def build_block(block_id: int, data: bytes) -> bytes:
-    # Monta a mensagem BLOCK <id> <conteúdo> para enviar um bloco
-    return f"{CMD_BLOCK} {block_id} ".encode() + data
+def build_handshake(info_hash: bytes, address: Optional[Tuple[str, int]] = None, flags: int = 0) -> bytes:
+    # Monta a mensagem HANDSHAKE com o info_hash (20 bytes) do swarm desejado e,
+    # opcionalmente, o endereço em que este peer escuta (identifica o peer no servidor remoto).
+    # As flags negociam a compressão: codecs aceitos (cliente) ou o codec escolhido (resposta do servidor)
+    if len(info_hash) != INFO_HASH_SIZE:
+        raise ValueError(f"info_hash deve ter {INFO_HASH_SIZE} bytes")
+    payload = info_hash
+    if address is not None:
+        payload += HANDSHAKE_ADDRESS.pack(socket.inet_aton(address[0]), address[1])
+    return build_frame(CMD_HANDSHAKE, 0, payload, flags)
 
-def build_blocks_list(block_ids: Iterable[int]) -> str:
-    # Monta a mensagem BLOCKS com os IDs dos blocos disponíveis
-    return f"{CMD_BLOCKS} {','.join(map(str, sorted(block_ids)))}"
+def build_choke(choked: bool = True) -> bytes:
+    # Monta a mensagem CHOKE (ou UNCHOKE), enviada sem pedido prévio
+    return build_frame(CMD_CHOKE if choked else CMD_UNCHOKE)
 
-def build_error(msg: str) -> str:
-    # Monta uma mensagem de erro com a descrição fornecida
-    return f"{CMD_ERROR} {msg}"
+def build_cancel(block_id: int, offset: int = 0, length: Optional[int] = None) -> bytes:
+    # Monta a mensagem CANCEL <id> (pedido do cliente ou confirmação do servidor), com a mesma faixa do GET
+    if length is None:
+        return build_frame(CMD_CANCEL, block_id)
+    return build_frame(CMD_CANCEL, block_id, SUBBLOCK_RANGE.pack(offset, length))
+
+def build_pex(added: Iterable[str], dropped: Iterable[str]) -> bytes:
+    # Monta a mensagem PEX com os endereços ("host:porta") que entraram e saíram do swarm;
+    # endereços que não são IPv4 (ex.: nomes de host) ficam de fora
+    added, dropped = _pack_addresses(added), _pack_addresses(dropped)
+    return build_frame(CMD_PEX, 0, PEX_COUNTS.pack(len(added), len(dropped)) + b"".join(added + dropped))
+
+def _pack_addresses(addresses: Iterable[str]) -> List[bytes]:
+    packed = []
+    for address in addresses:
+        host, _, port = address.rpartition(":")
+        try:
+            packed.append(HANDSHAKE_ADDRESS.pack(socket.inet_aton(host), int(port)))
+        except (OSError, ValueError, struct.error):
+            continue
+    return packed
+
+def build_error(msg: str, block_id: int = 0) -> bytes:
+    # Monta uma mensagem de erro com a descrição fornecida (e o bloco relacionado, se houver)
+    return build_frame(CMD_ERROR, block_id, msg.encode())
 
 # ----------------------
-# Função de parsing
+# Funções de parsing
 # ----------------------
 
+def parse_header(header: bytes) -> Tuple[str, int, int, int]:
+    """
+    Interpreta um cabeçalho de quadro.
+
+    Retorna uma tupla (comando, flags, id do bloco, tamanho do payload).
+    Lança ProtocolError se a versão ou o tamanho forem inválidos.
+    """
+    version, msg_type, flags, _, block_id, length = HEADER.unpack(header)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Versão de protocolo não suportada: {version}")
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Payload grande demais: {length} bytes")
+    return MSG_NAMES.get(msg_type, CMD_UNKNOWN), flags, block_id, length
+
 def parse_message(message: bytes) -> Tuple[str, Optional[int], Optional[bytes]]:
     """
-    Interpreta uma mensagem recebida.
+    Interpreta um quadro completo recebido.
 
     Retorna uma tupla:
     - tipo do comando (str)
@@ -48,43 +177,138 @@ def parse_message(message: bytes) -> Tuple[str, Optional[int], Optional[bytes]]:
     - dados binários (se aplicável)
     """
     try:
-        # Trata mensagens do tipo BLOCK com dados binários
-        if message.startswith(f"{CMD_BLOCK} ".encode()):
-            parts = message.split(b' ', 2)
-            if len(parts) < 3:
-                return CMD_BLOCK, int(parts[1]), b''
-            return CMD_BLOCK, int(parts[1]), parts[2]
-
-        # Decodifica a mensagem como string para tratar os outros tipos
-        decoded = message.decode().strip()
-
-        if decoded.startswith(CMD_GET):
-            # Mensagem GET <id>
-            parts = decoded.split()
-            if len(parts) == 2 and parts[1].isdigit():
-                return CMD_GET, int(parts[1]), None
+        cmd, _, block_id, length = parse_header(message[:HEADER_SIZE])
+        payload = message[HEADER_SIZE:HEADER_SIZE + length]
+        if len(payload) != length:
             return CMD_INVALID, None, None
+    except (ProtocolError, struct.error) as e:
+        # Em caso de erro no parsing, retorna comando inválido
+        logging.warning(f"Erro ao interpretar mensagem: {e}")
+        return CMD_INVALID, None, None
 
-        if decoded == CMD_LIST:
-            # Mensagem LIST
-            return CMD_LIST, None, None
+    if cmd == CMD_UNKNOWN:
+        # Se a mensagem não for reconhecida
+        return CMD_UNKNOWN, None, None
+    if cmd == CMD_LIST:
+        return CMD_LIST, None, None
+    if cmd == CMD_HAVE:
+        return cmd, block_id, None
+    if cmd in (CMD_GET, CMD_CANCEL):
+        return cmd, block_id, payload or None  # Payload = faixa do sub-bloco (None = bloco inteiro)
+    if cmd in (CMD_CHOKE, CMD_UNCHOKE):
+        return cmd, None, None
+    return cmd, block_id, payload
 
-        if decoded.startswith(CMD_BLOCKS):
-            # Mensagem BLOCKS <lista_de_blocos>
-            parts = decoded.split(maxsplit=1)
-            if len(parts) == 2:
-                return CMD_BLOCKS, None, parts[1].encode()
+def parse_flags(message: bytes) -> int:
+    # Campo de flags do cabeçalho de um quadro completo (codec de compressão em BLOCK/SUBBLOCK/HANDSHAKE)
+    return message[2] if len(message) >= HEADER_SIZE else 0
 
-        if decoded.startswith(CMD_ERROR):
-            # Mensagem ERROR <mensagem>
-            parts = decoded.split(maxsplit=1)
-            if len(parts) == 2:
-                return CMD_ERROR, None, parts[1].encode()
+def parse_range(payload: Optional[bytes]) -> Tuple[int, Optional[int]]:
+    # Faixa (offset, tamanho) de um GET/CANCEL; (0, None) para o bloco inteiro
+    if not payload:
+        return 0, None
+    return SUBBLOCK_RANGE.unpack_from(payload)
 
-    except Exception as e:
-        # Em caso de erro no parsing, retorna comando inválido
-        logging.warning(f"Erro ao interpretar mensagem: {e}")
-        return CMD_INVALID, None, None
+def parse_handshake(payload: bytes) -> Tuple[bytes, Optional[Tuple[str, int]]]:
+    # Separa o info_hash do endereço de escuta anunciado (None se ausente)
+    info_hash = payload[:INFO_HASH_SIZE]
+    rest = payload[INFO_HASH_SIZE:]
+    if len(rest) < HANDSHAKE_ADDRESS.size:
+        return info_hash, None
+    raw_ip, port = HANDSHAKE_ADDRESS.unpack_from(rest)
+    return info_hash, (socket.inet_ntoa(raw_ip), port)
+
+def parse_pex(payload: bytes) -> Tuple[List[str], List[str]]:
+    # Separa os endereços ("host:porta") que entraram e que saíram; lança ValueError se o payload estiver truncado
+    try:
+        added, dropped = PEX_COUNTS.unpack_from(payload)
+    except struct.error:
+        raise ValueError("PEX truncado")
+    end = PEX_COUNTS.size + (added + dropped) * HANDSHAKE_ADDRESS.size
+    if len(payload) < end:
+        raise ValueError("PEX truncado")
+    addresses = [f"{socket.inet_ntoa(raw_ip)}:{port}"
+                 for raw_ip, port in HANDSHAKE_ADDRESS.iter_unpack(payload[PEX_COUNTS.size:end])]
+    return addresses[:added], addresses[added:]
+
+def parse_blocks_list(payload: bytes, size: int) -> Bitfield:
+    # Converte o payload de uma mensagem BLOCKS (com `size` blocos) em um bitfield
+    return Bitfield.from_bytes(payload, size)
+
+# ----------------------
+# Leitura de quadros
+# ----------------------
+
+def recv_exact(sock, size: int) -> bytes:
+    # Lê exatamente `size` bytes do socket; retorna menos apenas se a conexão fechar
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            break
+        received += n
+    return bytes(view[:received])
+
+def recv_frame(sock) -> Optional[bytes]:
+    """
+    Lê exatamente um quadro do socket.
+
+    Retorna o quadro completo (cabeçalho + payload), ou None se a conexão
+    foi encerrada antes de um novo quadro começar. Um quadro interrompido no
+    meio lança ProtocolError.
+    """
+    header = recv_exact(sock, HEADER_SIZE)
+    if not header:
+        return None
+    if len(header) < HEADER_SIZE:
+        raise ProtocolError("Cabeçalho truncado")
+    _, _, _, length = parse_header(header)
+    payload = recv_exact(sock, length) if length else b""
+    if len(payload) < length:
+        raise ProtocolError(f"Payload truncado ({len(payload)}/{length} bytes)")
+    return header + payload
 
-    # Se a mensagem não for reconhecida
-    return CMD_UNKNOWN, None, None
+
+class FrameParser:
+    """
+    Parser incremental: recebe bytes em pedaços arbitrários e devolve os
+    quadros completos assim que ficam disponíveis.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        # Acrescenta os dados ao buffer e extrai todos os quadros completos
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= HEADER_SIZE:
+            _, _, _, length = parse_header(bytes(self.buffer[:HEADER_SIZE]))
+            end = HEADER_SIZE + length
+            if len(self.buffer) < end:
+                break
+            frames.append(bytes(self.buffer[:end]))
+            del self.buffer[:end]
+        return frames
+
+
+async def read_frame_async(reader) -> Optional[bytes]:
+    """
+    Versão assíncrona de recv_frame para asyncio.StreamReader.
+
+    Retorna None se a conexão foi encerrada antes de um novo quadro começar.
+    """
+    try:
+        header = await reader.readexactly(HEADER_SIZE)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ProtocolError("Cabeçalho truncado")
+    _, _, _, length = parse_header(header)
+    try:
+        payload = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError as e:
+        raise ProtocolError(f"Payload truncado ({len(e.partial)}/{length} bytes)")
+    return header + payload
@@ -0,0 +1,131 @@
+import time
+import threading
+from collections import deque
+from typing import Dict, Hashable, Optional
+
+RATE_WINDOW = 20.0  # Janela (s) das taxas médias usadas pelo tit-for-tat
+
+
+class RateMeter:
+    """
+    Taxa de transferência em janela deslizante (bytes/s nos últimos `window` segundos).
+
+    As amostras são agrupadas por segundo, então a memória fica limitada ao
+    tamanho da janela, qualquer que seja o número de blocos transferidos.
+    """
+
+    def __init__(self, window: float = RATE_WINDOW):
+        self.window = window
+        self.samples = deque()  # [segundo, bytes] em ordem crescente de tempo
+        self.total = 0
+        self.started = time.monotonic()
+        self.last_update = self.started
+        self.lock = threading.Lock()
+
+    def update(self, size: int, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        second = int(now)
+        with self.lock:
+            self.total += size
+            self.last_update = now
+            if self.samples and self.samples[-1][0] == second:
+                self.samples[-1][1] += size
+            else:
+                self.samples.append([second, size])
+            self._trim(now)
+
+    def _trim(self, now: float) -> None:
+        # Descarta as amostras que saíram da janela
+        oldest = now - self.window
+        while self.samples and self.samples[0][0] + 1 <= oldest:
+            self.samples.popleft()
+
+    def rate(self, now: Optional[float] = None) -> float:
+        # Bytes/s na janela; no início da medição, divide só pelo tempo já decorrido
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self._trim(now)
+            elapsed = min(self.window, max(now - self.started, 1.0))
+            return sum(size for _, size in self.samples) / elapsed
+
+
+class RateMeters:
+    """
+    Um RateMeter por chave (ex.: endereço "host:porta" do peer remoto).
+    """
+
+    def __init__(self, window: float = RATE_WINDOW):
+        self.window = window
+        self.meters: Dict[Hashable, RateMeter] = {}
+        self.lock = threading.Lock()
+
+    def update(self, key: Hashable, size: int) -> None:
+        meter = self.meters.get(key)
+        if meter is None:
+            with self.lock:
+                meter = self.meters.setdefault(key, RateMeter(self.window))
+        meter.update(size)
+
+    def rate(self, key: Hashable) -> float:
+        meter = self.meters.get(key)
+        return meter.rate() if meter is not None else 0.0
+
+    def rates(self) -> Dict[Hashable, float]:
+        # Taxa atual de cada chave; medidores parados há mais de uma janela são descartados
+        now = time.monotonic()
+        with self.lock:
+            for key in [key for key, meter in self.meters.items() if now - meter.last_update > self.window]:
+                del self.meters[key]
+            meters = list(self.meters.items())
+        return {key: meter.rate(now) for key, meter in meters}
+
+
+class TokenBucket:
+    """
+    Balde de fichas para limitar a taxa de envio (bytes/s).
+
+    reserve() debita o tamanho do envio e retorna quanto tempo esperar antes
+    de enviá-lo. O saldo pode ficar negativo: um envio maior que o balde não
+    é recusado, apenas adiado proporcionalmente. Taxa 0 = sem limite.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate  # Até 1 s de rajada por padrão
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, size: int, now: Optional[float] = None) -> float:
+        if not self.rate:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= size
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Limite global de envio mais um limite por peer; o atraso de um envio é o
+    maior entre os dois baldes.
+    """
+
+    def __init__(self, rate: float = 0, peer_rate: float = 0):
+        self.bucket = TokenBucket(rate)
+        self.peer_rate = peer_rate
+        self.peer_buckets: Dict[Hashable, TokenBucket] = {}
+
+    def reserve(self, key: Hashable, size: int) -> float:
+        delay = self.bucket.reserve(size)
+        if self.peer_rate:
+            bucket = self.peer_buckets.get(key)
+            if bucket is None:
+                bucket = self.peer_buckets.setdefault(key, TokenBucket(self.peer_rate))
+            delay = max(delay, bucket.reserve(size))
+        return delay
+
+    def discard(self, key: Hashable) -> None:
+        self.peer_buckets.pop(key, None)
@@ -0,0 +1,198 @@
+import os
+import struct
+import threading
+from typing import Iterator, Optional
+
+from bitfield import Bitfield
+
+STREAM_CHUNK = 256 * 1024  # Tamanho padrão dos trechos entregues por stream()
+PROGRESS_SUFFIX = ".progress"  # Blocos já gravados na saída, ao lado do arquivo reconstruído
+PROGRESS_MAGIC = b"MBRP"
+# Cabeçalho do progresso: magic, tamanho do bloco, nº de blocos, tamanho e mtime (ns) da saída ao gravar
+PROGRESS_HEADER = struct.Struct("!4sIIQQ")
+
+
+class ProgressiveRebuild:
+    """
+    Reconstrução progressiva do arquivo original.
+
+    Cada bloco é gravado no arquivo de saída na sua posição (offset =
+    id * block_size) assim que é salvo, de modo que, quando o último bloco
+    chega, o arquivo já está pronto, sem nenhuma passada extra. O maior
+    prefixo contíguo já gravado é acompanhado e pode ser lido enquanto o
+    download continua (read_prefix / stream), por exemplo para tocar um vídeo.
+
+    Os blocos já gravados ficam registrados em <saída>.progress (ao concluir
+    e em save_progress, depois de um fsync da saída). Ao reiniciar, se a
+    saída não mudou desde então (mesmo tamanho e mtime), esses blocos não
+    são copiados de novo; um seeder com a saída completa não relê nada.
+    """
+
+    def __init__(self, output_path: str, block_size: int, total_blocks: int, file_size: Optional[int] = None):
+        self.output_path = output_path
+        self.block_size = block_size
+        self.total_blocks = total_blocks
+        self.file_size = file_size  # Pode ser None (sem manifesto): descoberto ao gravar o último bloco
+        self.cond = threading.Condition()
+        self.written = Bitfield(total_blocks)
+        self.prefix_blocks = 0  # Blocos 0..prefix_blocks-1 já gravados
+        self.closed = False
+        self.catch_up: Optional[threading.Thread] = None  # Cópia dos blocos que o peer já tinha ao iniciar
+        self.progress_path = output_path + PROGRESS_SUFFIX
+
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.fd = os.open(output_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._load_progress()
+        if file_size is not None and os.fstat(self.fd).st_size != file_size:
+            os.ftruncate(self.fd, file_size)  # Só se o tamanho mudar: o ftruncate atualiza o mtime
+
+    def attach(self, file_manager) -> None:
+        """
+        Passa a receber cada bloco salvo pelo FileManager e grava, em uma
+        thread, os blocos que o peer já possui: em um seeder grande essa
+        cópia leva o tempo de ler o arquivo inteiro e não deve atrasar a
+        entrada no swarm.
+        """
+        file_manager.add_sink(self.write_block)
+        blocks = file_manager.load_blocks()
+        if blocks and not self.is_complete():  # Saída já completa de uma execução anterior: nada a copiar
+            self.catch_up = threading.Thread(target=self._copy_existing, args=(file_manager, blocks), daemon=True)
+            self.catch_up.start()
+
+    def _copy_existing(self, file_manager, blocks) -> None:
+        for block_id in blocks:
+            if block_id not in self.written:
+                data = file_manager.store.read(block_id)  # Direto do armazenamento, sem passar pelo cache
+                if data is not None:
+                    self.write_block(block_id, data)
+
+    # ----------------------
+    # Progresso gravado
+    # ----------------------
+
+    def _load_progress(self) -> None:
+        # Recupera os blocos gravados em uma execução anterior, se a saída continua a mesma
+        try:
+            with open(self.progress_path, "rb") as f:
+                raw = f.read()
+            magic, block_size, total_blocks, size, mtime_ns = PROGRESS_HEADER.unpack_from(raw)
+        except (OSError, struct.error):
+            return
+        stat = os.fstat(self.fd)
+        if (magic != PROGRESS_MAGIC or block_size != self.block_size or total_blocks != self.total_blocks
+                or (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns)):
+            return  # Progresso de outro arquivo, ou a saída foi alterada depois dele: copia tudo de novo
+        written = Bitfield.from_bytes(raw[PROGRESS_HEADER.size:], total_blocks)
+        with self.cond:
+            self.written = written
+            if self.file_size is None and total_blocks - 1 in written:
+                self.file_size = size
+            while self.prefix_blocks < self.total_blocks and self.prefix_blocks in self.written:
+                self.prefix_blocks += 1
+
+    def save_progress(self) -> None:
+        """
+        Grava os blocos já presentes na saída (chamado ao concluir e ao
+        encerrar o peer). A saída recebe fsync antes, para que o registro
+        nunca aponte para dados que não chegaram ao disco.
+        """
+        with self.cond:
+            written = self.written.copy()
+            if not self.closed:
+                os.fsync(self.fd)
+        stat = os.stat(self.output_path)
+        tmp_path = self.progress_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(PROGRESS_HEADER.pack(PROGRESS_MAGIC, self.block_size, self.total_blocks,
+                                         stat.st_size, stat.st_mtime_ns))
+            f.write(written.to_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.progress_path)
+
+    # ----------------------
+    # Escrita
+    # ----------------------
+
+    def write_block(self, block_id: int, data: bytes) -> None:
+        # Grava o bloco na sua posição e avança o prefixo contíguo
+        if block_id >= self.total_blocks or block_id in self.written:
+            return
+        os.pwrite(self.fd, data, block_id * self.block_size)
+        with self.cond:
+            self.written.add(block_id)
+            if block_id == self.total_blocks - 1 and self.file_size is None:
+                self.file_size = block_id * self.block_size + len(data)
+            while self.prefix_blocks < self.total_blocks and self.prefix_blocks in self.written:
+                self.prefix_blocks += 1
+            self.cond.notify_all()
+
+    def is_complete(self) -> bool:
+        return self.prefix_blocks >= self.total_blocks
+
+    def finish(self) -> bool:
+        """
+        Conclui a reconstrução: ajusta o tamanho final e fecha o arquivo.
+        Retorna False se ainda faltam blocos.
+        """
+        if self.catch_up is not None:
+            self.catch_up.join()
+        with self.cond:
+            if not self.is_complete():
+                return False
+            if self.closed:
+                return True
+            os.ftruncate(self.fd, self.file_size)
+            os.fsync(self.fd)
+            os.close(self.fd)
+            self.closed = True
+            self.cond.notify_all()
+        self.save_progress()
+        return True
+
+    # ----------------------
+    # Leitura do prefixo concluído
+    # ----------------------
+
+    def completed_bytes(self) -> int:
+        # Bytes do início do arquivo que já podem ser lidos
+        with self.cond:
+            return self._completed_bytes()
+
+    def _completed_bytes(self) -> int:
+        if self.is_complete():
+            return self.file_size
+        return self.prefix_blocks * self.block_size
+
+    def read_prefix(self, offset: int, size: int, timeout: Optional[float] = None) -> bytes:
+        """
+        Lê `size` bytes a partir de `offset`, esperando (até `timeout`) que o
+        trecho faça parte do prefixo concluído. Pode retornar menos bytes no
+        fim do arquivo ou se o tempo acabar.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self._completed_bytes() >= offset + size or self.is_complete(), timeout)
+            available = min(size, self._completed_bytes() - offset)
+            if available <= 0:
+                return b""
+            if self.closed:
+                with open(self.output_path, "rb") as f:
+                    f.seek(offset)
+                    return f.read(available)
+            return os.pread(self.fd, available, offset)
+
+    def stream(self, chunk_size: int = STREAM_CHUNK, timeout: Optional[float] = None) -> Iterator[bytes]:
+        """
+        Entrega o arquivo em ordem, trecho a trecho, conforme o prefixo
+        concluído avança. Termina no fim do arquivo ou se nenhum dado novo
+        chegar dentro de `timeout`.
+        """
+        offset = 0
+        while True:
+            data = self.read_prefix(offset, chunk_size, timeout)
+            if not data:
+                return
+            offset += len(data)
+            yield data
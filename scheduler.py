@@ -0,0 +1,380 @@
+import time
+import logging
+import threading
+from typing import Dict, Set, List, Optional, Tuple
+
+from availability import AvailabilityIndex
+from connection_pool import PeerChokedError, RequestCancelledError
+from metrics import REGISTRY
+
+MAX_OUTSTANDING = 32   # Limite global de requisições em andamento
+PER_PEER_SLOTS = 8     # Requisições simultâneas por peer
+REQUEST_TIMEOUT = 5    # Tempo limite (s) para cada bloco solicitado
+ENDGAME_THRESHOLD = 16 # Blocos faltando a partir dos quais entra o modo endgame
+ENDGAME_COPIES = 3     # Pedidos simultâneos do mesmo bloco no modo endgame
+SUB_BLOCK_SIZE = 16 * 1024  # Blocos maiores que isto são pedidos em sub-blocos independentes
+
+DOWNLOADED_BLOCKS = REGISTRY.counter("p2p_downloaded_blocks_total", "Blocos baixados, verificados e salvos")
+VERIFY_FAILURES = REGISTRY.counter("p2p_verify_failures_total", "Blocos montados cujo hash não conferiu")
+
+
+class TransferStats:
+    """
+    Contadores de transferência de um peer remoto (ou do total).
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.blocks = 0
+        self.failures = 0
+        self.duplicate_bytes = 0  # Bytes de cópias redundantes (modo endgame)
+        self.started = time.monotonic()
+
+    def record(self, size: int) -> None:
+        self.bytes += size
+        self.blocks += 1
+
+    def throughput(self, now: Optional[float] = None) -> float:
+        # Taxa média em bytes/s desde o início da medição
+        elapsed = (now or time.monotonic()) - self.started
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+
+class PartialPiece:
+    """
+    Bloco em montagem: os sub-blocos chegam (de um ou mais peers) direto na
+    sua posição do buffer, e o hash só é conferido com o bloco completo.
+
+    Com `length` None o bloco é pedido inteiro, em um único GET.
+    """
+
+    def __init__(self, block_id: int, length: Optional[int], sub_block_size: int):
+        self.block_id = block_id
+        if length is None or length <= sub_block_size:
+            self.ranges: Dict[int, Optional[int]] = {0: None}  # offset -> tamanho (None = bloco inteiro)
+            self.buffer = None
+        else:
+            self.ranges = {offset: min(sub_block_size, length - offset) for offset in range(0, length, sub_block_size)}
+            self.buffer = bytearray(length)
+        self.missing: Set[int] = set(self.ranges)  # Offsets ainda não recebidos
+        self.contributors: Set[str] = set()  # Peers que enviaram sub-blocos (suspeitos se o hash falhar)
+        self.verifying = False
+
+    def add(self, offset: int, data: bytes, peer: str) -> bool:
+        # Grava o sub-bloco na sua posição; False se já recebido ou com tamanho errado
+        expected = self.ranges.get(offset)
+        if offset not in self.missing or (expected is not None and len(data) != expected):
+            return False
+        if self.buffer is None:
+            self.buffer = data
+        else:
+            self.buffer[offset:offset + len(data)] = data
+        self.missing.discard(offset)
+        self.contributors.add(peer)
+        return True
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing
+
+    def reset(self) -> None:
+        # Descarta o conteúdo recebido (hash não conferiu) para pedir tudo de novo
+        self.missing = set(self.ranges)
+        self.contributors.clear()
+        self.verifying = False
+        if len(self.ranges) == 1:
+            self.buffer = None
+
+
+class DownloadScheduler:
+    """
+    Escalonador de downloads concorrentes entre vários peers.
+
+    Mantém até `max_outstanding` requisições em andamento, espalhadas entre
+    todos os peers desbloqueados (no máximo `per_peer_slots` por peer). Assim
+    que um pedido termina, o slot do peer é reabastecido: primeiro com
+    sub-blocos que faltam dos blocos já iniciados, depois com o próximo bloco
+    mais raro que o peer possui, segundo o AvailabilityIndex. Pedidos que
+    falham são tentados novamente em outro peer.
+
+    Blocos maiores que `sub_block_size` são divididos em sub-blocos pedidos
+    de forma independente (possivelmente a peers diferentes) e montados no
+    lugar; o bloco é verificado e salvo (o que já o anuncia com HAVE) assim
+    que o último sub-bloco chega.
+
+    Modo endgame: quando faltam `endgame_threshold` blocos ou menos, cada
+    pedido em andamento é feito também a outros peers que possuem o bloco
+    (até `endgame_copies` pedidos simultâneos). A primeira cópia que chega
+    vence e os pedidos redundantes recebem CANCEL; os bytes de cópias que
+    chegam mesmo assim são contados como duplicados.
+    """
+
+    def __init__(self, peer_id: str, client, file_manager, index: AvailabilityIndex,
+                 max_outstanding: int = MAX_OUTSTANDING, per_peer_slots: int = PER_PEER_SLOTS,
+                 request_timeout: float = REQUEST_TIMEOUT, endgame_threshold: int = ENDGAME_THRESHOLD,
+                 endgame_copies: int = ENDGAME_COPIES, sub_block_size: int = SUB_BLOCK_SIZE):
+        self.peer_id = peer_id
+        self.client = client
+        self.file_manager = file_manager
+        self.index = index  # Fonte da ordem Rarest First, mantida pelos anúncios HAVE e pelos blocos salvos
+        self.max_outstanding = max_outstanding
+        self.per_peer_slots = per_peer_slots
+        self.request_timeout = request_timeout
+        self.endgame_threshold = endgame_threshold
+        self.endgame_copies = endgame_copies
+        self.sub_block_size = sub_block_size
+        # Pedidos por bloco novo (para saber quantos blocos iniciar para ocupar os slots livres)
+        self.requests_per_block = max(1, -(-file_manager.block_size // sub_block_size))
+        self.pieces: Dict[int, PartialPiece] = {}  # Blocos iniciados e ainda não salvos (sobrevivem entre rodadas)
+        self.cond = threading.Condition()
+        self.peer_stats: Dict[str, TransferStats] = {}  # Estatísticas acumuladas por peer remoto
+        self.total_stats = TransferStats()
+        self.endgame_requests = 0  # Pedidos redundantes enviados no modo endgame
+        self.cancels_sent = 0      # CANCELs enviados após a primeira cópia chegar
+        self.verify_failures = 0   # Blocos montados cujo hash não conferiu
+        self._failed: Dict[int, Set[str]] = {}
+
+    def run(self, unchoked_peers: List[str]) -> int:
+        """
+        Baixa tudo o que for possível dos peers desbloqueados.
+
+        A escolha dos blocos vem do AvailabilityIndex, atualizado em tempo
+        real pelos anúncios HAVE, então blocos que surgem durante a rodada
+        também são aproveitados. Retorna quando nenhum peer desbloqueado
+        consegue fornecer mais blocos e não há requisições pendentes nem
+        blocos em verificação, com o número de blocos salvos nesta rodada.
+        """
+        self._peers = [peer for peer in unchoked_peers if self.index.has_peer(peer)]
+        # (block_id, offset) -> {peer: (future, instante do pedido)}; mais de um peer só no modo endgame
+        self._in_flight: Dict[Tuple[int, int], Dict[str, tuple]] = {}
+        self._peer_load: Dict[str, int] = {peer: 0 for peer in self._peers}
+        self._failed = {}   # block_id -> peers que já falharam com ele
+        self._dead: Set[str] = set()
+        self._completed = 0
+        self._endgame = False
+        round_start = time.monotonic()
+
+        with self.cond:
+            while True:
+                self._expire_requests()
+                self._fill_slots()
+                if not self._in_flight and not any(piece.verifying for piece in self.pieces.values()):
+                    break
+                self.cond.wait(timeout=self.request_timeout)
+
+        self._log_round(time.monotonic() - round_start)
+        return self._completed
+
+    # ------------------------------------------------------------------
+    # Distribuição das requisições (chamado com self.cond adquirido)
+    # ------------------------------------------------------------------
+
+    def _fill_slots(self) -> None:
+        # Ocupa os slots livres de cada peer, respeitando o limite global
+        # Peers menos carregados primeiro, para espalhar as requisições; peers que nos bloquearam ficam de fora
+        choking = self.client.choking()
+        for peer in sorted(self._peers, key=lambda p: self._peer_load[p]):
+            free = min(self.per_peer_slots - self._peer_load[peer], self.max_outstanding - len(self._in_flight))
+            if free <= 0 or peer in self._dead or peer in choking:
+                continue
+            for key in self._next_requests(peer, free):
+                self._dispatch(peer, key)
+        if self.index.missing_count() <= self.endgame_threshold:
+            self._fill_endgame(choking)
+
+    def _fill_endgame(self, choking: Set[str]) -> None:
+        # Pede os sub-blocos em andamento também a outros peers que possuem o bloco
+        if not self._endgame:
+            self._endgame = True
+            logging.info(f"[{self.peer_id}] Modo endgame: faltam {self.index.missing_count()} blocos")
+        available = set(self._peers) - self._dead - choking
+        for key, requests in list(self._in_flight.items()):
+            if self._received(key) or len(requests) >= self.endgame_copies:
+                continue
+            block_id = key[0]
+            failed = self._failed.get(block_id, ())
+            for peer in self.index.holders(block_id):
+                if len(requests) >= self.endgame_copies:
+                    break
+                if (peer in available and peer not in requests and peer not in failed
+                        and self._peer_load[peer] < self.per_peer_slots):
+                    self.endgame_requests += 1
+                    self._dispatch(peer, key)
+
+    def _next_requests(self, peer: str, n: int) -> List[Tuple[int, int]]:
+        """
+        Próximos n pedidos (block_id, offset) para o peer: primeiro os
+        sub-blocos que faltam dos blocos já iniciados (blocos completos mais
+        cedo podem ser compartilhados mais cedo), depois blocos novos do mais
+        raro para o mais comum.
+        """
+        requests: List[Tuple[int, int]] = []
+        for block_id, piece in self.pieces.items():
+            if piece.verifying or peer in self._failed.get(block_id, ()) or not self.index.peer_holds(peer, block_id):
+                continue
+            for offset in piece.ranges:
+                if offset in piece.missing and (block_id, offset) not in self._in_flight:
+                    requests.append((block_id, offset))
+                    if len(requests) >= n:
+                        return requests
+
+        # Blocos novos: os mais raros que o peer possui, ainda não iniciados e que não falharam com ele
+        def skip(block_id: int) -> bool:
+            return block_id in self.pieces or peer in self._failed.get(block_id, ())
+        wanted = -(-(n - len(requests)) // self.requests_per_block)
+        for block_id in self.index.rarest_for_peer(peer, wanted, skip):
+            piece = self.pieces[block_id] = PartialPiece(block_id, self.file_manager.block_length(block_id),
+                                                         self.sub_block_size)
+            for offset in piece.ranges:
+                if len(requests) >= n:
+                    return requests
+                requests.append((block_id, offset))
+        return requests
+
+    def _dispatch(self, peer: str, key: Tuple[int, int]) -> None:
+        block_id, offset = key
+        host, port = peer.rsplit(":", 1)
+        try:
+            future = self.client.fetch_subblock(host, int(port), block_id, offset, self.pieces[block_id].ranges[offset])
+        except Exception as e:
+            logging.warning(f"[{self.peer_id}] Não foi possível pedir o bloco {block_id} a {peer} - {e}")
+            self._dead.add(peer)
+            self._failed.setdefault(block_id, set()).add(peer)
+            return
+        self._in_flight.setdefault(key, {})[peer] = (future, time.monotonic())
+        self._peer_load[peer] += 1
+        future.add_done_callback(lambda f, k=key, p=peer: self._on_done(k, p, f))
+
+    def _expire_requests(self) -> None:
+        # Cancela requisições que passaram do tempo limite
+        now = time.monotonic()
+        for key, requests in list(self._in_flight.items()):
+            for peer, (future, started) in list(requests.items()):
+                if now - started > self.request_timeout:
+                    logging.warning(f"[{self.peer_id}] Tempo esgotado para o bloco {key[0]} (offset {key[1]}) de {peer}")
+                    self._finish(key, peer, None, False)
+                    future.cancel()  # Libera o slot da conexão; uma resposta tardia é descartada
+
+    def _received(self, key: Tuple[int, int]) -> bool:
+        # O sub-bloco já chegou (ou o bloco inteiro já foi salvo)
+        piece = self.pieces.get(key[0])
+        return piece is None or key[1] not in piece.missing
+
+    # ------------------------------------------------------------------
+    # Conclusão das requisições
+    # ------------------------------------------------------------------
+
+    def _on_done(self, key: Tuple[int, int], peer: str, future) -> None:
+        # Chamado pela thread leitora da conexão quando a resposta chega (ou falha)
+        block_id, offset = key
+        data = None
+        if not future.cancelled():
+            try:
+                data = future.result()
+            except (PeerChokedError, RequestCancelledError):
+                pass  # O peer bloqueou os pedidos ou confirmou o CANCEL; o bloco vem (ou veio) de outro peer
+            except Exception as e:
+                logging.warning(f"[{self.peer_id}] Erro ao solicitar bloco {block_id} de {peer} - {e}")
+        with self.cond:
+            requests = self._in_flight.get(key, {})
+            if requests.get(peer, (None,))[0] is not future:
+                return  # Já expirou e foi contabilizado
+            # Só a primeira cópia entra no bloco; as demais requisições do sub-bloco recebem CANCEL
+            piece = self.pieces.get(block_id)
+            accepted = data is not None and piece is not None and piece.add(offset, data, peer)
+            redundant = [other for other in requests if other != peer] if accepted else []
+            length = piece.ranges[offset] if piece is not None else None
+            complete = accepted and piece.complete
+            if complete:
+                piece.verifying = True
+            self._finish(key, peer, data, accepted)
+            self.cond.notify()
+        for other in redundant:
+            host, port = other.rsplit(":", 1)
+            if self.client.cancel_block(host, int(port), block_id, offset, length):
+                self.cancels_sent += 1
+        if complete:
+            # Bloco montado: confere o hash fora da thread de rede e salva
+            self.client.verify_block(block_id, bytes(piece.buffer)).add_done_callback(
+                lambda f, p=piece: self._on_verified(p, f))
+
+    def _on_verified(self, piece: PartialPiece, future) -> None:
+        data = None
+        try:
+            data = future.result()
+        except Exception as e:
+            logging.warning(f"[{self.peer_id}] Bloco {piece.block_id} inválido "
+                            f"(sub-blocos de {sorted(piece.contributors)}) - {e}")
+        if data:
+            self.file_manager.save_block(piece.block_id, data)  # Já anuncia o bloco (HAVE) aos peers conectados
+            logging.debug(f"[{self.peer_id}] Bloco {piece.block_id} recebido de {sorted(piece.contributors)}")
+        with self.cond:
+            if self.pieces.get(piece.block_id) is piece:
+                if data:
+                    del self.pieces[piece.block_id]
+                    self._completed += 1
+                    self.total_stats.blocks += 1
+                    DOWNLOADED_BLOCKS.inc()
+                else:
+                    # Não dá para saber qual peer enviou o sub-bloco corrompido: todos os que contribuíram ficam de fora
+                    self.verify_failures += 1
+                    VERIFY_FAILURES.inc()
+                    self._failed.setdefault(piece.block_id, set()).update(piece.contributors)
+                    piece.reset()
+            self.cond.notify()
+
+    def _finish(self, key: Tuple[int, int], peer: str, data: Optional[bytes], accepted: bool) -> None:
+        # Atualiza o estado após a conclusão de uma requisição (com self.cond adquirido)
+        requests = self._in_flight[key]
+        del requests[peer]
+        if not requests:
+            del self._in_flight[key]
+        self._peer_load[peer] -= 1
+        stats = self.peer_stats.setdefault(peer, TransferStats())
+        if accepted:
+            stats.record(len(data))
+            self.total_stats.bytes += len(data)
+        elif data and self._received(key):
+            # Cópia redundante do endgame que chegou antes do CANCEL
+            stats.duplicate_bytes += len(data)
+            self.total_stats.duplicate_bytes += len(data)
+        elif not self._received(key):
+            stats.failures += 1
+            self.total_stats.failures += 1
+            # O sub-bloco continua faltando e será pedido a outro peer que possua o bloco
+            self._failed.setdefault(key[0], set()).add(peer)
+
+    # ------------------------------------------------------------------
+    # Relatório de vazão
+    # ------------------------------------------------------------------
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """
+        Retorna a vazão acumulada por peer e o total agregado.
+        """
+        now = time.monotonic()
+        with self.cond:
+            result = {
+                peer: {"bytes": s.bytes, "blocks": s.blocks, "failures": s.failures,
+                       "duplicate_bytes": s.duplicate_bytes, "bytes_per_sec": s.throughput(now)}
+                for peer, s in self.peer_stats.items()
+            }
+            result["total"] = {
+                "bytes": self.total_stats.bytes, "blocks": self.total_stats.blocks,
+                "failures": self.total_stats.failures, "duplicate_bytes": self.total_stats.duplicate_bytes,
+                "endgame_requests": self.endgame_requests, "cancels": self.cancels_sent,
+                "verify_failures": self.verify_failures, "bytes_per_sec": self.total_stats.throughput(now),
+            }
+        return result
+
+    def _log_round(self, elapsed: float) -> None:
+        if not self._completed:
+            return
+        logging.info(f"[{self.peer_id}] Rodada de download: {self._completed} blocos em {elapsed:.2f}s")
+        for peer, stats in self.report().items():
+            logging.info(f"[{self.peer_id}]   {peer}: {stats['blocks']} pedidos, "
+                         f"{stats['bytes_per_sec'] / 1024:.1f} KB/s, {stats['failures']} falhas")
+        if self._endgame:
+            total = self.report()["total"]
+            logging.info(f"[{self.peer_id}]   endgame: {total['endgame_requests']} pedidos redundantes, "
+                         f"{total['cancels']} cancelados, {total['duplicate_bytes']} bytes duplicados")
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import subprocess
+from typing import Dict, List, Optional
+
+from block_cache import BlockCache
+from compression import CODEC_NONE
+from file_manager import FileManager
+from metrics import REGISTRY, Counter
+from peer_server import AsyncPeerServer
+from protocol import NO_INFO_HASH
+from strategy import Strategy
+
+REPORT_INTERVAL = 1.0      # Intervalo (s) entre os relatórios de cada worker ao processo principal
+CHOKE_INTERVAL = 10        # Intervalo (s) entre as rodadas de choking de cada worker (como no peer.py)
+WORKER_START_TIMEOUT = 10  # Tempo máximo (s) para um worker associar a porta
+STOP_TIMEOUT = 5           # Tempo (s) dado a cada worker para encerrar antes de ser morto
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class SeederWorkers:
+    """
+    Processos extras que servem os blocos de um seeder na mesma porta do
+    servidor principal (SO_REUSEPORT): o kernel reparte as conexões novas
+    entre os processos, e cada um usa um núcleo para enquadrar, comprimir e
+    enviar os blocos.
+
+    Os workers abrem o armazenamento só para leitura (o mesmo data.bin,
+    mapeado em memória por cada um) e fazem o próprio choking entre as
+    conexões que recebem. A cada REPORT_INTERVAL cada worker envia uma
+    linha JSON com os seus contadores, somados ao registro de métricas
+    deste processo, e o número de conexões e pedidos em fila.
+
+    Cada worker é um processo novo (python seeder.py), e não um fork: quando
+    o peer vira seeder o processo principal já tem threads (servidor,
+    downloads, verificação), e um fork herdaria travas que elas seguravam.
+    """
+
+    def __init__(self, peer_id: str, port: int, swarms: List[FileManager], count: int, host: str = "0.0.0.0",
+                 compression: int = CODEC_NONE, compression_level: Optional[int] = None,
+                 max_upload_rate: float = 0, max_peer_upload_rate: float = 0):
+        self.peer_id = peer_id
+        self.count = count
+        self.swarms = swarms
+        self.config = {
+            "peer_id": peer_id,
+            "parent": os.getpid(),
+            "host": host,
+            "port": port,
+            "compression": compression,
+            "compression_level": compression_level,
+            # O limite total de upload é repartido entre o servidor principal e os workers
+            "max_upload_rate": max_upload_rate / (count + 1),
+            "max_peer_upload_rate": max_peer_upload_rate,
+            "swarms": [{
+                "directory": fm.directory,
+                "storage": fm.storage,
+                "info_hash": fm.info_hash.hex(),
+                "block_size": fm.block_size,
+                "total_blocks": fm.total_blocks,
+                "file_size": fm.file_size,
+            } for fm in swarms],
+        }
+        self.processes: List[subprocess.Popen] = []
+        self.reports: Dict[int, dict] = {}  # Último relatório de cada worker
+        self.lock = threading.Lock()
+
+    def start(self) -> "SeederWorkers":
+        # Os workers só enxergam o índice de blocos que está no disco: o diário
+        # (gravado em lotes) é descarregado antes, senão faltariam os últimos blocos salvos
+        for file_manager in self.swarms:
+            file_manager.flush()
+        script = os.path.abspath(__file__)
+        for index in range(1, self.count + 1):
+            config = json.dumps(dict(self.config, index=index))
+            popen = subprocess.Popen([sys.executable, script, config], stdout=subprocess.PIPE, text=True)
+            self.processes.append(popen)
+            threading.Thread(target=self._read_reports, args=(index, popen), daemon=True).start()
+        logging.info(f"[{self.peer_id}] {self.count} workers servindo na porta {self.config['port']}")
+        return self
+
+    def _read_reports(self, index: int, popen: subprocess.Popen) -> None:
+        # Lê os relatórios de um worker e soma os incrementos dos contadores ao registro local
+        previous: Dict[str, Dict[tuple, float]] = {}
+        for line in popen.stdout:
+            try:
+                report = json.loads(line)
+            except ValueError:
+                continue
+            with self.lock:
+                self.reports[index] = report
+            for name, series in report.get("counters", {}).items():
+                metric = REGISTRY.metrics.get(name)
+                if not isinstance(metric, Counter):
+                    continue
+                seen = previous.setdefault(name, {})
+                for labels, value in series:
+                    key = tuple(labels)
+                    delta = value - seen.get(key, 0)
+                    if delta > 0:
+                        metric.labels(*key).inc(delta)
+                    seen[key] = value
+        with self.lock:
+            self.reports.pop(index, None)
+        code = popen.wait()
+        if code not in (0, -15):
+            logging.warning(f"[{self.peer_id}] Worker {index} encerrou com código {code}")
+
+    def _total(self, field: str) -> int:
+        with self.lock:
+            return sum(report.get(field, 0) for report in self.reports.values())
+
+    def connection_count(self) -> int:
+        return self._total("connections")
+
+    def queued_requests(self) -> int:
+        return self._total("queued")
+
+    def unchoked_count(self) -> int:
+        return self._total("unchoked")
+
+    def stop(self) -> None:
+        for popen in self.processes:
+            if popen.poll() is None:
+                popen.terminate()
+        for popen in self.processes:
+            try:
+                popen.wait(STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                popen.kill()
+
+
+# ----------------------
+# Processo worker
+# ----------------------
+
+def run_worker(config: dict) -> None:
+    """
+    Serve os swarms do seeder na porta compartilhada até o processo
+    principal encerrar. Os relatórios saem em stdout, uma linha JSON por
+    intervalo; os logs continuam em stderr, junto com os do processo principal.
+    """
+    peer_id = f"{config['peer_id']}-w{config['index']}"
+    server = AsyncPeerServer(peer_id, host=config["host"], port=config["port"],
+                             max_upload_rate=config["max_upload_rate"],
+                             max_peer_upload_rate=config["max_peer_upload_rate"],
+                             compression=config["compression"], compression_level=config["compression_level"],
+                             reuse_port=True)
+    cache = BlockCache()  # Um cache por worker, compartilhado entre os swarms (como no peer.py)
+    for swarm in config["swarms"]:
+        info_hash = bytes.fromhex(swarm["info_hash"])
+        file_manager = FileManager(peer_id, storage=swarm["storage"], block_size=swarm["block_size"],
+                                   total_blocks=swarm["total_blocks"], file_size=swarm["file_size"], cache=cache,
+                                   info_hash=info_hash, directory=swarm["directory"], read_only=True)
+        server.add_swarm(file_manager)
+        if info_hash == NO_INFO_HASH:
+            server.file_manager = file_manager  # Conexões sem HANDSHAKE (modo antigo)
+
+    threading.Thread(target=server.start, daemon=True).start()
+    if not server.ready.wait(WORKER_START_TIMEOUT):
+        raise SystemExit(f"[{peer_id}] O servidor não iniciou em {WORKER_START_TIMEOUT}s")
+
+    strategy = Strategy()
+    next_choke = time.monotonic() + CHOKE_INTERVAL
+    while os.getppid() == config["parent"]:  # Sai sozinho se o processo principal morrer
+        time.sleep(REPORT_INTERVAL)
+        if time.monotonic() >= next_choke:
+            # Como seeder, todos os peers conectados são candidatos, ordenados pela taxa de upload
+            unchoked = strategy.update_unchoked_peers(list(server.connected_peers()), {},
+                                                      server.upload_rates.rates(), seeding=True)
+            server.set_unchoked(unchoked)
+            next_choke += CHOKE_INTERVAL
+        report = {
+            "counters": REGISTRY.counter_values(),
+            "connections": server.connection_count(),
+            "queued": server.queued_requests(),
+            "unchoked": len(server.unchoked),
+        }
+        print(json.dumps(report), flush=True)
+
+
+if __name__ == "__main__":
+    # Uso interno: python seeder.py '<configuração JSON>' (iniciado por SeederWorkers)
+    try:
+        run_worker(json.loads(sys.argv[1]))
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
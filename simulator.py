@@ -0,0 +1,418 @@
+import argparse
+import heapq
+import json
+import logging
+import random
+import statistics
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Set
+
+from availability import AvailabilityIndex
+from bitfield import Bitfield
+from file_manager import PLACEMENT_POLICIES
+from peer_server import UPLOAD_SLOTS, PEX_MAX_ADDED
+from rate import RATE_WINDOW
+from strategy import Strategy
+from swarm import TRACKER_QUERY_INTERVAL
+from tracker_server import PeerRegistry
+
+# -------- SIMULADOR DE EVENTOS DISCRETOS DO SWARM --------
+# Uso: python simulator.py --peers 10000 --blocks 100 --output simulacao.json
+# Sem sockets: os peers são modelos (banda, latência, entrada e saída), mas a escolha de
+# blocos (AvailabilityIndex.rarest_for_peer), o choking (Strategy) e a amostragem do tracker
+# (PeerRegistry) são o código real do projeto. Os vizinhos vêm do tracker (a cada
+# TRACKER_QUERY_INTERVAL, como no Swarm) e, entre as consultas, por PEX.
+
+CHOKE_INTERVAL = 10   # Intervalo (s) entre as rodadas de choking, como no peer.py
+NUMWANT = 30          # Peers pedidos ao tracker, como no Swarm
+MAX_NEIGHBORS = 55    # Conexões por peer (novas conexões a um peer cheio são recusadas)
+SAMPLE_INTERVAL = 30  # Intervalo (s) entre as amostras da curva de replicação
+PEX_INTERVAL = 5      # Intervalo (s) entre as rodadas de PEX, como no peer.py
+
+
+class SimPeer:
+    """
+    Estado de um peer simulado. Não há conexões nem bytes: uma transferência
+    é um evento com a duração dada pela banda de quem envia e de quem recebe.
+    """
+
+    __slots__ = ("id", "upload", "download", "latency", "index", "strategy", "neighbors", "unchoked",
+                 "uploads", "inflight", "downloads", "received", "sent", "previous_received",
+                 "previous_sent", "joined", "completed", "complete", "present")
+
+    def __init__(self, peer_id: str, total_blocks: int, upload: float, download: float, latency: float):
+        self.id = peer_id
+        self.upload = upload      # Bytes/s
+        self.download = download  # Bytes/s
+        self.latency = latency    # Latência de acesso (s) em cada sentido
+        self.index = AvailabilityIndex(total_blocks)
+        self.strategy = Strategy()
+        self.neighbors: Set[str] = set()
+        self.unchoked: Set[str] = set()  # Quem pode baixar deste peer
+        self.uploads: Dict[str, tuple] = {}  # Peer que está recebendo -> (bloco, ficha do evento)
+        self.inflight: Set[int] = set()  # Blocos sendo recebidos
+        self.downloads = 0  # Transferências sendo recebidas (dividem a banda de download)
+        # Bytes trocados nesta rodada de choking e na anterior (taxa na janela de RATE_WINDOW)
+        self.received: Dict[str, int] = {}
+        self.sent: Dict[str, int] = {}
+        self.previous_received: Dict[str, int] = {}
+        self.previous_sent: Dict[str, int] = {}
+        self.joined = 0.0
+        self.completed: Optional[float] = None  # Instante em que completou o arquivo
+        self.complete = False  # Atalho para `completed is not None` (consultado a cada HAVE)
+        self.present = False
+
+    @property
+    def blocks(self) -> Bitfield:
+        return self.index.my_blocks
+
+    def rates(self, current: Dict[str, int], previous: Dict[str, int], peers) -> Dict[str, float]:
+        return {peer: (current.get(peer, 0) + previous.get(peer, 0)) / RATE_WINDOW for peer in peers}
+
+
+class Simulator:
+    """
+    Fila de eventos ordenada pelo tempo simulado. Cada evento é (instante,
+    sequência, função, argumentos); a sequência desempata eventos no mesmo
+    instante. Transferências canceladas (choke ou saída de um peer) não são
+    retiradas da fila: o evento é ignorado quando o ID não confere mais.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        random.seed(args.seed)  # A Strategy usa o gerador global
+        self.total_blocks = args.blocks
+        self.block_size = args.block_size
+        self.now = 0.0
+        self.events: List[tuple] = []
+        self.seq = 0
+        self.peers: Dict[str, SimPeer] = {}
+        self.tracker = PeerRegistry(ttl=float("inf"))
+        self.copies = array("I", bytes(4 * self.total_blocks))  # Réplicas de cada bloco entre os peers presentes
+        self.present = 0
+        self.completed_count = 0
+        self.departed_incomplete = 0
+        self.pending_arrivals = args.peers
+        self.transfers = 0
+        self.transfer_ids = 0
+        self.tracker_queries = 0
+        self.stalled = False  # Algum bloco deixou de existir no swarm e não há como recuperá-lo
+        self.samples: List[dict] = []
+
+    # ------------------------------------------------------------------
+    # Fila de eventos
+    # ------------------------------------------------------------------
+
+    def schedule(self, delay: float, handler: Callable, *args) -> int:
+        self.seq += 1
+        heapq.heappush(self.events, (self.now + delay, self.seq, handler, args))
+        return self.seq
+
+    def run(self) -> dict:
+        self.setup()
+        self.schedule(0, self.sample)
+        started = time.process_time()
+        while self.events:
+            when, _, handler, args = heapq.heappop(self.events)
+            if when > self.args.max_time:
+                break
+            self.now = when
+            handler(*args)
+            if self.stalled or (not self.pending_arrivals and self.finished()):
+                break
+        self.sample()
+        return self.report(time.process_time() - started)
+
+    def finished(self) -> bool:
+        # Todos os peers que ainda estão no swarm completaram o arquivo
+        return self.completed_count + self.departed_incomplete >= self.args.peers
+
+    # ------------------------------------------------------------------
+    # Peers
+    # ------------------------------------------------------------------
+
+    def setup(self) -> None:
+        args = self.args
+        # Distribuição inicial entre os primeiros peers, com as mesmas políticas do split_and_distribute
+        initial = min(args.initial_peers, args.peers)
+        shares = [Bitfield(self.total_blocks) for _ in range(initial)]
+        policy = PLACEMENT_POLICIES[args.placement]
+        for block_id, owners in enumerate(policy(self.total_blocks, initial, args.replication, self.rng)):
+            for owner in owners:
+                shares[owner].add(block_id)
+        for i in range(args.peers):
+            # Banda com dispersão log-normal em torno da média; latência uniforme em torno da média
+            spread = self.rng.lognormvariate(0, args.heterogeneity) if args.heterogeneity else 1.0
+            peer = SimPeer(f"p{i}", self.total_blocks, args.upload * 1024 * spread, args.download * 1024 * spread,
+                           args.latency / 1000 * self.rng.uniform(0.5, 1.5))
+            self.peers[peer.id] = peer
+            if i < initial:
+                self.schedule(0, self.join, peer, shares[i])
+            else:
+                self.schedule(self.rng.uniform(0, args.arrival_window), self.join, peer, None)
+
+    def join(self, peer: SimPeer, blocks: Optional[Bitfield]) -> None:
+        self.pending_arrivals -= 1
+        peer.present = True
+        peer.joined = self.now
+        self.present += 1
+        for block_id in blocks or ():
+            peer.index.mark_local(block_id)
+            self.copies[block_id] += 1
+        if not peer.index.missing_count():
+            self.mark_complete(peer, leaves=blocks is None)  # Os seeders iniciais ficam até o fim
+        elif self.args.mean_lifetime and blocks is None:
+            # Churn: o peer pode desistir antes de completar (os peers iniciais ficam)
+            self.schedule(self.rng.expovariate(1 / self.args.mean_lifetime), self.leave, peer)
+        self.tracker.announce(peer.id, "127.0.0.1", 0, now=self.now, complete=peer.complete)
+        self.announce(peer)
+        self.schedule(self.rng.uniform(0, CHOKE_INTERVAL), self.choke_round, peer)
+        self.schedule(self.rng.uniform(0, PEX_INTERVAL), self.pex_round, peer)
+
+    def announce(self, peer: SimPeer) -> None:
+        # Pede peers ao tracker e conecta aos que ainda não são vizinhos
+        if not peer.present:
+            return
+        if len(peer.neighbors) < NUMWANT:
+            self.tracker_queries += 1
+            for other_id in self.tracker.sample(NUMWANT, exclude=peer.id):
+                other = self.peers[other_id]
+                if other_id not in peer.neighbors and len(other.neighbors) < MAX_NEIGHBORS:
+                    self.connect(peer, other)
+        # Como no Swarm: sem nenhum vizinho, o tracker é consultado de novo logo
+        self.schedule(TRACKER_QUERY_INTERVAL if peer.neighbors else PEX_INTERVAL, self.announce, peer)
+
+    def pex_round(self, peer: SimPeer) -> None:
+        # PEX: conecta a vizinhos dos vizinhos, até PEX_MAX_ADDED sugestões de cada um (como o delta do PeerServer)
+        if not peer.present:
+            return
+        if not peer.complete:
+            for neighbor_id in list(peer.neighbors):
+                if len(peer.neighbors) >= NUMWANT:
+                    break
+                candidates = [other_id for other_id in self.peers[neighbor_id].neighbors
+                              if other_id != peer.id and other_id not in peer.neighbors]
+                for other_id in self.rng.sample(candidates, min(len(candidates), PEX_MAX_ADDED)):
+                    other = self.peers[other_id]
+                    if len(peer.neighbors) >= NUMWANT:
+                        break
+                    if len(other.neighbors) < MAX_NEIGHBORS:
+                        self.connect(peer, other)
+        self.schedule(PEX_INTERVAL, self.pex_round, peer)
+
+    def connect(self, a: SimPeer, b: SimPeer) -> None:
+        # Conexão nos dois sentidos: cada lado recebe o bitfield do outro
+        a.neighbors.add(b.id)
+        b.neighbors.add(a.id)
+        for local, remote in ((a, b), (b, a)):
+            if not local.complete:
+                local.index.set_peer(remote.id, remote.blocks)
+        for uploader, downloader in ((a, b), (b, a)):
+            # Como o PeerServer.admit: um slot livre é ocupado na hora, sem esperar a próxima rodada
+            if (not downloader.complete and len(uploader.unchoked) < UPLOAD_SLOTS
+                    and downloader.index.interesting_count(uploader.id)):
+                uploader.unchoked.add(downloader.id)
+                self.start_upload(uploader, downloader)
+
+    def leave(self, peer: SimPeer) -> None:
+        if not peer.present:
+            return
+        peer.present = False
+        self.present -= 1
+        if not peer.complete:
+            self.departed_incomplete += 1
+        self.tracker.remove(peer.id)
+        for block_id in peer.blocks:
+            self.copies[block_id] -= 1
+        # Transferências em andamento para este peer são perdidas
+        for downloader_id, (block_id, _) in peer.uploads.items():
+            downloader = self.peers[downloader_id]
+            downloader.inflight.discard(block_id)
+            downloader.downloads -= 1
+        peer.uploads.clear()
+        for neighbor_id in peer.neighbors:
+            neighbor = self.peers[neighbor_id]
+            neighbor.neighbors.discard(peer.id)
+            neighbor.unchoked.discard(peer.id)
+            neighbor.uploads.pop(peer.id, None)
+            if not neighbor.complete:
+                neighbor.index.remove_peer(peer.id)
+        peer.neighbors.clear()
+
+    def mark_complete(self, peer: SimPeer, leaves: bool = True) -> None:
+        peer.completed = self.now
+        peer.complete = True
+        self.completed_count += 1
+        self.tracker.announce(peer.id, "127.0.0.1", 0, now=self.now, complete=True)
+        if leaves and self.args.seed_time >= 0:
+            self.schedule(self.rng.expovariate(1 / self.args.seed_time) if self.args.seed_time else 0, self.leave, peer)
+
+    # ------------------------------------------------------------------
+    # Choking e transferências
+    # ------------------------------------------------------------------
+
+    def choke_round(self, peer: SimPeer) -> None:
+        if not peer.present:
+            return
+        peers = self.peers
+        candidates = [n for n in peer.neighbors if not peers[n].complete and peers[n].index.interesting_count(peer.id)]
+        unchoked = set(peer.strategy.update_unchoked_peers(
+            candidates, peer.rates(peer.received, peer.previous_received, candidates),
+            peer.rates(peer.sent, peer.previous_sent, candidates), seeding=peer.complete))
+        for choked_id in peer.unchoked - unchoked:
+            # CHOKE: a transferência em andamento para o peer é descartada
+            entry = peer.uploads.pop(choked_id, None)
+            if entry is not None:
+                downloader = peers[choked_id]
+                downloader.inflight.discard(entry[0])
+                downloader.downloads -= 1
+        newly = unchoked - peer.unchoked
+        peer.unchoked = unchoked
+        for downloader_id in newly:
+            self.start_upload(peer, peers[downloader_id])
+        peer.previous_received, peer.received = peer.received, {}
+        peer.previous_sent, peer.sent = peer.sent, {}
+        self.schedule(CHOKE_INTERVAL, self.choke_round, peer)
+
+    def start_upload(self, uploader: SimPeer, downloader: SimPeer) -> None:
+        # O downloader escolhe, entre os blocos do uploader, o mais raro que ainda não está recebendo
+        if downloader.id in uploader.uploads or downloader.complete or not downloader.present:
+            return
+        blocks = downloader.index.rarest_for_peer(uploader.id, 1, downloader.inflight.__contains__)
+        if not blocks:
+            return
+        block_id = blocks[0]
+        downloader.inflight.add(block_id)
+        downloader.downloads += 1
+        # A banda de upload se divide entre os desbloqueados; a de download, entre as transferências recebidas
+        rate = min(uploader.upload / max(1, len(uploader.unchoked)), downloader.download / downloader.downloads)
+        duration = uploader.latency + downloader.latency + self.block_size / rate
+        self.transfer_ids += 1
+        uploader.uploads[downloader.id] = (block_id, self.transfer_ids)
+        self.schedule(duration, self.transfer_done, uploader, downloader, self.transfer_ids)
+
+    def transfer_done(self, uploader: SimPeer, downloader: SimPeer, transfer_id: int) -> None:
+        entry = uploader.uploads.get(downloader.id)
+        if entry is None or entry[1] != transfer_id:
+            return  # Cancelada por CHOKE ou pela saída de um dos peers
+        block_id = entry[0]
+        del uploader.uploads[downloader.id]
+        downloader.inflight.discard(block_id)
+        downloader.downloads -= 1
+        self.transfers += 1
+        size = self.block_size
+        downloader.received[uploader.id] = downloader.received.get(uploader.id, 0) + size
+        uploader.sent[downloader.id] = uploader.sent.get(downloader.id, 0) + size
+        if block_id not in downloader.blocks:
+            downloader.index.mark_local(block_id)
+            self.copies[block_id] += 1
+            # HAVE para os vizinhos; quem foi desbloqueado pelo downloader pode passar a querer o bloco
+            peers, unchoked, uploads, source = self.peers, downloader.unchoked, downloader.uploads, downloader.id
+            for neighbor_id in downloader.neighbors:
+                neighbor = peers[neighbor_id]
+                if neighbor.complete:
+                    continue
+                neighbor.index.peer_has(source, block_id)
+                if neighbor_id in unchoked and neighbor_id not in uploads:
+                    self.start_upload(downloader, neighbor)
+            if not downloader.index.missing_count():
+                self.mark_complete(downloader)
+                return
+        self.start_upload(uploader, downloader)
+
+    # ------------------------------------------------------------------
+    # Medições
+    # ------------------------------------------------------------------
+
+    def sample(self) -> None:
+        # Curva de replicação: réplicas por bloco entre os peers presentes
+        copies = self.copies
+        self.samples.append({
+            "time": round(self.now, 1),
+            "present": self.present,
+            "complete": self.completed_count,
+            "min_copies": min(copies) if copies else 0,
+            "mean_copies": round(sum(copies) / len(copies), 2) if copies else 0,
+            "max_copies": max(copies) if copies else 0,
+            "transfers": self.transfers,
+        })
+        # Sem nenhuma cópia de um bloco e sem peers iniciais por chegar, ninguém mais completa
+        self.stalled = not self.pending_arrivals and self.copies and not min(self.copies)
+        self.schedule(self.args.sample_interval, self.sample)
+
+    def report(self, cpu_seconds: float) -> dict:
+        durations = sorted(peer.completed - peer.joined for peer in self.peers.values()
+                           if peer.completed is not None and peer.completed > peer.joined)
+        distribution = {}
+        if durations:
+            quantiles = statistics.quantiles(durations, n=100) if len(durations) > 1 else [durations[0]] * 99
+            distribution = {
+                "count": len(durations),
+                "mean": round(statistics.fmean(durations), 2),
+                "min": round(durations[0], 2),
+                "p10": round(quantiles[9], 2),
+                "p50": round(quantiles[49], 2),
+                "p90": round(quantiles[89], 2),
+                "p99": round(quantiles[98], 2),
+                "max": round(durations[-1], 2),
+            }
+        return {
+            "config": vars(self.args),
+            "simulated_seconds": round(self.now, 1),
+            "cpu_seconds": round(cpu_seconds, 1),
+            "transfers": self.transfers,
+            "tracker_queries": self.tracker_queries,
+            "completed": self.completed_count,
+            "departed_incomplete": self.departed_incomplete,
+            "stalled": bool(self.stalled),
+            "completion_seconds": distribution,
+            "replication": self.samples,
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulador de eventos discretos do swarm (sem sockets)")
+    parser.add_argument("--peers", type=int, default=10000, help="peers simulados")
+    parser.add_argument("--blocks", type=int, default=100, help="blocos do arquivo")
+    parser.add_argument("--block-size", type=int, default=256 * 1024, help="tamanho do bloco (bytes)")
+    parser.add_argument("--initial-peers", type=int, default=10, help="peers que começam com blocos")
+    parser.add_argument("--placement", choices=sorted(PLACEMENT_POLICIES), default="random",
+                        help="política de distribuição inicial (a mesma do split_and_distribute)")
+    parser.add_argument("--replication", type=int, default=None, help="cópias de cada bloco entre os peers iniciais")
+    parser.add_argument("--upload", type=float, default=512, help="banda média de upload (KB/s)")
+    parser.add_argument("--download", type=float, default=2048, help="banda média de download (KB/s)")
+    parser.add_argument("--heterogeneity", type=float, default=0.5, help="desvio (log-normal) da banda entre peers")
+    parser.add_argument("--latency", type=float, default=40, help="latência média de acesso (ms)")
+    parser.add_argument("--arrival-window", type=float, default=600, help="os peers chegam ao longo deste intervalo (s)")
+    parser.add_argument("--mean-lifetime", type=float, default=0,
+                        help="churn: tempo médio (s) até um peer incompleto desistir (0 = sem churn)")
+    parser.add_argument("--seed-time", type=float, default=300,
+                        help="tempo médio (s) como seeder após completar (-1 = fica até o fim)")
+    parser.add_argument("--sample-interval", type=float, default=SAMPLE_INTERVAL, help="intervalo das amostras (s)")
+    parser.add_argument("--max-time", type=float, default=24 * 3600, help="tempo simulado máximo (s)")
+    parser.add_argument("--seed", type=int, default=1, help="semente dos sorteios")
+    parser.add_argument("--output", default=None, help="arquivo JSON com o relatório completo")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)  # A Strategy loga cada rodada de cada peer
+    result = Simulator(args).run()
+    completion = result["completion_seconds"]
+    print(f"[SIM] {result['completed']}/{args.peers} peers completaram em {result['simulated_seconds']}s simulados "
+          f"({result['departed_incomplete']} desistiram); CPU {result['cpu_seconds']}s, {result['transfers']} blocos, "
+          f"{result['tracker_queries']} consultas ao tracker")
+    if completion:
+        print(f"[SIM] Tempo até completar (s): p10 {completion['p10']}, p50 {completion['p50']}, "
+              f"p90 {completion['p90']}, p99 {completion['p99']}, máx {completion['max']}")
+    for sample in result["replication"][::max(1, len(result["replication"]) // 10)]:
+        print(f"[SIM] t={sample['time']}s: {sample['present']} presentes, {sample['complete']} completos, "
+              f"réplicas min/média {sample['min_copies']}/{sample['mean_copies']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"[SIM] Relatório gravado em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
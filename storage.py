@@ -0,0 +1,447 @@
+import os
+import mmap
+import zlib
+import struct
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple, BinaryIO
+
+from bitfield import Bitfield
+
+# Tipos de armazenamento suportados pelo FileManager
+STORAGE_BLOCKS = "blocks"  # Um arquivo block_N.bin por bloco (formato original)
+STORAGE_SINGLE = "single"  # Um único arquivo pré-alocado, blocos gravados em offset = id * block_size
+
+DATA_FILENAME = "data.bin"
+INDEX_FILENAME = "have.idx"
+SNAPSHOT_FILENAME = "have.snap"
+
+# Cabeçalho do índice: assinatura + tamanho do bloco; cada registro: id do bloco + tamanho gravado
+INDEX_MAGIC = b"MBIX"
+INDEX_HEADER = struct.Struct("!4sI")
+INDEX_RECORD = struct.Struct("!II")
+# Retrato do índice: assinatura, tamanho do bloco, nº de blocos do bitfield, nº de blocos curtos e CRC32 do corpo
+SNAPSHOT_MAGIC = b"MBSN"
+SNAPSHOT_HEADER = struct.Struct("!4sIIII")
+
+JOURNAL_SYNC_INTERVAL = 0.5        # Atraso máximo (s) até um bloco gravado entrar no índice em disco
+JOURNAL_SYNC_RECORDS = 1024        # Registros pendentes que disparam a gravação antes do prazo
+JOURNAL_COMPACT_RECORDS = 64 * 1024  # Tamanho do índice (registros) a partir do qual ele vira um retrato
+COPY_CHUNK = 1024 * 1024  # Trecho copiado por vez quando copy_file_range não está disponível
+
+
+def parse_block_filename(filename: str) -> Optional[int]:
+    # Extrai o índice de um nome no formato block_N.bin (ou None, se não seguir o padrão)
+    if filename.startswith("block_") and filename.endswith(".bin"):
+        try:
+            return int(filename[len("block_"):-len(".bin")])
+        except ValueError:
+            return None
+    return None
+
+
+class BlockDirStore:
+    """
+    Armazenamento original: cada bloco é um arquivo block_N.bin no diretório do peer.
+    """
+
+    def __init__(self, blocks_dir: str, total_blocks: int = 0):
+        self.blocks_dir = blocks_dir
+        self.total_blocks = total_blocks
+        os.makedirs(self.blocks_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.have: Optional[Bitfield] = None  # Montado na primeira listagem e atualizado a cada escrita
+
+    def _path(self, block_num: int) -> str:
+        return os.path.join(self.blocks_dir, f"block_{block_num}.bin")
+
+    def block_ids(self) -> Bitfield:
+        # Lista o diretório só na primeira chamada; depois o mapa vem da memória
+        with self.lock:
+            if self.have is None:
+                self.have = Bitfield(self.total_blocks)
+                for filename in os.listdir(self.blocks_dir):
+                    index = parse_block_filename(filename)
+                    if index is not None:
+                        self.have.add(index)
+            return self.have.copy()
+
+    def write(self, block_num: int, data: bytes) -> None:
+        with open(self._path(block_num), "wb") as f:
+            f.write(data)
+        with self.lock:
+            if self.have is not None:
+                self.have.add(block_num)
+
+    def read(self, block_num: int) -> Optional[bytes]:
+        try:
+            with open(self._path(block_num), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def span(self, block_num: int) -> Optional[Tuple[BinaryIO, int, int]]:
+        # Este formato não mantém um arquivo aberto para envio direto (sendfile)
+        return None
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SingleFileStore:
+    """
+    Armazenamento em um único arquivo esparso por peer.
+
+    O bloco N fica em offset = N * block_size. Quais blocos já foram gravados
+    (e o tamanho dos que não ocupam um bloco inteiro) fica em memória e em
+    dois arquivos: um retrato compacto (have.snap, o bitfield inteiro) e um
+    diário append-only (have.idx) com os blocos gravados depois dele. Na
+    abertura basta ler o retrato e reaplicar o diário, sem varrer diretórios
+    nem ler os dados. As leituras são servidas por um mmap do arquivo, e
+    span() expõe (arquivo, offset, tamanho) para envio direto com
+    socket.sendfile.
+
+    Os registros do diário são gravados em lote (até `sync_interval`
+    segundos ou `sync_records` registros depois do bloco), sempre depois de
+    um fsync dos dados: após uma queda, o índice nunca aponta para um bloco
+    que não chegou ao disco, e no pior caso os últimos blocos são baixados
+    de novo. Com `sync_interval=0` cada bloco é registrado na própria escrita.
+
+    Com `read_only=True` (processos que só servem blocos, como os workers do
+    seeder), nada é criado nem alterado: o arquivo de dados é aberto só para
+    leitura e o índice é lido uma vez, sem diário nem retrato novos.
+    """
+
+    def __init__(self, directory: str, block_size: int, total_size: Optional[int] = None, total_blocks: int = 0,
+                 sync_interval: float = JOURNAL_SYNC_INTERVAL, sync_records: int = JOURNAL_SYNC_RECORDS,
+                 read_only: bool = False):
+        self.directory = directory
+        self.block_size = block_size
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, DATA_FILENAME)
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILENAME)
+        self.sync_interval = sync_interval
+        self.sync_records = sync_records
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()  # Serializa as gravações do diário e do retrato
+        self.closed = False
+
+        # Abre (ou cria) o arquivo de dados e pré-aloca o tamanho total sem ocupar disco (arquivo esparso)
+        self.fd = os.open(self.data_path, os.O_RDONLY if read_only else os.O_RDWR | os.O_CREAT, 0o644)
+        if total_size and not read_only and os.fstat(self.fd).st_size < total_size:
+            os.ftruncate(self.fd, total_size)
+        # Arquivo separado só para leitura, usado pelo sendfile do servidor
+        self.read_file = open(self.data_path, "rb")
+        self.mm: Optional[mmap.mmap] = None
+        self.mapped_size = 0
+
+        # Mapa de blocos presentes, mantido em memória, e tamanhos dos blocos menores que block_size
+        self.have, self.short = read_snapshot(self.snapshot_path, block_size, total_blocks)
+        self.journal_records = self._replay_index()
+        self.pending: List[bytes] = []  # Registros ainda não gravados no diário
+        self.sync_timer: Optional[threading.Timer] = None
+        self.index_file: Optional[BinaryIO] = None
+        if read_only:
+            return
+        self.index_file = open(self.index_path, "ab")
+        if self.index_file.tell() == 0:
+            self.index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, block_size))
+            self.index_file.flush()
+        if self.journal_records >= JOURNAL_COMPACT_RECORDS:
+            with self.sync_lock:
+                self._compact()
+
+    def _replay_index(self) -> int:
+        # Reaplica o diário sobre o retrato; registros incompletos no final (queda no meio da escrita) são ignorados
+        if not os.path.exists(self.index_path):
+            return 0
+        with open(self.index_path, "rb") as f:
+            raw = f.read()
+        if len(raw) < INDEX_HEADER.size:
+            return 0
+        magic, block_size = INDEX_HEADER.unpack_from(raw)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"Índice inválido: {self.index_path}")
+        if block_size != self.block_size:
+            raise ValueError(f"Índice criado com blocos de {block_size} bytes, esperado {self.block_size}")
+        body = memoryview(raw)[INDEX_HEADER.size:]
+        usable = len(body) - len(body) % INDEX_RECORD.size
+        records = 0
+        for block_id, length in INDEX_RECORD.iter_unpack(body[:usable]):
+            self._mark(block_id, length)
+            records += 1
+        return records
+
+    def _mark(self, block_id: int, length: int) -> None:
+        self.have.add(block_id)
+        if length != self.block_size:
+            self.short[block_id] = length
+        else:
+            self.short.pop(block_id, None)
+
+    def _length(self, block_num: int) -> Optional[int]:
+        # Bytes gravados do bloco (None se ausente); chamado com self.lock
+        if block_num not in self.have:
+            return None
+        return self.short.get(block_num, self.block_size)
+
+    def block_ids(self) -> Bitfield:
+        with self.lock:
+            return self.have.copy()
+
+    def write(self, block_num: int, data: bytes) -> None:
+        # Grava o bloco na sua posição do arquivo; o registro no índice segue no próximo lote
+        if self.read_only:
+            raise PermissionError(f"{self.data_path} foi aberto só para leitura")
+        os.pwrite(self.fd, data, block_num * self.block_size)
+        with self.lock:
+            self._mark(block_num, len(data))
+            self.pending.append(INDEX_RECORD.pack(block_num, len(data)))
+            sync_now = not self.sync_interval or len(self.pending) >= self.sync_records
+            if not sync_now and self.sync_timer is None:
+                self.sync_timer = threading.Timer(self.sync_interval, self.sync)
+                self.sync_timer.daemon = True
+                self.sync_timer.start()
+        if sync_now:
+            self.sync()
+
+    def sync(self) -> None:
+        """
+        Grava no diário os registros pendentes: fsync dos dados, depois os
+        registros e fsync do índice.
+        """
+        with self.sync_lock:
+            with self.lock:
+                records, self.pending = self.pending, []
+                timer, self.sync_timer = self.sync_timer, None
+            if timer is not None:
+                timer.cancel()
+            if not records or self.closed:
+                return
+            os.fsync(self.fd)  # Os dados chegam ao disco antes do registro que aponta para eles
+            self.index_file.write(b"".join(records))
+            self.index_file.flush()
+            os.fsync(self.index_file.fileno())
+            self.journal_records += len(records)
+            if self.journal_records >= JOURNAL_COMPACT_RECORDS:
+                self._compact()
+
+    def _compact(self) -> None:
+        # Grava o estado atual como retrato e recomeça o diário vazio; chamado com self.sync_lock
+        with self.lock:
+            have, short = self.have.copy(), dict(self.short)
+        os.fsync(self.fd)  # O retrato inclui blocos que talvez ainda estejam só no cache de páginas
+        write_snapshot(self.snapshot_path, self.block_size, have, short)
+        # Registros pendentes continuam em self.pending e vão para o diário novo
+        self.index_file.close()
+        self.index_file = open(self.index_path, "wb")
+        self.index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, self.block_size))
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+        self.journal_records = 0
+
+    def _mapping(self, end: int) -> Optional[mmap.mmap]:
+        # Retorna um mmap que cobre até `end`, remapeando se o arquivo cresceu
+        if self.mm is None or self.mapped_size < end:
+            size = os.fstat(self.fd).st_size
+            if size < end:
+                return None
+            # O mmap anterior não é fechado explicitamente: memoryviews já entregues continuam válidas
+            self.mm = mmap.mmap(self.fd, size, access=mmap.ACCESS_READ)
+            self.mapped_size = size
+        return self.mm
+
+    def view(self, block_num: int) -> Optional[memoryview]:
+        """
+        Retorna uma memoryview do bloco dentro do mmap, sem cópia.
+        """
+        with self.lock:
+            length = self._length(block_num)
+            if length is None:
+                return None
+            offset = block_num * self.block_size
+            mm = self._mapping(offset + length)
+        if mm is None:
+            return None
+        return memoryview(mm)[offset:offset + length]
+
+    def read(self, block_num: int) -> Optional[bytes]:
+        view = self.view(block_num)
+        return bytes(view) if view is not None else None
+
+    def span(self, block_num: int) -> Optional[Tuple[BinaryIO, int, int]]:
+        # Retorna (arquivo, offset, tamanho) para envio direto do disco com sendfile
+        with self.lock:
+            length = self._length(block_num)
+        if length is None:
+            return None
+        return self.read_file, block_num * self.block_size, length
+
+    def flush(self) -> None:
+        # Grava os registros pendentes e condensa o diário em um retrato (próxima abertura lê só o retrato)
+        self.sync()
+        with self.sync_lock:
+            if self.journal_records and not self.closed and not self.read_only:
+                self._compact()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.flush()
+        with self.sync_lock, self.lock:
+            self.closed = True
+            if self.index_file is not None:
+                self.index_file.close()
+            self.read_file.close()
+            self.mm = None
+            os.close(self.fd)
+
+
+def read_snapshot(path: str, block_size: int, total_blocks: int = 0) -> Tuple[Bitfield, Dict[int, int]]:
+    """
+    Lê o retrato do índice: (bitfield dos blocos presentes, {bloco: tamanho}
+    dos blocos menores que block_size). Sem retrato, ou com um retrato
+    corrompido, começa vazio (o diário e, no pior caso, um novo download
+    completam o estado).
+    """
+    empty = Bitfield(total_blocks), {}
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return empty
+    if len(raw) < SNAPSHOT_HEADER.size:
+        logging.warning(f"Retrato do índice truncado, ignorado: {path}")
+        return empty
+    magic, snap_block_size, size, short_count, crc = SNAPSHOT_HEADER.unpack_from(raw)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"Retrato do índice inválido: {path}")
+    if snap_block_size != block_size:
+        raise ValueError(f"Retrato criado com blocos de {snap_block_size} bytes, esperado {block_size}")
+    body = memoryview(raw)[SNAPSHOT_HEADER.size:]
+    bits_length = (size + 7) // 8
+    if len(body) != bits_length + short_count * INDEX_RECORD.size or zlib.crc32(body) != crc:
+        logging.warning(f"Retrato do índice corrompido, ignorado: {path}")
+        return empty
+    have = Bitfield(max(size, total_blocks), bytes(body[:bits_length]))
+    short = dict(INDEX_RECORD.iter_unpack(body[bits_length:]))
+    return have, short
+
+
+def write_snapshot(path: str, block_size: int, have: Bitfield, short: Dict[int, int]) -> None:
+    # Grava o retrato de forma atômica: arquivo temporário, fsync e rename sobre o anterior
+    body = have.to_bytes() + b"".join(INDEX_RECORD.pack(block_id, length) for block_id, length in sorted(short.items()))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, block_size, have.size, len(short), zlib.crc32(body)))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    directory_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)  # Torna o rename durável
+    finally:
+        os.close(directory_fd)
+
+
+def _copy_range(src_fd: int, dst_fd: int, offset: int, length: int) -> None:
+    # Copia um trecho entre arquivos na mesma posição; copy_file_range evita passar os dados pelo processo
+    while length > 0:
+        if hasattr(os, "copy_file_range"):
+            try:
+                copied = os.copy_file_range(src_fd, dst_fd, length, offset, offset)
+            except OSError:
+                copied = 0  # Sistema de arquivos sem suporte: recorre a pread/pwrite
+        else:
+            copied = 0
+        if copied == 0:
+            data = os.pread(src_fd, min(length, COPY_CHUNK), offset)
+            if not data:
+                raise ValueError(f"Arquivo de origem terminou antes do esperado (offset {offset})")
+            copied = os.pwrite(dst_fd, data, offset)
+        offset += copied
+        length -= copied
+
+
+def seed_store(src_path: str, directory: str, block_size: int, blocks: Bitfield, link: bool = False) -> int:
+    """
+    Cria o armazenamento de arquivo único de um peer diretamente a partir do
+    arquivo original, com os blocos indicados no bitfield.
+
+    Como o bloco N fica em offset = N * block_size nos dois arquivos, cada
+    sequência de blocos consecutivos vira uma única cópia (copy_file_range).
+    Com `link=True` e todos os blocos presentes, data.bin vira um hardlink do
+    original, sem copiar nada; o SingleFileStore abre o data.bin para
+    escrita, então qualquer escrita nele altera também o original.
+    Retorna o número de bytes copiados.
+    """
+    os.makedirs(directory, exist_ok=True)
+    data_path = os.path.join(directory, DATA_FILENAME)
+    file_size = os.path.getsize(src_path)
+    total_blocks = (file_size + block_size - 1) // block_size
+    copied = 0
+    if os.path.exists(data_path):
+        os.remove(data_path)
+
+    linked = False
+    if link and len(blocks) == total_blocks:
+        try:
+            os.link(src_path, data_path)
+            linked = True
+        except OSError:
+            pass  # Outro dispositivo ou sem permissão: copia normalmente
+
+    if not linked:
+        src_fd = os.open(src_path, os.O_RDONLY)
+        dst_fd = os.open(data_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(dst_fd, file_size)  # Arquivo esparso: só os trechos copiados ocupam disco
+            for first, count in blocks.runs():
+                offset = first * block_size
+                length = min(count * block_size, file_size - offset)
+                _copy_range(src_fd, dst_fd, offset, length)
+                copied += length
+        finally:
+            os.close(src_fd)
+            os.close(dst_fd)
+
+    # Índice já condensado: o retrato com o bitfield e um diário vazio
+    last = total_blocks - 1
+    short = {last: file_size - last * block_size} if last in blocks and file_size % block_size else {}
+    write_snapshot(os.path.join(directory, SNAPSHOT_FILENAME), block_size, blocks, short)
+    with open(os.path.join(directory, INDEX_FILENAME), "wb") as index_file:
+        index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, block_size))
+    return copied
+
+
+def migrate_block_dir(blocks_dir: str, store: SingleFileStore, remove: bool = True) -> int:
+    """
+    Migra os blocos do formato antigo (peers/<id>/blocks/block_N.bin) para o
+    arquivo único. Retorna o número de blocos migrados.
+    """
+    if not os.path.isdir(blocks_dir):
+        return 0
+    migrated = []
+    for filename in os.listdir(blocks_dir):
+        block_num = parse_block_filename(filename)
+        if block_num is None:
+            continue
+        path = os.path.join(blocks_dir, filename)
+        with open(path, "rb") as f:
+            store.write(block_num, f.read())
+        migrated.append(path)
+    store.sync()  # Os originais só são apagados depois que o índice registrou os blocos
+    if remove:
+        for path in migrated:
+            os.remove(path)
+    if remove and not os.listdir(blocks_dir):
+        os.rmdir(blocks_dir)
+    if migrated:
+        logging.info(f"Migrados {len(migrated)} blocos de {blocks_dir} para {store.data_path}")
+    return len(migrated)
@@ -1,65 +1,81 @@
 import random
 import logging
-from typing import Dict, Set, List
+from typing import Dict, List
 
-def select_rarest_blocks(peer_block_map: Dict[str, Set[int]], my_blocks: Set[int]) -> List[int]:
+from availability import AvailabilityIndex
+from bitfield import Bitfield
+
+def select_rarest_blocks(peer_block_map: Dict[str, Bitfield], my_blocks: Bitfield) -> List[int]:
     """
     Estratégia Rarest First: prioriza os blocos menos comuns entre os peers disponíveis.
 
     Args:
-        peer_block_map (dict): Mapeamento peer -> blocos disponíveis
-        my_blocks (set): Blocos já presentes no peer atual
+        peer_block_map (dict): Mapeamento peer -> bitfield dos blocos disponíveis
+        my_blocks (Bitfield): Blocos já presentes no peer atual
 
     Returns:
         list: Lista ordenada dos blocos mais raros para os mais comuns
+
+    Para decisões repetidas, mantenha um AvailabilityIndex atualizado
+    incrementalmente em vez de chamar esta função a cada ciclo.
     """
-    block_frequency = {}
+    return AvailabilityIndex.from_map(peer_block_map, my_blocks).rarest()
 
-    # Conta a frequência de cada bloco entre os peers, ignorando os que o peer atual já tem
-    for blocks in peer_block_map.values():
-        for block in blocks:
-            if block not in my_blocks:
-                block_frequency[block] = block_frequency.get(block, 0) + 1
+REGULAR_SLOTS = 4       # Peers desbloqueados pela reciprocidade medida
+OPTIMISTIC_ROUNDS = 3   # O desbloqueio otimista troca de peer a cada 3 rodadas (30 s)
 
-    # Retorna os blocos ordenados do mais raro para o mais comum
-    return sorted(block_frequency.keys(), key=lambda b: block_frequency[b])
 
 class Strategy:
-    def __init__(self):
-        # Lista de peers desbloqueados fixos (até 4)
+    """
+    Tit-for-tat por taxa medida: a cada rodada, desbloqueia os REGULAR_SLOTS
+    peers interessados que mais nos enviaram (bytes/s na janela recente) e
+    mais um peer aleatório (unchoke otimista), que dá a peers novos a chance
+    de provar reciprocidade. Como seeder não há o que receber, e a ordem passa
+    a ser pela taxa de upload para cada peer.
+    """
+
+    def __init__(self, regular_slots: int = REGULAR_SLOTS, optimistic_rounds: int = OPTIMISTIC_ROUNDS):
+        self.regular_slots = regular_slots
+        self.optimistic_rounds = optimistic_rounds
+        # Lista de peers desbloqueados fixos (até regular_slots)
         self.regular_unchoked: List[str] = []
         # Peer desbloqueado aleatoriamente (optimistic unchoke)
         self.optimistic_peer: str = ""
+        self.rounds = 0
 
-    def update_unchoked_peers(self, known_peers: List[str], peer_block_map: Dict[str, Set[int]], my_blocks: Set[int]):
+    def update_unchoked_peers(self, candidates: List[str], download_rates: Dict[str, float],
+                              upload_rates: Dict[str, float], seeding: bool = False) -> List[str]:
         """
-        Atualiza os peers desbloqueados com base na utilidade (tit-for-tat + unchoke otimista).
+        Atualiza os peers desbloqueados com base na reciprocidade (tit-for-tat + unchoke otimista).
 
         Args:
-            known_peers (list): Lista de peers conhecidos (formato "IP:porta")
-            peer_block_map (dict): Mapeamento peer -> blocos disponíveis
-            my_blocks (set): Blocos já baixados
-        """
-        # Calcula quantos blocos úteis cada peer possui (ou seja, blocos que eu ainda não tenho)
-        scored_peers = []
-        for peer, blocks in peer_block_map.items():
-            useful_blocks = len(blocks - my_blocks)
-            scored_peers.append((peer, useful_blocks))
+            candidates (list): Peers interessados em nossos blocos (formato "IP:porta")
+            download_rates (dict): Bytes/s recebidos de cada peer
+            upload_rates (dict): Bytes/s enviados a cada peer
+            seeding (bool): True se já temos todos os blocos (ordena pela taxa de upload)
 
-        # Ordena os peers pelo número de blocos úteis (decrescente)
-        scored_peers.sort(key=lambda x: x[1], reverse=True)
+        Returns:
+            list: Peers desbloqueados (fixos + otimista)
+        """
+        rates = upload_rates if seeding else download_rates
+        # Ordena os candidatos pela taxa medida (decrescente); o embaralhamento desempata peers sem histórico
+        ranked = random.sample(candidates, len(candidates))
+        ranked.sort(key=lambda peer: rates.get(peer, 0.0), reverse=True)
 
-        # Seleciona os 4 mais úteis como peers desbloqueados fixos
-        self.regular_unchoked = [peer for peer, _ in scored_peers[:4]]
+        # Seleciona os mais recíprocos como peers desbloqueados fixos
+        self.regular_unchoked = ranked[:self.regular_slots]
 
-        # Escolhe aleatoriamente 1 peer entre os restantes como desbloqueado otimista
-        candidates = [peer for peer in known_peers if peer not in self.regular_unchoked]
-        self.optimistic_peer = random.choice(candidates) if candidates else ""
+        # O otimista continua por algumas rodadas; depois (ou se saiu da lista) é sorteado outro entre os restantes
+        others = ranked[self.regular_slots:]
+        if self.rounds % self.optimistic_rounds == 0 or self.optimistic_peer not in others:
+            self.optimistic_peer = random.choice(others) if others else ""
+        self.rounds += 1
 
         # Loga os peers desbloqueados para monitoramento
         logging.info(f"Unchoked peers: {self.regular_unchoked}")
         if self.optimistic_peer:
             logging.info(f"Optimistic unchoke: {self.optimistic_peer}")
+        return self.get_unchoked_peers()
 
     def get_unchoked_peers(self) -> List[str]:
         """
@@ -69,6 +85,6 @@ class Strategy:
 
     def should_request_from(self, peer_id: str) -> bool:
         """
-        Verifica se o peer remoto está atualmente desbloqueado.
+        Verifica se o peer remoto está atualmente desbloqueado (pode baixar deste peer).
         """
         return peer_id in self.get_unchoked_peers()
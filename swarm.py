@@ -0,0 +1,160 @@
+import os
+import time
+import logging
+from typing import Dict, Optional, Set
+
+from availability import AvailabilityIndex
+from file_manager import FileManager, BLOCK_SIZE
+from manifest import Manifest
+from protocol import NO_INFO_HASH
+from reconstruction import ProgressiveRebuild
+from peer_client import PeerClient
+from scheduler import DownloadScheduler
+
+NUMWANT = 30                 # Quantos peers pedir ao tracker em cada consulta (e máximo de conexões de saída)
+TRACKER_QUERY_INTERVAL = 60  # Com PEX, o tracker só é consultado a cada 60 s (ou enquanto não houver peer conectado)
+PEER_RETRY_INTERVAL = 30     # Tempo (s) antes de tentar de novo um peer que recusou a conexão
+
+
+class Swarm:
+    """
+    Tudo o que um peer mantém para um arquivo (swarm): armazenamento, índice
+    de disponibilidade, cliente, escalonador e reconstrução.
+
+    Um mesmo processo pode participar de vários swarms; o servidor, o pool de
+    conexões, o verificador, o cache de blocos e a estratégia de choking são
+    compartilhados entre eles, e cada swarm é identificado pelo info_hash do
+    seu manifesto.
+    """
+
+    def __init__(self, peer_id: str, directory: str, output_path: str, manifest: Optional[Manifest] = None,
+                 total_blocks: Optional[int] = None, block_size: int = BLOCK_SIZE, storage: str = "single",
+                 pool=None, verifier=None, cache=None, numwant: int = NUMWANT, server=None):
+        self.peer_id = peer_id
+        self.manifest = manifest
+        if manifest is not None:
+            total_blocks, block_size = manifest.block_count, manifest.block_size
+        # Sem manifesto (modo antigo) não há HANDSHAKE: o swarm é o padrão do servidor e do tracker
+        self.info_hash = manifest.info_hash if manifest is not None else NO_INFO_HASH
+        self.total_blocks = total_blocks
+        self.numwant = numwant
+        self.server = server  # Servidor compartilhado: os peers que se conectam a ele também são candidatos
+        self.file_manager = FileManager(peer_id, storage=storage, block_size=block_size, total_blocks=total_blocks,
+                                        file_size=manifest.file_size if manifest is not None else None,
+                                        cache=cache, info_hash=self.info_hash, directory=directory)
+        # Índice de disponibilidade (réplicas por bloco), atualizado pelos HAVEs recebidos e pelos blocos salvos
+        self.index = AvailabilityIndex(total_blocks, self.file_manager.load_blocks())
+        self.file_manager.add_listener(self.index.mark_local)
+        # Reconstrução progressiva: cada bloco salvo já é gravado na sua posição do arquivo de saída
+        self.rebuild = ProgressiveRebuild(output_path, block_size, total_blocks,
+                                          manifest.file_size if manifest is not None else None)
+        self.rebuild.attach(self.file_manager)
+        self.client = PeerClient(peer_id, self.file_manager, index=self.index, manifest=manifest, pool=pool,
+                                 info_hash=self.info_hash if manifest is not None else None, verifier=verifier)
+        self.scheduler = DownloadScheduler(peer_id, self.client, self.file_manager, self.index)
+        self.completed = False
+        # Descoberta de peers: a última resposta do tracker, os peers que se conectaram a nós
+        # e os recebidos por PEX; o tracker vira fonte lenta, usada na entrada e como reserva
+        self.address: Optional[str] = None  # Endereço de escuta deste peer (nunca é candidato)
+        self.tracker_peers: Set[str] = set()
+        self.next_tracker_query = 0.0
+        self.retry_after: Dict[str, float] = {}  # Peer -> instante da próxima tentativa de conexão
+
+    @property
+    def name(self) -> str:
+        # Nome usado nos logs: o arquivo do manifesto (ou "padrão" no modo antigo)
+        return self.manifest.file_name if self.manifest is not None else "padrão"
+
+    def register(self, tracker, host: str, port: int) -> bool:
+        self.address = f"{host}:{port}"
+        return tracker.register(self.peer_id, host, port, info_hash=self.info_hash)
+
+    def interested(self, peer: str, my_blocks) -> bool:
+        # O peer quer algo nosso se lhe falta algum bloco que temos (sem o bitfield dele, presume que sim)
+        remote = self.client.availability().get(peer)
+        return remote is None or my_blocks.difference_count(remote) > 0
+
+    def inbound_peers(self) -> Set[str]:
+        # Peers que abriram conexão com o nosso servidor neste swarm (sem HANDSHAKE, o
+        # endereço visto pelo servidor é a porta de saída do cliente, e não a de escuta)
+        if self.server is None or self.manifest is None:
+            return set()
+        return {peer for peer, hashes in self.server.connected_peers().items() if self.info_hash in hashes}
+
+    def gossip_peers(self) -> Set[str]:
+        # Endereços divulgados por PEX: os peers com conexão aberta, nos dois sentidos
+        return self.client.connected_peers() | self.inbound_peers()
+
+    def discover_peers(self, tracker, connected) -> None:
+        """
+        Conecta (troca inicial LIST) a peers conhecidos ainda não conectados,
+        até `numwant` conexões. O tracker só é consultado a cada
+        TRACKER_QUERY_INTERVAL, ou a cada ciclo enquanto não houver nenhum
+        peer conectado; no intervalo, os peers novos chegam por PEX e pelas
+        conexões recebidas. Sem manifesto (modo antigo, sem HANDSHAKE) não há
+        PEX e o tracker é consultado sempre.
+        """
+        now = time.monotonic()
+        if now >= self.next_tracker_query or not connected:
+            peers = tracker.get_peers(self.peer_id, self.numwant, info_hash=self.info_hash)
+            if peers:  # Com o tracker fora do ar, continua com a última lista
+                self.tracker_peers = {f"{peer['host']}:{peer['port']}" for peer in peers}
+            interval = TRACKER_QUERY_INTERVAL if self.manifest is not None else 0
+            self.next_tracker_query = now + interval
+
+        candidates = (self.tracker_peers | self.inbound_peers() | self.client.pex_peers()) - set(connected)
+        candidates.discard(self.address)
+        room = self.numwant - len(connected)
+        for peer in candidates:
+            if room <= 0:
+                break
+            if self.retry_after.get(peer, 0) > now:
+                continue
+            host, _, port = peer.rpartition(":")
+            if self.client.get_peer_blocks(host, int(port)) is None:
+                self.retry_after[peer] = now + PEER_RETRY_INTERVAL
+            else:
+                self.retry_after.pop(peer, None)
+                room -= 1
+
+    def download_loop(self, tracker) -> None:
+        """
+        Baixa os blocos que faltam até completar o arquivo; retorna quando o
+        arquivo estiver reconstruído (o peer continua como seeder do swarm).
+        """
+        while True:
+            # Carrega os blocos que este peer já possui
+            my_blocks = self.file_manager.load_blocks()
+            logging.debug(f"[{self.peer_id}] {self.name}: {len(my_blocks)}/{self.total_blocks} blocos")
+
+            # Se já tiver todos os blocos, conclui o arquivo (os blocos já foram gravados conforme chegaram)
+            if len(my_blocks) >= self.total_blocks:
+                logging.info(f"[{self.peer_id}] {self.name}: todos os blocos foram baixados. Concluindo a reconstrução...")
+                if self.rebuild.finish():
+                    logging.info(f"[{self.peer_id}] {self.name}: arquivo reconstruído com sucesso.")
+                    tracker.completed(info_hash=self.info_hash)
+                    logging.info(f"[{self.peer_id}] {self.name}: permanecendo online como seeder.")
+                    self.completed = True
+                    return
+                logging.warning(f"[{self.peer_id}] {self.name}: falha na reconstrução. Esperando mais blocos...")
+                time.sleep(3)
+                continue
+
+            # Faz a troca inicial (LIST) só com peers ainda não conectados; os demais
+            # mantêm o bitfield atualizado pelos anúncios HAVE da conexão persistente
+            self.discover_peers(tracker, self.client.availability())
+
+            # Baixa em paralelo dos peers que nos desbloquearam, do bloco mais raro para o mais comum.
+            # O escalonador reabastece os slots de cada peer assim que um bloco chega.
+            downloaded = self.scheduler.run(self.client.unchoked_peers())
+
+            if not downloaded:
+                # Nenhum bloco disponível agora; espera um HAVE/UNCHOKE/PEX dos peers conectados (ou 2s para buscar peers)
+                self.client.wait_for_update(timeout=2)
+
+
+def output_name(peer_id: str, manifest: Optional[Manifest], single: bool) -> str:
+    # Com um único swarm mantém o nome antigo; com vários, cada arquivo leva o próprio nome
+    if single or manifest is None:
+        return f"{peer_id}_reconstruido.txt"
+    return f"{peer_id}_{os.path.basename(manifest.file_name)}"
@@ -0,0 +1,84 @@
+import socket
+import threading
+import unittest
+
+from compression import CODEC_LZMA, CODEC_ZLIB, CompressionError, compress, decompress
+from connection_pool import PeerConnection
+from protocol import build_block, build_subblock, parse_message, parse_range, recv_frame
+
+
+class DecompressLimitTest(unittest.TestCase):
+    def test_exact_size_fits(self):
+        for codec in (CODEC_ZLIB, CODEC_LZMA):
+            data = b"abc" * 1000
+            self.assertEqual(decompress(codec, compress(codec, data, 6), len(data)), data)
+
+    def test_overrun_is_rejected(self):
+        for codec in (CODEC_ZLIB, CODEC_LZMA):
+            packed = compress(codec, b"\0" * 16385, 6)
+            with self.assertRaises(CompressionError):
+                decompress(codec, packed, 16384)
+            with self.assertRaises(CompressionError):
+                decompress(codec, packed, 0)  # Limite zero não pode virar "sem limite"
+
+
+class FakeServer:
+    """
+    Servidor de um só cliente que responde a cada GET com `inflated`
+    bytes comprimidos, ignorando o tamanho pedido.
+    """
+
+    def __init__(self, inflated: int):
+        self.inflated = inflated
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        sock, _ = self.listener.accept()
+        with sock:
+            while True:
+                frame = recv_frame(sock)
+                if frame is None:
+                    return
+                _, block_id, payload = parse_message(frame)
+                offset, length = parse_range(payload)
+                data = compress(CODEC_ZLIB, b"\0" * self.inflated, 6)
+                if length is None:
+                    sock.sendall(build_block(block_id, data, CODEC_ZLIB))
+                else:
+                    sock.sendall(build_subblock(block_id, offset, data, CODEC_ZLIB))
+
+    def close(self):
+        self.listener.close()
+
+
+class ConnectionDecompressLimitTest(unittest.TestCase):
+    def connect(self, inflated: int) -> PeerConnection:
+        server = FakeServer(inflated)
+        self.addCleanup(server.close)
+        conn = PeerConnection("127.0.0.1", server.port)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_subblock_within_requested_length(self):
+        conn = self.connect(16384)
+        self.assertEqual(conn.request_block(0, offset=0, length=16384).result(5), b"\0" * 16384)
+
+    def test_subblock_overrun_closes_connection(self):
+        # Um sub-bloco de 16 KB que descomprime para 1 MB é erro de protocolo
+        conn = self.connect(1024 * 1024)
+        with self.assertRaises(Exception):
+            conn.request_block(0, offset=16384, length=16384).result(5)
+        conn.reader.join(5)
+        self.assertTrue(conn.closed)
+
+    def test_block_limited_by_block_size(self):
+        conn = self.connect(64 * 1024)
+        with self.assertRaises(Exception):
+            conn.request_block(0, block_size=32 * 1024).result(5)
+        self.assertTrue(conn.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+from bitfield import Bitfield
+from reconstruction import ProgressiveRebuild
+
+BLOCK_SIZE = 64
+TOTAL_BLOCKS = 8
+FILE_SIZE = BLOCK_SIZE * (TOTAL_BLOCKS - 1) + 10
+
+
+class FakeStore:
+    # Armazenamento em memória que conta as leituras
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.reads = []
+
+    def read(self, block_id):
+        self.reads.append(block_id)
+        return self.blocks.get(block_id)
+
+
+class FakeFileManager:
+    def __init__(self, blocks):
+        self.store = FakeStore(blocks)
+
+    def add_sink(self, sink):
+        pass
+
+    def load_blocks(self):
+        return Bitfield.from_iterable(self.store.blocks)
+
+
+class ProgressiveRebuildRestartTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmp.name, "saida.txt")
+        content = os.urandom(FILE_SIZE)
+        self.content = content
+        self.blocks = {i: content[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE] for i in range(TOTAL_BLOCKS)}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def rebuild(self, blocks):
+        file_manager = FakeFileManager(blocks)
+        rebuild = ProgressiveRebuild(self.output, BLOCK_SIZE, TOTAL_BLOCKS, FILE_SIZE)
+        rebuild.attach(file_manager)
+        if rebuild.catch_up is not None:
+            rebuild.catch_up.join()
+        return rebuild, file_manager.store
+
+    def read_output(self):
+        with open(self.output, "rb") as f:
+            return f.read()
+
+    def test_complete_output_is_not_copied_again(self):
+        rebuild, store = self.rebuild(self.blocks)
+        self.assertTrue(rebuild.finish())
+        self.assertEqual(sorted(store.reads), list(range(TOTAL_BLOCKS)))
+
+        rebuild, store = self.rebuild(self.blocks)
+        self.assertEqual(store.reads, [])
+        self.assertTrue(rebuild.finish())
+        self.assertEqual(self.read_output(), self.content)
+
+    def test_restart_copies_only_missing_blocks(self):
+        half = {i: data for i, data in self.blocks.items() if i < TOTAL_BLOCKS // 2}
+        rebuild, _ = self.rebuild(half)
+        rebuild.save_progress()
+        os.close(rebuild.fd)
+
+        rebuild, store = self.rebuild(self.blocks)
+        self.assertEqual(sorted(store.reads), list(range(TOTAL_BLOCKS // 2, TOTAL_BLOCKS)))
+        self.assertTrue(rebuild.finish())
+        self.assertEqual(self.read_output(), self.content)
+
+    def test_modified_output_is_copied_again(self):
+        rebuild, _ = self.rebuild(self.blocks)
+        self.assertTrue(rebuild.finish())
+        with open(self.output, "r+b") as f:
+            f.write(b"x" * BLOCK_SIZE)
+        os.utime(self.output, ns=(1, 1))  # Garante um mtime diferente do registrado
+
+        rebuild, store = self.rebuild(self.blocks)
+        self.assertEqual(sorted(store.reads), list(range(TOTAL_BLOCKS)))
+        self.assertTrue(rebuild.finish())
+        self.assertEqual(self.read_output(), self.content)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import socket
+import tempfile
+import time
+import unittest
+
+from connection_pool import ConnectionPool
+from file_manager import FileManager
+from seeder import SeederWorkers
+
+BLOCK_SIZE = 1024
+TOTAL_BLOCKS = 40
+INFO_HASH = b"s" * 20
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@unittest.skipUnless(hasattr(socket, "SO_REUSEPORT"), "SO_REUSEPORT indisponível")
+class SeederWorkersTest(unittest.TestCase):
+    def test_workers_started_right_after_last_save_serve_every_block(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        file_manager = FileManager("seed", storage="single", block_size=BLOCK_SIZE, total_blocks=TOTAL_BLOCKS,
+                                   file_size=BLOCK_SIZE * TOTAL_BLOCKS, info_hash=INFO_HASH,
+                                   directory=os.path.join(tmp.name, "seed"))
+        blocks = [os.urandom(BLOCK_SIZE) for _ in range(TOTAL_BLOCKS)]
+        for block_id, data in enumerate(blocks):
+            file_manager.save_block(block_id, data)
+
+        # Sem esperar o diário do índice ir para o disco: os workers abrem o armazenamento na hora
+        port = free_port()
+        workers = SeederWorkers("seed", port, [file_manager], count=1, host="127.0.0.1").start()
+        self.addCleanup(workers.stop)
+
+        pool = ConnectionPool()
+        self.addCleanup(pool.close_all)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                conn = pool.get("127.0.0.1", port, INFO_HASH)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        self.assertEqual(len(conn.request_list().result(5)), TOTAL_BLOCKS)
+        # O worker faz o próprio choking: o primeiro peer ocupa um slot livre e é atendido
+        for block_id, data in enumerate(blocks):
+            self.assertEqual(conn.request_block(block_id, block_size=BLOCK_SIZE).result(5), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
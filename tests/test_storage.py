@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from file_manager import split_and_distribute
+from storage import SingleFileStore
+
+BLOCK_SIZE = 1024
+
+
+class SplitAndDistributeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, "original.txt")
+        self.content = os.urandom(10 * BLOCK_SIZE + 100)
+        with open(self.source, "wb") as f:
+            f.write(self.content)
+        self.peers = os.path.join(self.tmp.name, "peers")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def full_seed_dirs(self):
+        # Diretórios dos peers que receberam todos os blocos
+        for name in sorted(os.listdir(self.peers)):
+            directory = os.path.join(self.peers, name)
+            if name.startswith("peer_"):
+                store = SingleFileStore(directory, BLOCK_SIZE, read_only=True)
+                complete = len(store.have) == 11
+                store.close()
+                if complete:
+                    yield directory
+
+    def test_full_seed_is_a_copy_by_default(self):
+        # Sem link_full_seeds, escrever no data.bin de um seeder completo não altera o original
+        split_and_distribute(self.source, self.peers, block_size=BLOCK_SIZE, num_peers=3, replication=3)
+        directory = next(self.full_seed_dirs())
+        self.assertFalse(os.path.samefile(self.source, os.path.join(directory, "data.bin")))
+        store = SingleFileStore(directory, BLOCK_SIZE)
+        store.write(0, b"x" * BLOCK_SIZE)
+        store.close()
+        with open(self.source, "rb") as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_link_full_seeds_shares_the_original(self):
+        split_and_distribute(self.source, self.peers, block_size=BLOCK_SIZE, num_peers=3, replication=3,
+                             link_full_seeds=True)
+        directory = next(self.full_seed_dirs())
+        self.assertTrue(os.path.samefile(self.source, os.path.join(directory, "data.bin")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+
+from tracker_server import TrackerServer
+
+INFO_HASH = "ab" * 20
+
+
+class HandleRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.tracker = TrackerServer(port=0)
+
+    def test_empty_request(self):
+        self.assertEqual(self.tracker.handle_request(""), b"ERROR Invalid command")
+        self.assertEqual(self.tracker.handle_request("   "), b"ERROR Invalid command")
+
+    def test_info_hash_only_request(self):
+        # Sem comando depois de retirar o info_hash: erro, e não IndexError
+        self.assertEqual(self.tracker.handle_request(f"info_hash={INFO_HASH}"), b"ERROR Invalid command")
+
+    def test_register_and_get_peers_with_info_hash(self):
+        self.assertTrue(self.tracker.handle_request(f"REGISTER p1 127.0.0.1 5000 info_hash={INFO_HASH}").startswith(b"OK"))
+        self.assertIn(b'"p1"', self.tracker.handle_request(f"GET_PEERS p2 5 info_hash={INFO_HASH}"))
+        self.assertEqual(self.tracker.handle_request("GET_PEERS p2 5"), b"[]")  # Swarm padrão, sem peers
+
+
+if __name__ == "__main__":
+    unittest.main()
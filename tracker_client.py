@@ -1,32 +1,199 @@
+import os
 import socket
 import json
+import time
+import logging
+import threading
+
+from protocol import NO_INFO_HASH
+from tracker_protocol import (
+    unpack_peers, build_connect, build_announce, COMPACT_PREFIX, CONNECT_RESPONSE, ANNOUNCE_RESPONSE,
+    ERROR_RESPONSE, ACTION_CONNECT, ACTION_ANNOUNCE, ACTION_ERROR, CONNECTION_ID_TTL, MAX_DATAGRAM,
+    EVENT_NONE, EVENT_STARTED, EVENT_COMPLETED, EVENT_STOPPED,
+)
+
+DEFAULT_INTERVAL = 30  # Intervalo de renovação usado se o tracker não informar outro
+UDP_TIMEOUT = 0.5      # Espera inicial por uma resposta UDP; dobra a cada retransmissão
+UDP_RETRIES = 4        # Retransmissões antes de desistir
+
+
+def recv_all(sock) -> bytes:
+    # Lê a resposta completa: o tracker fecha a conexão após responder
+    chunks = []
+    while chunk := sock.recv(4096):
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def swarm_option(info_hash) -> str:
+    # Opção que escolhe o swarm no tracker; omitida para o swarm padrão (compatível com trackers antigos)
+    return "" if info_hash == NO_INFO_HASH else f" info_hash={info_hash.hex()}"
+
 
 class TrackerClient:
     def __init__(self, host, port):
         # Armazena o host e a porta do servidor tracker
         self.host = host
         self.port = port
+        self.interval = DEFAULT_INTERVAL  # Intervalo de renovação informado pelo tracker
 
-    def register(self, peer_id, ip, port):
-        # Envia uma mensagem de registro para o tracker no formato:
-        # REGISTER <peer_id> <ip> <port>
+    def register(self, peer_id, ip, port, info_hash=NO_INFO_HASH):
+        # Envia uma mensagem de registro (ou renovação) para o tracker no formato:
+        # REGISTER <peer_id> <ip> <port> [info_hash=<hex>]
         try:
             with socket.create_connection((self.host, self.port), timeout=5) as s:
-                msg = f"REGISTER {peer_id} {ip} {port}"
+                msg = f"REGISTER {peer_id} {ip} {port}" + swarm_option(info_hash)
                 s.sendall(msg.encode())  # Envia a mensagem ao tracker
-                response = s.recv(1024).decode()  # Aguarda resposta
-                return response.strip() == "OK"  # Retorna True se registro for bem-sucedido
+                response = recv_all(s).decode().split()  # Aguarda resposta: OK [intervalo]
+                if response[:1] != ["OK"]:
+                    return False
+                if len(response) > 1:
+                    self.interval = float(response[1])
+                return True  # Registro bem-sucedido
         except:
             return False  # Retorna False se ocorrer erro na conexão
 
-    def get_peers(self, peer_id):
+    def get_peers(self, peer_id, numwant=None, compact=True, info_hash=NO_INFO_HASH):
         # Solicita ao tracker a lista de peers disponíveis, exceto ele mesmo
-        # Envia: GET_PEERS <peer_id>
+        # Envia: GET_PEERS <peer_id> [numwant] [compact] [info_hash=<hex>]
         try:
             with socket.create_connection((self.host, self.port), timeout=5) as s:
-                msg = f"GET_PEERS {peer_id}"
+                msg = (f"GET_PEERS {peer_id}" + (f" {numwant}" if numwant else "") + (" compact" if compact else "")
+                       + swarm_option(info_hash))
                 s.sendall(msg.encode())  # Envia a solicitação
-                response = s.recv(4096).decode()  # Recebe resposta em JSON
-                return json.loads(response)  # Converte JSON para lista de peers (dicionários)
-        except:
+                response = recv_all(s)
+                if compact:
+                    # Lista compacta: 6 bytes (IPv4 + porta) por peer
+                    if not response.startswith(COMPACT_PREFIX):
+                        logging.warning(f"Resposta inesperada do tracker: {response[:64]!r}")
+                        return []
+                    return unpack_peers(response[len(COMPACT_PREFIX):])
+                return json.loads(response.decode())  # Converte JSON para lista de peers (dicionários)
+        except Exception as e:
+            logging.warning(f"Falha ao consultar o tracker {self.host}:{self.port} - {e}")
             return []  # Retorna lista vazia em caso de erro
+
+    def completed(self, info_hash=NO_INFO_HASH):
+        # O protocolo TCP não informa o progresso do download; nada a anunciar
+        pass
+
+
+class UdpTrackerClient:
+    """
+    Cliente do anúncio UDP (no estilo do BEP 15): um handshake connect obtém
+    um connection_id, reaproveitado por CONNECTION_ID_TTL segundos, e cada
+    announce registra o peer e já devolve a lista compacta de peers em um
+    único datagrama. Pacotes perdidos são retransmitidos com espera dobrada.
+
+    Expõe a mesma interface de TrackerClient (register / get_peers). Cada
+    swarm (info_hash) guarda o próprio endereço anunciado e o restante.
+    """
+
+    def __init__(self, host, port, timeout: float = UDP_TIMEOUT, retries: int = UDP_RETRIES):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.interval = DEFAULT_INTERVAL
+        self.connection_id = None
+        self.connection_expires = 0.0
+        self.announce_address = {}  # info_hash -> (peer_id, ip, porta) do último register, repetido em get_peers
+        self.left = {}  # info_hash -> bytes que faltam (0 = seeder), informado em cada anúncio
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.lock = threading.Lock()  # Um pedido por vez no socket (announce periódico e consultas)
+
+    def _transact(self, build, expected_action: int) -> bytes:
+        # Envia um pedido e espera a resposta com o mesmo transaction_id, retransmitindo se necessário
+        timeout = self.timeout
+        for _ in range(self.retries + 1):
+            transaction_id = int.from_bytes(os.urandom(4), "big")
+            self.sock.sendto(build(transaction_id), (self.host, self.port))
+            deadline = time.monotonic() + timeout
+            while (remaining := deadline - time.monotonic()) > 0:
+                self.sock.settimeout(remaining)
+                try:
+                    data, _ = self.sock.recvfrom(MAX_DATAGRAM)
+                except socket.timeout:
+                    break
+                if len(data) < ERROR_RESPONSE.size:
+                    continue
+                action, received_id = ERROR_RESPONSE.unpack_from(data)
+                if received_id != transaction_id:
+                    continue  # Resposta atrasada de uma tentativa anterior
+                if action == ACTION_ERROR:
+                    raise ConnectionError(data[ERROR_RESPONSE.size:].decode(errors="replace"))
+                if action == expected_action:
+                    return data
+            timeout *= 2
+        raise TimeoutError(f"Tracker UDP {self.host}:{self.port} não respondeu")
+
+    def _connect(self) -> int:
+        if self.connection_id is None or time.monotonic() >= self.connection_expires:
+            data = self._transact(build_connect, ACTION_CONNECT)
+            _, _, self.connection_id = CONNECT_RESPONSE.unpack_from(data)
+            self.connection_expires = time.monotonic() + CONNECTION_ID_TTL
+        return self.connection_id
+
+    def announce(self, peer_id, ip, port, numwant=-1, event=EVENT_NONE, left=None, info_hash=NO_INFO_HASH):
+        """
+        Anuncia o peer no swarm e retorna a lista de outros peers (dicionários com host e porta).
+        """
+        left = self.left.get(info_hash, 1) if left is None else left
+        with self.lock:
+            for attempt in range(2):
+                connection_id = self._connect()
+                try:
+                    data = self._transact(
+                        lambda tid: build_announce(connection_id, tid, peer_id, port, ip, numwant, left,
+                                                   event=event, info_hash=info_hash),
+                        ACTION_ANNOUNCE,
+                    )
+                    break
+                except ConnectionError:
+                    if attempt:
+                        raise
+                    # connection_id expirou no tracker: obtém outro e tenta de novo
+                    self.connection_id = None
+        _, _, interval, _, _ = ANNOUNCE_RESPONSE.unpack_from(data)
+        self.interval = interval or DEFAULT_INTERVAL
+        return unpack_peers(data[ANNOUNCE_RESPONSE.size:])
+
+    def register(self, peer_id, ip, port, info_hash=NO_INFO_HASH):
+        try:
+            event = EVENT_STARTED if info_hash not in self.announce_address else EVENT_NONE
+            self.announce_address[info_hash] = (peer_id, ip, port)
+            self.announce(peer_id, ip, port, numwant=0, event=event, info_hash=info_hash)
+            return True
+        except Exception as e:
+            logging.warning(f"Falha no anúncio UDP para {self.host}:{self.port} - {e}")
+            return False
+
+    def get_peers(self, peer_id, numwant=None, info_hash=NO_INFO_HASH):
+        # O anúncio UDP registra e devolve peers de uma vez; requer um register anterior no swarm
+        if info_hash not in self.announce_address:
+            return []
+        _, ip, port = self.announce_address[info_hash]
+        try:
+            return self.announce(peer_id, ip, port, numwant=numwant if numwant else -1, info_hash=info_hash)
+        except Exception as e:
+            logging.warning(f"Falha no anúncio UDP para {self.host}:{self.port} - {e}")
+            return []
+
+    def completed(self, info_hash=NO_INFO_HASH):
+        # Passa a se anunciar como seeder do swarm (restante = 0)
+        self.left[info_hash] = 0
+        if info_hash in self.announce_address:
+            peer_id, ip, port = self.announce_address[info_hash]
+            try:
+                self.announce(peer_id, ip, port, numwant=0, event=EVENT_COMPLETED, info_hash=info_hash)
+            except Exception as e:
+                logging.warning(f"Falha no anúncio UDP para {self.host}:{self.port} - {e}")
+
+    def stop(self):
+        # Avisa o tracker que o peer está saindo de todos os swarms
+        for info_hash, (peer_id, ip, port) in list(self.announce_address.items()):
+            try:
+                self.announce(peer_id, ip, port, numwant=0, event=EVENT_STOPPED, info_hash=info_hash)
+            except Exception:
+                pass
+        self.sock.close()
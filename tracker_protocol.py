@@ -0,0 +1,115 @@
+import os
+import time
+import socket
+import struct
+import hashlib
+from typing import List, Optional, Tuple
+
+from protocol import NO_INFO_HASH
+
+# ----------------------
+# Lista compacta de peers (no estilo do BEP 23)
+# ----------------------
+# Cada peer ocupa 6 bytes: IPv4 (4B) + porta (2B), em ordem de rede. Uma
+# resposta com 200 peers cabe em 1200 bytes, contra ~12 KB em JSON.
+COMPACT_PEER = struct.Struct("!4sH")
+COMPACT_PREFIX = b"PEERS "  # Prefixo da resposta compacta via TCP (distingue de "ERROR ...")
+
+
+def pack_peer(host: str, port: int) -> Optional[bytes]:
+    # Codifica um peer em 6 bytes; retorna None se o host não for um IPv4 literal
+    try:
+        return COMPACT_PEER.pack(socket.inet_aton(host), port)
+    except (OSError, struct.error):
+        return None
+
+
+def unpack_peers(data: bytes) -> List[dict]:
+    # Decodifica uma lista compacta no mesmo formato de dicionários usado pela resposta JSON
+    peers = []
+    usable = len(data) - len(data) % COMPACT_PEER.size
+    for raw_ip, port in COMPACT_PEER.iter_unpack(data[:usable]):
+        host = socket.inet_ntoa(raw_ip)
+        peers.append({"peer_id": f"{host}:{port}", "host": host, "port": port})
+    return peers
+
+
+# ----------------------
+# Anúncio via UDP (no estilo do BEP 15)
+# ----------------------
+# connect:   connection_id mágico (8B) | ação=0 (4B) | transaction_id (4B)
+#         -> ação=0 | transaction_id | connection_id (8B)
+# announce:  connection_id | ação=1 | transaction_id | info_hash (20B) | peer_id (20B)
+#            | baixado (8B) | restante (8B) | enviado (8B) | evento (4B) | ip (4B)
+#            | chave (4B) | num_want (4B, -1 = padrão) | porta (2B)
+#         -> ação=1 | transaction_id | intervalo (4B) | leechers (4B) | seeders (4B) | peers compactos
+# erro:   -> ação=3 | transaction_id | mensagem
+UDP_PROTOCOL_ID = 0x41727101980
+ACTION_CONNECT = 0
+ACTION_ANNOUNCE = 1
+ACTION_ERROR = 3
+
+EVENT_NONE = 0
+EVENT_COMPLETED = 1
+EVENT_STARTED = 2
+EVENT_STOPPED = 3
+
+CONNECT_REQUEST = struct.Struct("!QII")
+CONNECT_RESPONSE = struct.Struct("!IIQ")
+ANNOUNCE_REQUEST = struct.Struct("!QII20s20sQQQI4sIiH")
+ANNOUNCE_RESPONSE = struct.Struct("!IIIII")
+ERROR_RESPONSE = struct.Struct("!II")
+
+CONNECTION_ID_TTL = 60  # Validade (s) de um connection_id emitido pelo tracker
+MAX_DATAGRAM = 8192     # Maior resposta UDP aceita pelo cliente
+
+
+def encode_peer_id(peer_id: str) -> bytes:
+    # O campo peer_id tem 20 bytes fixos: IDs curtos são completados com zeros
+    raw = peer_id.encode()
+    if len(raw) > 20:
+        raise ValueError(f"peer_id maior que 20 bytes: {peer_id}")
+    return raw.ljust(20, b"\0")
+
+
+def decode_peer_id(raw: bytes) -> str:
+    return raw.rstrip(b"\0").decode(errors="replace")
+
+
+def build_connect(transaction_id: int) -> bytes:
+    return CONNECT_REQUEST.pack(UDP_PROTOCOL_ID, ACTION_CONNECT, transaction_id)
+
+
+def build_announce(connection_id: int, transaction_id: int, peer_id: str, port: int, ip: str = "0.0.0.0",
+                   numwant: int = -1, left: int = 0, downloaded: int = 0, uploaded: int = 0,
+                   event: int = EVENT_NONE, info_hash: bytes = NO_INFO_HASH, key: int = 0) -> bytes:
+    return ANNOUNCE_REQUEST.pack(connection_id, ACTION_ANNOUNCE, transaction_id, info_hash, encode_peer_id(peer_id),
+                                 downloaded, left, uploaded, event, socket.inet_aton(ip), key, numwant, port)
+
+
+def build_error(transaction_id: int, message: str) -> bytes:
+    return ERROR_RESPONSE.pack(ACTION_ERROR, transaction_id) + message.encode()
+
+
+class ConnectionIds:
+    """
+    Emissão e validação de connection_ids sem guardar estado: o ID é um HMAC
+    do endereço do cliente e da janela de tempo atual, e o da janela anterior
+    continua aceito. Impede que um endereço forjado receba respostas de announce.
+    """
+
+    def __init__(self, ttl: float = CONNECTION_ID_TTL, secret: Optional[bytes] = None):
+        self.ttl = ttl
+        self.secret = secret or os.urandom(16)
+
+    def _make(self, addr: Tuple[str, int], window: int) -> int:
+        # BLAKE2 com chave já funciona como MAC, sem o custo extra do módulo hmac
+        digest = hashlib.blake2b(f"{addr[0]}:{addr[1]}:{window}".encode(), key=self.secret, digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def issue(self, addr: Tuple[str, int]) -> int:
+        return self._make(addr, int(time.monotonic() // self.ttl))
+
+    def valid(self, addr: Tuple[str, int], connection_id: int) -> bool:
+        window = int(time.monotonic() // self.ttl)
+        return connection_id in (self._make(addr, window), self._make(addr, window - 1))
@@ -1,80 +1,350 @@
-import socket
-import threading
+import argparse
+import asyncio
 import logging
 import random
 import json
+import time
+import socket
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from metrics import REGISTRY, MetricsServer
+from protocol import NO_INFO_HASH, INFO_HASH_SIZE
+from tracker_protocol import (
+    pack_peer, decode_peer_id, build_error, ConnectionIds, COMPACT_PREFIX, UDP_PROTOCOL_ID,
+    ACTION_CONNECT, ACTION_ANNOUNCE, EVENT_STOPPED, CONNECT_REQUEST, CONNECT_RESPONSE,
+    ANNOUNCE_REQUEST, ANNOUNCE_RESPONSE,
+)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+ANNOUNCE_INTERVAL = 120  # Intervalo (s) sugerido aos peers para renovar o registro (os peers novos chegam por PEX)
+PEER_TTL = 360           # Um peer que não renova o registro nesse tempo é descartado
+DEFAULT_NUMWANT = 5      # Quantidade de peers devolvida quando o pedido não informa numwant
+MAX_NUMWANT = 200        # Limite de peers devolvidos por pedido
+MAX_REQUEST = 1024       # Tamanho máximo de uma requisição
+METRICS_PORT = 8001      # Endpoint HTTP local das métricas (0 = desativado)
+
+ANNOUNCES = REGISTRY.counter("tracker_announces_total", "Anúncios (registros e renovações) recebidos", ["transport"])
+TCP_ANNOUNCES = ANNOUNCES.labels("tcp")
+UDP_ANNOUNCES = ANNOUNCES.labels("udp")
+PEER_REQUESTS = REGISTRY.counter("tracker_peer_requests_total", "Pedidos de lista de peers (GET_PEERS e anúncios UDP)",
+                                 ["transport"])
+TCP_PEER_REQUESTS = PEER_REQUESTS.labels("tcp")
+UDP_PEER_REQUESTS = PEER_REQUESTS.labels("udp")
+
+
+class PeerRegistry:
+    """
+    Conjunto de peers ativos com amostragem aleatória e expiração em O(1).
+
+    Os IDs ficam em uma lista com um dicionário de posições: a remoção troca
+    o elemento com o último da lista (swap-remove), e a amostragem sorteia
+    posições distintas da lista, sem montar a lista completa a cada pedido.
+    Os prazos ficam em um OrderedDict na ordem do último anúncio; como o TTL é
+    o mesmo para todos, os vencidos estão sempre no início.
+    """
+
+    def __init__(self, ttl: float = PEER_TTL):
+        self.ttl = ttl
+        self.ids: List[str] = []                        # IDs em posições sorteáveis
+        self.positions: Dict[str, int] = {}             # peer_id -> posição em self.ids
+        self.addresses: Dict[str, Tuple[str, int]] = {} # peer_id -> (host, porta)
+        self.compact: Dict[str, Optional[bytes]] = {}   # peer_id -> entrada compacta de 6 bytes (None se não for IPv4)
+        self.seeders = set()                            # Peers que informaram ter o arquivo completo
+        self.deadlines: "OrderedDict[str, float]" = OrderedDict()  # peer_id -> instante de expiração
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, peer_id: str) -> bool:
+        return peer_id in self.positions
+
+    def announce(self, peer_id: str, host: str, port: int, now: Optional[float] = None,
+                 complete: Optional[bool] = None) -> bool:
+        # Registra ou renova um peer; retorna True se ele é novo
+        now = time.monotonic() if now is None else now
+        is_new = peer_id not in self.positions
+        if is_new:
+            self.positions[peer_id] = len(self.ids)
+            self.ids.append(peer_id)
+        if self.addresses.get(peer_id) != (host, port):
+            self.addresses[peer_id] = (host, port)
+            self.compact[peer_id] = pack_peer(host, port)  # Pré-codificada: a resposta compacta só concatena
+        if complete:
+            self.seeders.add(peer_id)
+        elif complete is not None:
+            self.seeders.discard(peer_id)
+        self.deadlines[peer_id] = now + self.ttl
+        self.deadlines.move_to_end(peer_id)
+        return is_new
+
+    def remove(self, peer_id: str) -> None:
+        position = self.positions.pop(peer_id, None)
+        if position is None:
+            return
+        last = self.ids.pop()
+        if last != peer_id:
+            # Move o último elemento para a posição liberada
+            self.ids[position] = last
+            self.positions[last] = position
+        del self.addresses[peer_id]
+        del self.compact[peer_id]
+        self.seeders.discard(peer_id)
+        self.deadlines.pop(peer_id, None)
+
+    def expire(self, now: Optional[float] = None) -> int:
+        # Remove os peers cujo prazo venceu; retorna quantos saíram
+        now = time.monotonic() if now is None else now
+        expired = 0
+        while self.deadlines:
+            peer_id, deadline = next(iter(self.deadlines.items()))
+            if deadline > now:
+                break
+            self.remove(peer_id)
+            expired += 1
+        return expired
+
+    def sample(self, numwant: int, exclude: Optional[str] = None) -> List[str]:
+        # Sorteia até `numwant` peers distintos (sem o solicitante) em O(numwant): índices
+        # distintos sorteados de forma uniforme, sem percorrer a lista inteira
+        ids = self.ids
+        picked = [ids[i] for i in random.sample(range(len(ids)), min(numwant + 1, len(ids)))]
+        if exclude in self.positions:
+            picked = [peer_id for peer_id in picked if peer_id != exclude]
+        return picked[:numwant]
+
+    def sample_compact(self, numwant: int, exclude: Optional[str] = None) -> bytes:
+        # Mesma amostragem, já no formato compacto (6 bytes por peer IPv4)
+        compact = self.compact
+        return b"".join(filter(None, (compact[peer_id] for peer_id in self.sample(numwant, exclude))))
+
+
 class TrackerServer:
-    def __init__(self, host="0.0.0.0", port=8000):
+    def __init__(self, host="0.0.0.0", port=8000, ttl: float = PEER_TTL, interval: float = ANNOUNCE_INTERVAL):
         # Inicializa o servidor tracker com IP e porta definidos
         self.host = host
         self.port = port
-        self.peers = {}  # Dicionário que armazena os peers registrados: peer_id -> (host, port)
-        self.lock = threading.Lock()  # Trava para garantir acesso seguro em múltiplas threads
+        self.interval = interval
+        self.ttl = ttl
+        # Peers ativos de cada swarm (info_hash -> PeerRegistry); acessado apenas pela thread do event loop.
+        # Pedidos sem info_hash usam o swarm padrão (NO_INFO_HASH).
+        self.swarms: Dict[bytes, PeerRegistry] = {}
+        self.connection_ids = ConnectionIds()  # connection_ids dos anúncios UDP
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stopping: Optional[asyncio.Event] = None
+
+    @property
+    def peers(self) -> PeerRegistry:
+        # Swarm padrão (compatível com peers que não informam info_hash)
+        return self.registry(NO_INFO_HASH)
+
+    def registry(self, info_hash: bytes, create: bool = True) -> Optional[PeerRegistry]:
+        registry = self.swarms.get(info_hash)
+        if registry is None and create:
+            registry = self.swarms[info_hash] = PeerRegistry(self.ttl)
+        return registry
+
+    def expire(self) -> int:
+        # Expira os peers de todos os swarms e descarta os swarms que ficaram vazios
+        expired = 0
+        for info_hash, registry in list(self.swarms.items()):
+            expired += registry.expire()
+            if not len(registry):
+                del self.swarms[info_hash]
+        return expired
+
+    def register_metrics(self, registry=REGISTRY) -> None:
+        # Tamanho dos swarms, calculado só quando as métricas são consultadas
+        registry.gauge("tracker_swarms", "Swarms com peers ativos").set_function(lambda: len(self.swarms))
+        registry.gauge("tracker_peers", "Peers ativos por swarm", ["info_hash"]).set_function(
+            lambda: {info_hash.hex()[:8]: len(peers) for info_hash, peers in list(self.swarms.items())})
+        registry.gauge("tracker_seeders", "Seeders ativos por swarm", ["info_hash"]).set_function(
+            lambda: {info_hash.hex()[:8]: len(peers.seeders) for info_hash, peers in list(self.swarms.items())})
 
     def start(self):
-        # Inicia o servidor TCP e escuta conexões
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
-            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server.bind((self.host, self.port))
-            server.listen()
-            logging.info(f"[Tracker] Servidor escutando em {self.host}:{self.port}")
-            while True:
-                client_socket, addr = server.accept()
-                client_socket.settimeout(10)
-                # Cria uma nova thread para tratar a requisição do peer
-                threading.Thread(target=self.handle_peer, args=(client_socket, addr)).start()
-
-    def handle_peer(self, sock, addr):
+        # Inicia o event loop do tracker (bloqueia até stop())
+        asyncio.run(self.serve())
+
+    def stop(self):
+        # Pode ser chamado de qualquer thread
+        if self.loop is not None and self.stopping is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        server = await asyncio.start_server(self.handle_peer, self.host, self.port, reuse_address=True, backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        # Anúncios UDP (sem conexão) na mesma porta
+        transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: TrackerDatagramProtocol(self), local_addr=(self.host, self.port)
+        )
+        logging.info(f"[Tracker] Servidor escutando em {self.host}:{self.port} (TCP e UDP)")
+        expiry = asyncio.create_task(self.expire_loop())
+        async with server:
+            await self.stopping.wait()
+        expiry.cancel()
+        transport.close()
+
+    async def expire_loop(self):
+        # Remove periodicamente os peers que pararam de renovar o registro
+        while True:
+            await asyncio.sleep(max(1.0, self.ttl / 4))
+            expired = self.expire()
+            if expired:
+                active = sum(len(registry) for registry in self.swarms.values())
+                logging.info(f"[Tracker] {expired} peers expirados; {active} ativos em {len(self.swarms)} swarms")
+
+    async def handle_peer(self, reader, writer):
         # Lida com uma requisição vinda de um peer conectado
+        addr = writer.get_extra_info("peername")
         try:
-            with sock:
-                data = sock.recv(1024).decode().strip()
-                if not data:
-                    logging.warning(f"[Tracker] Conexão vazia de {addr}")
-                    return
-
-                # Comando para registrar peer: REGISTER <peer_id> <host> <port>
-                if data.startswith("REGISTER"):
-                    parts = data.split()
-                    if len(parts) != 4:
-                        sock.sendall(b"ERROR Invalid REGISTER format")
-                        return
-                    _, peer_id, host, port = parts
-                    with self.lock:
-                        self.peers[peer_id] = (host, int(port))  # Salva o peer no dicionário
-                    logging.info(f"[Tracker] Registrado {peer_id} em {host}:{port}")
-                    sock.sendall(b"OK")  # Resposta de sucesso
-
-                # Comando para obter lista de peers: GET_PEERS <peer_id>
-                elif data.startswith("GET_PEERS"):
-                    parts = data.split()
-                    if len(parts) != 2:
-                        sock.sendall(b"ERROR Invalid GET_PEERS format")
-                        return
-                    _, peer_id = parts
-                    with self.lock:
-                        # Filtra os peers removendo o próprio solicitante
-                        other_peers = [
-                            {"peer_id": pid, "host": host, "port": port}
-                            for pid, (host, port) in self.peers.items()
-                            if pid != peer_id
-                        ]
-                        # Retorna até 5 peers aleatórios
-                        sample = random.sample(other_peers, min(5, len(other_peers)))
-                    sock.sendall(json.dumps(sample).encode())  # Envia a lista em formato JSON
-
-                else:
-                    # Comando não reconhecido
-                    logging.warning(f"[Tracker] Comando inválido de {addr}: {data}")
-                    sock.sendall(b"ERROR Invalid command")
+            data = (await asyncio.wait_for(reader.read(MAX_REQUEST), timeout=10)).decode().strip()
+            if not data:
+                logging.warning(f"[Tracker] Conexão vazia de {addr}")
+                return
+            writer.write(self.handle_request(data, addr))
+            await writer.drain()
         except Exception as e:
             # Caso ocorra algum erro no tratamento da requisição
             logging.warning(f"[Tracker] Erro com cliente {addr}: {e}")
+        finally:
+            writer.close()
+
+    def handle_request(self, data: str, addr=None) -> bytes:
+        parts = data.split()
+
+        # Opção comum aos comandos: info_hash=<40 hex> escolhe o swarm (padrão: swarm sem info_hash)
+        info_hash = NO_INFO_HASH
+        options = [part for part in parts if part.startswith("info_hash=")]
+        if options:
+            try:
+                info_hash = bytes.fromhex(options[-1][len("info_hash="):])
+            except ValueError:
+                info_hash = b""
+            if len(info_hash) != INFO_HASH_SIZE:
+                return b"ERROR Invalid info_hash"
+            parts = [part for part in parts if not part.startswith("info_hash=")]
+
+        if not parts:
+            # Requisição vazia (ou só com info_hash=)
+            logging.warning(f"[Tracker] Comando inválido de {addr}: {data}")
+            return b"ERROR Invalid command"
+
+        # Comando para registrar (ou renovar) um peer: REGISTER <peer_id> <host> <port> [info_hash=...]
+        if parts[0] == "REGISTER":
+            if len(parts) != 4 or not parts[3].isdigit():
+                return b"ERROR Invalid REGISTER format"
+            _, peer_id, host, port = parts
+            TCP_ANNOUNCES.inc()
+            if self.registry(info_hash).announce(peer_id, host, int(port)):
+                logging.info(f"[Tracker] Registrado {peer_id} em {host}:{port} (swarm {info_hash.hex()[:8]})")
+            # Resposta de sucesso, com o intervalo sugerido para renovar o registro
+            return f"OK {self.interval:g}".encode()
+
+        # Comando para obter lista de peers: GET_PEERS <peer_id> [numwant] [compact] [info_hash=...]
+        if parts[0] == "GET_PEERS":
+            compact = parts[-1] == "compact"
+            if compact:
+                parts = parts[:-1]
+            if len(parts) not in (2, 3) or (len(parts) == 3 and not parts[2].isdigit()):
+                return b"ERROR Invalid GET_PEERS format"
+            peer_id = parts[1]
+            TCP_PEER_REQUESTS.inc()
+            numwant = min(int(parts[2]), MAX_NUMWANT) if len(parts) == 3 else DEFAULT_NUMWANT
+            registry = self.registry(info_hash, create=False) or PeerRegistry(self.ttl)
+            registry.expire()
+            if compact:
+                # 6 bytes por peer (IPv4 + porta), após o prefixo "PEERS "
+                return COMPACT_PREFIX + registry.sample_compact(numwant, exclude=peer_id)
+            addresses = registry.addresses
+            sample = [
+                {"peer_id": pid, "host": addresses[pid][0], "port": addresses[pid][1]}
+                for pid in registry.sample(numwant, exclude=peer_id)
+            ]
+            return json.dumps(sample).encode()  # Envia a lista em formato JSON
+
+        # Comando não reconhecido
+        logging.warning(f"[Tracker] Comando inválido de {addr}: {data}")
+        return b"ERROR Invalid command"
+
+    def handle_datagram(self, data: bytes, addr: Tuple[str, int]) -> Optional[bytes]:
+        """
+        Trata um pacote UDP (connect ou announce, no estilo do BEP 15) e
+        retorna a resposta, ou None para pacotes que devem ser ignorados.
+        """
+        if len(data) < CONNECT_REQUEST.size:
+            return None
+        connection_id, action, transaction_id = CONNECT_REQUEST.unpack_from(data)
+
+        if action == ACTION_CONNECT:
+            if connection_id != UDP_PROTOCOL_ID:
+                return None
+            return CONNECT_RESPONSE.pack(ACTION_CONNECT, transaction_id, self.connection_ids.issue(addr))
+
+        if action != ACTION_ANNOUNCE:
+            return build_error(transaction_id, "Invalid action")
+        if len(data) < ANNOUNCE_REQUEST.size:
+            return build_error(transaction_id, "Invalid ANNOUNCE format")
+        if not self.connection_ids.valid(addr, connection_id):
+            return build_error(transaction_id, "Invalid connection id")
+
+        (_, _, _, info_hash, raw_peer_id, _downloaded, left, _uploaded, event,
+         raw_ip, _key, numwant, port) = ANNOUNCE_REQUEST.unpack_from(data)
+        peer_id = decode_peer_id(raw_peer_id)
+        UDP_ANNOUNCES.inc()
+        if event == EVENT_STOPPED:
+            registry = self.registry(info_hash, create=False)
+            if registry is not None:
+                registry.remove(peer_id)
+            return ANNOUNCE_RESPONSE.pack(ACTION_ANNOUNCE, transaction_id, int(self.interval), 0, 0)
+
+        # IP 0 = usar o endereço de origem do pacote
+        host = socket.inet_ntoa(raw_ip) if raw_ip != bytes(4) else addr[0]
+        registry = self.registry(info_hash)
+        if registry.announce(peer_id, host, port, complete=left == 0):
+            logging.info(f"[Tracker] Registrado {peer_id} em {host}:{port} (UDP, swarm {info_hash.hex()[:8]})")
+        registry.expire()
+        UDP_PEER_REQUESTS.inc()
+        numwant = DEFAULT_NUMWANT if numwant < 0 else min(numwant, MAX_NUMWANT)
+        seeders = len(registry.seeders)
+        return ANNOUNCE_RESPONSE.pack(
+            ACTION_ANNOUNCE, transaction_id, int(self.interval), len(registry) - seeders, seeders
+        ) + registry.sample_compact(numwant, exclude=peer_id)
+
+
+class TrackerDatagramProtocol(asyncio.DatagramProtocol):
+    # Recebe os anúncios UDP e responde pelo mesmo transporte
+    def __init__(self, tracker: TrackerServer):
+        self.tracker = tracker
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            response = self.tracker.handle_datagram(data, addr)
+        except Exception as e:
+            logging.warning(f"[Tracker] Erro com pacote UDP de {addr}: {e}")
+            return
+        if response is not None:
+            self.transport.sendto(response, addr)
+
 
 if __name__ == "__main__":
     # Inicia o servidor quando o script é executado diretamente
-    tracker = TrackerServer()
+    parser = argparse.ArgumentParser(description="Tracker da rede P2P")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="0 = desativado")
+    args = parser.parse_args()
+    tracker = TrackerServer(port=args.port)
+    if args.metrics_port:
+        tracker.register_metrics()
+        try:
+            metrics = MetricsServer(args.metrics_port).start()
+            logging.info(f"[Tracker] Métricas em http://{metrics.host}:{metrics.port}/metrics")
+        except OSError as e:
+            logging.warning(f"[Tracker] Não foi possível abrir o endpoint de métricas: {e}")
     tracker.start()